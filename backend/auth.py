@@ -1,6 +1,11 @@
 import os
 import jwt
-import requests
+import asyncio
+import hashlib
+import httpx
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -17,6 +22,73 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
+# Number of verified tokens remembered between requests (0 disables the cache)
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024"))
+
+# Supabase Auth API used for server-side user verification
+SUPABASE_AUTH_URL = os.getenv("SUPABASE_AUTH_URL") or f"{SUPABASE_URL}/auth/v1"
+SUPABASE_AUTH_TIMEOUT = float(os.getenv("SUPABASE_AUTH_TIMEOUT", "3"))
+SUPABASE_AUTH_MAX_CONNECTIONS = int(os.getenv("SUPABASE_AUTH_MAX_CONNECTIONS", "20"))
+# Seconds a successful verification is reused (0 disables)
+AUTH_VERIFY_TTL = float(os.getenv("AUTH_VERIFY_TTL", "30"))
+
+class VerifiedTokenCache:
+    """
+    LRU of tokens that passed verification, keyed by the token's SHA-256
+    (the token itself is never stored). Entries expire at the token's exp
+    claim, so an expired token is verified again and rejected.
+    """
+    
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # token hash -> (user, exp)
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+    
+    def get(self, token: str) -> Optional[dict]:
+        if self.max_entries <= 0:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, exp = entry
+            if exp <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+    
+    def put(self, token: str, user: dict) -> None:
+        exp = user.get("exp")
+        # Tokens without an expiry are never cached
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
 class SupabaseAuth:
     def __init__(self):
         if not SUPABASE_URL or not SUPABASE_JWT_SECRET:
@@ -26,6 +98,14 @@ class SupabaseAuth:
         self.jwt_secret = SUPABASE_JWT_SECRET
         self.service_key = SUPABASE_SERVICE_KEY
         self._jwks_cache = None
+        self.token_cache = VerifiedTokenCache()
+        
+        # Keep-alive connection pool for the Auth API, created on first use
+        self._http: Optional[httpx.AsyncClient] = None
+        self._verified = OrderedDict()  # token hash -> (user, expires_at)
+        self._verifying = {}  # token hash -> task shared by concurrent callers
+        self.verify_hits = 0
+        self.verify_calls = 0
     
     def verify_jwt_token(self, token: str) -> dict:
         """
@@ -53,10 +133,18 @@ class SupabaseAuth:
     def get_user_from_token(self, token: str) -> dict:
         """
         Extract user information from a valid JWT token
+        
+        Tokens verified before are served from the token cache until they
+        expire. The returned dict is shared between requests and must not
+        be modified.
         """
+        user = self.token_cache.get(token)
+        if user is not None:
+            return user
+        
         payload = self.verify_jwt_token(token)
         
-        return {
+        user = {
             "id": payload.get("sub"),
             "email": payload.get("email"),
             "role": payload.get("role"),
@@ -67,39 +155,89 @@ class SupabaseAuth:
             "user_metadata": payload.get("user_metadata", {}),
             "app_metadata": payload.get("app_metadata", {})
         }
+        self.token_cache.put(token, user)
+        return user
+    
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=SUPABASE_AUTH_URL,
+                timeout=httpx.Timeout(SUPABASE_AUTH_TIMEOUT, connect=min(SUPABASE_AUTH_TIMEOUT, 2.0)),
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_AUTH_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_AUTH_MAX_CONNECTIONS
+                ),
+                headers={"apikey": self.service_key or ""}
+            )
+        return self._http
+    
+    async def aclose(self) -> None:
+        """Close the Auth API connection pool"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
     
     async def verify_user_with_supabase(self, token: str) -> dict:
         """
         Verify user with Supabase API (optional additional verification)
+        
+        Successful verifications are reused for AUTH_VERIFY_TTL seconds and
+        concurrent verifications of the same token share one API call.
         """
+        key = VerifiedTokenCache._key(token)
+        entry = self._verified.get(key)
+        if entry is not None:
+            user, expires_at = entry
+            if expires_at > time.monotonic():
+                self.verify_hits += 1
+                return user
+            del self._verified[key]
+        
+        task = self._verifying.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_user(token))
+            self._verifying[key] = task
+            task.add_done_callback(lambda _: self._verifying.pop(key, None))
+        else:
+            self.verify_hits += 1
+        # One caller going away must not cancel the call the others wait for
+        user = await asyncio.shield(task)
+        
+        if AUTH_VERIFY_TTL > 0 and key not in self._verified:
+            self._verified[key] = (user, time.monotonic() + AUTH_VERIFY_TTL)
+            while len(self._verified) > max(AUTH_TOKEN_CACHE_SIZE, 1):
+                self._verified.popitem(last=False)
+        return user
+    
+    async def _fetch_user(self, token: str) -> dict:
+        self.verify_calls += 1
         try:
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "apikey": self.service_key or ""
-            }
-            
-            response = requests.get(
-                f"{self.supabase_url}/auth/v1/user",
-                headers=headers,
-                timeout=10
+            response = await self._http_client().get(
+                "/user",
+                headers={"Authorization": f"Bearer {token}"}
             )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(status_code=401, detail="User verification failed")
-                
-        except requests.RequestException as e:
-            logger.error(f"Supabase API error: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.error(f"Supabase API error: {type(e).__name__} {str(e)}")
             raise HTTPException(status_code=503, detail="Authentication service unavailable")
+        
+        if response.status_code == 200:
+            return response.json()
+        raise HTTPException(status_code=401, detail="User verification failed")
 
 # Initialize the auth instance
 supabase_auth = SupabaseAuth()
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """
     FastAPI dependency to get the current authenticated user
+    
+    Reuses the user AuthMiddleware verified for this request; the token is
+    only verified here when the middleware could not (e.g. it is invalid,
+    so the proper 401 is raised).
     """
+    user = request.scope.get("user")
+    if user is not None:
+        return user
     try:
         token = credentials.credentials
         user = supabase_auth.get_user_from_token(token)
@@ -114,6 +252,9 @@ def get_optional_user(request: Request) -> Optional[dict]:
     """
     FastAPI dependency to get the current user if authenticated (optional)
     """
+    user = request.scope.get("user")
+    if user is not None:
+        return user
     try:
         auth_header = request.headers.get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
@@ -0,0 +1,101 @@
+"""
+Benchmark the authentication overhead of a protected request.
+
+Compares the old path (AuthMiddleware and get_current_user each verifying
+the bearer token) with verifying once per request and reusing the result,
+both for a token seen for the first time and for one already in the
+verified token cache.
+
+Run from the backend directory:
+
+    python benchmarks/auth_benchmark.py
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "benchmark-secret-benchmark-secret")
+
+import jwt
+from fastapi.security import HTTPAuthorizationCredentials
+from starlette.requests import Request
+
+from auth import supabase_auth, get_optional_user, get_current_user, SUPABASE_JWT_SECRET
+
+REPEAT = 20000
+
+
+def make_token(subject: str) -> str:
+    payload = {
+        "sub": subject,
+        "email": f"{subject}@example.com",
+        "aud": "authenticated",
+        "role": "authenticated",
+        "iat": int(time.time()),
+        "exp": int(time.time()) + 3600,
+        "user_metadata": {"name": subject},
+    }
+    return jwt.encode(payload, SUPABASE_JWT_SECRET, algorithm="HS256")
+
+
+def scope_for(token: str) -> dict:
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": "/notes",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+    }
+
+
+def before(token: str) -> None:
+    """Middleware and dependency each verify the token"""
+    scope = scope_for(token)
+    user = get_optional_user(Request(scope))
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    # The dependency did not look at what the middleware found
+    get_current_user(Request(scope_for(token)), credentials)
+    assert user is not None
+
+
+def after(token: str) -> None:
+    """Middleware verifies (or hits the cache) and the dependency reuses it"""
+    scope = scope_for(token)
+    scope["user"] = get_optional_user(Request(scope))
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    get_current_user(Request(scope), credentials)
+
+
+def measure(label: str, fn, tokens) -> float:
+    start = time.perf_counter()
+    for token in tokens:
+        fn(token)
+    seconds = (time.perf_counter() - start) / len(tokens)
+    print(f"  {label:<40} {seconds * 1e6:8.1f} us/request")
+    return seconds
+
+
+def main() -> int:
+    cache = supabase_auth.token_cache
+    same_token = [make_token("user")] * REPEAT
+    fresh_tokens = [make_token(f"user{i}") for i in range(REPEAT)]
+
+    print(f"Auth overhead per request ({REPEAT} requests):")
+    max_entries = cache.max_entries
+    cache.max_entries = 0
+    baseline = measure("before: verified twice", before, same_token)
+    cache.max_entries = max_entries
+
+    cold = measure("after: new token, verified once", after, fresh_tokens)
+    warm = measure("after: cached token", after, same_token)
+
+    print(f"  speed-up: {baseline / cold:.1f}x for new tokens, {baseline / warm:.1f}x for cached tokens")
+    print(f"  cache: {cache.stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
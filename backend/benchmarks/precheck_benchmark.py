@@ -0,0 +1,112 @@
+"""
+Benchmark the structural pre-check against a corpus of broken documents.
+
+Every document in the broken corpus must be rejected, every valid document
+must pass (advisory diagnostics, which only annotate an engine failure,
+are allowed), and the run reports the per-document cost so it can be compared with
+the time a TeX engine needs to start up and fail on the same input.
+
+Run from the backend directory:
+
+    python benchmarks/precheck_benchmark.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from latex_precheck import check_structure
+
+PREAMBLE = "\\documentclass{article}\n\\usepackage{amsmath}\n\\newcommand{\\bi}{\\begin{itemize}}\n"
+
+BROKEN = {
+    "unclosed brace": "\\begin{document}\n\\textbf{bold\n\\end{document}\n",
+    "extra closing brace": "\\begin{document}\nText}\n\\end{document}\n",
+    "mismatched environment": "\\begin{document}\n\\begin{itemize}\n\\item A\n\\end{enumerate}\n\\end{document}\n",
+    "unclosed environment": "\\begin{document}\n\\begin{center}\nText\n\\end{document}\n",
+    "stray end": "\\begin{document}\nText\n\\end{figure}\n\\end{document}\n",
+    "unclosed inline math": "\\begin{document}\nLet $x = 1 be given.\n\nNext paragraph.\n\\end{document}\n",
+    "unclosed display math": "\\begin{document}\n\\[ x^2\n\\end{document}\n",
+    "mismatched math": "\\begin{document}\n\\( x \\]\n\\end{document}\n",
+    "unclosed verbatim": "\\begin{document}\n\\begin{verbatim}\n{ $ }\n\\end{document}\n",
+}
+
+VALID = {
+    "escapes and comments": "\\begin{document}\n\\{ \\} \\$ 50\\% % stray { $ \\begin{x}\n\\end{document}\n",
+    "verbatim": "\\begin{document}\n\\begin{verbatim}\n{ $ \\begin{x}\n\\end{verbatim}\n\\verb|{$|\n\\end{document}\n",
+    "nested math": "\\begin{document}\n$a \\text{ if $b$ }$ and $$c$$ and \\[ d \\]\n\\end{document}\n",
+    "definitions": "\\begin{document}\n\\newenvironment{box2}{\\begin{center}}{\\end{center}}\n\\begin{box2}x\\end{box2}\n\\end{document}\n",
+    "url with percent": "\\begin{document}\n\\url{http://x/a%20b}\n\\end{document}\n",
+    "delimited path": "\\begin{document}\n\\path|C:\\{x|\n\\end{document}\n",
+    "lstinline dollar": "\\begin{document}\n\\lstinline|a$b|\n\\end{document}\n",
+    "lstinline brace": "\\begin{document}\n\\lstinline{a{b}\n\\end{document}\n",
+    "mintinline": "\\begin{document}\n\\mintinline{python}{x = {1: \"$\"}}\n\\end{document}\n",
+    "iffalse": "\\begin{document}\n\\iffalse { \\fi\n\\end{document}\n",
+    "adjacent inline math": "\\begin{document}\n$x$$y$\n\\end{document}\n",
+    "tikz path": "\\begin{document}\n\\path[draw] (0,0) node {$a$} -- (1,1);\n\\end{document}\n",
+    "macro closes environment": "\\newcommand{\\ee}{\\end{equation}}\n\\begin{document}\n\\begin{equation} x \\ee\n\\end{document}\n",
+    "string escape": "\\begin{document}\n\\texttt{\\string\\end{itemize}}\n\\end{document}\n",
+    "open group": "\\begin{document}\n{\\bfseries x\n\\end{document}\n",
+    "short verbatim": "\\begin{document}\n\\MakeShortVerb{\\|}\n|{$|\n\\end{document}\n",
+}
+
+
+def large_document(sections: int) -> str:
+    """A realistic valid document of roughly sections * 600 bytes"""
+    body = []
+    for i in range(sections):
+        body.append(
+            f"\\section{{Section {i}}}\\label{{sec:{i}}}\n"
+            f"Some text with $x_{{{i}}} = \\frac{{a}}{{b}}$ and a reference to \\ref{{sec:{i}}}. % comment\n"
+            "\\begin{align}\n  a &= b + c \\\\\n  d &= e\n\\end{align}\n"
+            "\\begin{itemize}\n  \\item First \\textbf{item}\n  \\item Second \\emph{item}\n\\end{itemize}\n\n"
+        )
+    return PREAMBLE + "\\begin{document}\n" + "".join(body) + "\\end{document}\n"
+
+
+def measure(source: str, repeat: int) -> float:
+    """Average seconds per check"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        check_structure(source)
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> int:
+    failures = 0
+
+    print("Broken corpus:")
+    for name, body in BROKEN.items():
+        source = PREAMBLE + body
+        diagnostics = check_structure(source)
+        errors = [diagnostic for diagnostic in diagnostics if not diagnostic.advisory]
+        if not errors:
+            failures += 1
+        first = str(errors[0]) if errors else "NOT REJECTED"
+        print(f"  {name:<24} {measure(source, 2000) * 1e6:8.1f} us  {first}")
+
+    print("Valid corpus:")
+    for name, body in VALID.items():
+        source = PREAMBLE + body
+        diagnostics = check_structure(source)
+        errors = [diagnostic for diagnostic in diagnostics if not diagnostic.advisory]
+        if errors:
+            failures += 1
+        result = f"FALSE POSITIVE: {errors[0]}" if errors else "ok" if not diagnostics else f"ok (advisory: {diagnostics[0]})"
+        print(f"  {name:<24} {measure(source, 2000) * 1e6:8.1f} us  {result}")
+
+    print("Scaling (valid documents):")
+    for sections in (10, 100, 1000):
+        source = large_document(sections)
+        seconds = measure(source, max(1, 2000 // sections))
+        print(f"  {len(source) / 1024:8.1f} KB  {seconds * 1e3:8.2f} ms  {len(source) / seconds / 1e6:6.1f} MB/s")
+
+    if failures:
+        print(f"{failures} document(s) were classified incorrectly")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
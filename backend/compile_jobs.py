@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Tuple
+import logging
+
+from compiler import compiler, compile_latex_document, CompileResult, LaTeXCompilationError, LaTeXResourceLimitError, MODE_FINAL
+from compile_queue import compile_pool, CompileQueueFullError, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Compile job configuration
+COMPILE_JOB_TTL = int(os.getenv("COMPILE_JOB_TTL", "600"))
+COMPILE_JOBS_MAX = int(os.getenv("COMPILE_JOBS_MAX", "256"))
+
+# Seconds between SSE keep-alive comments
+SSE_KEEPALIVE = 15
+
+
+class CompileJob:
+    """
+    A compile running in the background, with its phase events.
+
+    Events are appended on the event loop (worker threads hand them over
+    with call_soon_threadsafe) and every append wakes the SSE listeners.
+    """
+
+    def __init__(self, user_id: str, mode: str = MODE_FINAL):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.mode = mode
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.events = []
+        self.result: Optional[CompileResult] = None
+        self.error: Optional[str] = None
+        self.error_status: Optional[int] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def add_event(self, phase: str, details: Optional[dict] = None) -> None:
+        if phase != "queued" and self.status == "queued":
+            self.status = "running"
+        self.events.append({"phase": phase, "time": time.time(), **(details or {})})
+        # Wake everyone waiting for the next event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def to_dict(self) -> dict:
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "mode": self.mode,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "events": self.events,
+        }
+        if self.result is not None:
+            job.update({
+                "engine": self.result.engine,
+                "passes": self.result.passes,
+                "cached": self.result.cached,
+                "pdf_size": self.result.pdf_size,
+                "etag": self.result.pdf.etag,
+            })
+        if self.error is not None:
+            job["error"] = self.error
+        return job
+
+
+class CompileJobManager:
+    """
+    Tracks background compile jobs so a single compile serves both status
+    polling and the PDF download. Finished jobs expire after COMPILE_JOB_TTL
+    seconds and at most COMPILE_JOBS_MAX jobs are kept.
+    """
+
+    def __init__(self, ttl: int = COMPILE_JOB_TTL, max_jobs: int = COMPILE_JOBS_MAX):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._tasks = set()
+
+    def _purge(self) -> None:
+        """Drop expired jobs, then the oldest finished ones beyond max_jobs"""
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done and now - job.finished_at > self.ttl]:
+            del self._jobs[job_id]
+
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done]:
+            if len(self._jobs) < self.max_jobs:
+                break
+            del self._jobs[job_id]
+
+    def create(
+        self,
+        user_id: str,
+        latex_content: str,
+        workspace: Optional[Tuple[str, str]] = None,
+        priority: str = PRIORITY_BULK,
+        mode: str = MODE_FINAL,
+        files: Optional[Dict[str, str]] = None
+    ) -> CompileJob:
+        """
+        Queue a compile and return its job immediately
+
+        Raises:
+            LaTeXCompilationError: If the source fails validation
+            CompileQueueFullError: If the compile queue has no room
+        """
+        compiler.validate(latex_content, files)
+        compile_pool.check_capacity(user_id)
+        self._purge()
+
+        job = CompileJob(user_id, mode)
+        self._jobs[job.id] = job
+        job.add_event("queued")
+
+        task = asyncio.ensure_future(self._run(job, latex_content, workspace, priority, files))
+        # Keep a reference so the task isn't garbage collected mid-run
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(
+        self,
+        job: CompileJob,
+        latex_content: str,
+        workspace: Optional[Tuple[str, str]],
+        priority: str,
+        files: Optional[Dict[str, str]] = None
+    ) -> None:
+        loop = asyncio.get_running_loop()
+
+        def on_progress(phase: str, details: dict) -> None:
+            # Called on a compile worker thread
+            loop.call_soon_threadsafe(job.add_event, phase, details)
+
+        try:
+            # Cache hits finish without waiting for a worker
+            job.result = await loop.run_in_executor(None, compiler.lookup, latex_content, job.mode, files)
+            if job.result is None:
+                job.result = await compile_pool.submit_shared(
+                    compiler.cache_key(latex_content, job.mode, files),
+                    compile_latex_document,
+                    latex_content,
+                    workspace=workspace,
+                    on_progress=on_progress,
+                    mode=job.mode,
+                    files=files,
+                    user_id=job.user_id,
+                    priority=priority
+                )
+            job.status = "succeeded"
+            job.add_event("done", {"engine": job.result.engine, "passes": job.result.passes})
+        except LaTeXResourceLimitError as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.error_status = 422
+            job.add_event("failed", {"error": job.error, "limit": e.limit})
+        except LaTeXCompilationError as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.error_status = 400
+            job.add_event("failed", {"error": job.error})
+        except CompileQueueFullError as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.error_status = 503
+            job.add_event("failed", {"error": job.error})
+        except Exception as e:
+            logger.error(f"Unexpected error in compile job {job.id}: {str(e)}")
+            job.status = "failed"
+            job.error = "Internal server error during compilation"
+            job.error_status = 500
+            job.add_event("failed", {"error": job.error})
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str, user_id: str) -> Optional[CompileJob]:
+        """Return the job if it exists and belongs to the user"""
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    async def stream_events(self, job: CompileJob) -> AsyncIterator[str]:
+        """Server-sent events for a job: past events first, then live ones until it finishes"""
+        index = 0
+        while True:
+            while index < len(job.events):
+                event = job.events[index]
+                index += 1
+                yield f"event: {event['phase']}\ndata: {json.dumps(event)}\n\n"
+            if job.done:
+                return
+            await job.wait_for_change(SSE_KEEPALIVE)
+            if index == len(job.events) and not job.done:
+                yield ": keep-alive\n\n"
+
+
+# Singleton job manager used by the /compile/jobs endpoints
+compile_jobs = CompileJobManager()
@@ -0,0 +1,425 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+from typing import Any, Callable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Compile pool configuration
+COMPILE_WORKERS = int(os.getenv("COMPILE_WORKERS", "2"))
+COMPILE_QUEUE_SIZE = int(os.getenv("COMPILE_QUEUE_SIZE", "8"))
+COMPILE_USER_CONCURRENCY = int(os.getenv("COMPILE_USER_CONCURRENCY", "1"))
+COMPILE_USER_QUEUE_SIZE = int(os.getenv("COMPILE_USER_QUEUE_SIZE", "3"))
+# After this many interactive compiles in a row a waiting bulk compile gets a turn
+COMPILE_BULK_EVERY = int(os.getenv("COMPILE_BULK_EVERY", "4"))
+
+# Compile priorities: editor previews go before background/download compiles
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+# Per-user statistics are kept for this many recently active users
+MAX_TRACKED_USERS = 1024
+ANONYMOUS_USER = "anonymous"
+
+
+class CompileQueueFullError(Exception):
+    """Raised when the compile queue cannot accept another job"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Compile queue is full, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class _CompileTask:
+    """A queued unit of work together with the future awaiting it"""
+
+    __slots__ = ("fn", "args", "kwargs", "loop", "future", "enqueued_at", "user_id", "priority")
+
+    def __init__(self, fn, args, kwargs, loop, future, user_id, priority):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.loop = loop
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.user_id = user_id
+        self.priority = priority
+
+
+class _UserStats:
+    """Queue counters for one user"""
+
+    __slots__ = ("running", "submitted", "completed", "failed", "rejected", "cancelled", "total_wait", "last_served")
+
+    def __init__(self):
+        self.last_served = 0  # dispatch sequence number of the user's latest compile
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+
+
+class _SharedCompile:
+    """An in-flight compile shared by identical submissions, and the progress listeners of all of them"""
+
+    __slots__ = ("task", "events", "listeners", "lock")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.events = []  # (phase, details) published so far, replayed to late joiners
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def listen(self, on_progress: Optional[Callable]) -> None:
+        if on_progress is None:
+            return
+        with self.lock:
+            for phase, details in self.events:
+                _notify(on_progress, phase, details)
+            self.listeners.append(on_progress)
+
+    def publish(self, phase: str, details: dict) -> None:
+        """Progress callback of the shared run (called on a compile worker thread)"""
+        with self.lock:
+            self.events.append((phase, details))
+            for listener in self.listeners:
+                _notify(listener, phase, details)
+
+
+def _notify(listener: Callable, phase: str, details: dict) -> None:
+    """Call one progress listener, never letting it break the others"""
+    try:
+        listener(phase, details)
+    except Exception as e:
+        logger.debug(f"Progress listener failed: {str(e)}")
+
+
+def _resolve_future(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+    """Set the outcome of a future unless the awaiting request already went away"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class CompileWorkerPool:
+    """
+    Dedicated thread pool for blocking LaTeX compiles with a bounded queue.
+
+    Compiles run on their own worker threads so the event loop keeps serving
+    health checks and notes requests. Once the queue is full new submissions
+    are rejected with CompileQueueFullError instead of piling up.
+
+    Queued compiles are kept per user and per priority. Workers serve users
+    round-robin, never run more than user_concurrency compiles for one user
+    at a time, and take interactive compiles before bulk ones (letting a
+    bulk compile through every COMPILE_BULK_EVERY interactive ones so bulk
+    work is not starved). Each user may also only have a few compiles
+    waiting, so one script cannot fill the whole queue.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = COMPILE_WORKERS,
+        max_queue: int = COMPILE_QUEUE_SIZE,
+        user_concurrency: int = COMPILE_USER_CONCURRENCY,
+        user_queue: int = COMPILE_USER_QUEUE_SIZE
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.user_concurrency = max(1, user_concurrency)
+        self.user_queue = max(0, user_queue)
+        # priority -> user_id -> deque of that user's waiting tasks
+        self._queues = {priority: {} for priority in PRIORITIES}
+        self._queued = 0
+        self._dispatched = 0
+        self._interactive_streak = 0
+        self._cond = threading.Condition()
+        self._workers = []
+        self._running = 0
+        self._inflight = {}  # (key, workspace) -> _SharedCompile of identical submissions
+        self._users = OrderedDict()  # user_id -> _UserStats, most recently active last
+
+        # Counters for /compiler/queue
+        self._submitted = 0
+        self._finished = 0
+        self._failed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._coalesced = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+
+    def _ensure_workers(self) -> None:
+        """Start worker threads on first use (caller holds the lock)"""
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"compile-worker-{len(self._workers) + 1}",
+                daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _user(self, user_id: str) -> _UserStats:
+        """Stats for a user, forgetting the least recently active idle users (caller holds the lock)"""
+        stats = self._users.get(user_id)
+        if stats is None:
+            stats = self._users[user_id] = _UserStats()
+            for stale in list(self._users):
+                if len(self._users) <= MAX_TRACKED_USERS:
+                    break
+                if self._users[stale].running == 0 and self._user_queued(stale) == 0:
+                    del self._users[stale]
+        self._users.move_to_end(user_id)
+        return stats
+
+    def _user_queued(self, user_id: str) -> int:
+        return sum(len(users.get(user_id, ())) for users in self._queues.values())
+
+    def _average_run(self) -> float:
+        return self._total_run / self._finished if self._finished else 5.0
+
+    def _retry_after(self) -> int:
+        """Estimate how many seconds until a queue slot frees up"""
+        backlog = self._queued + self._running
+        return max(1, math.ceil(backlog / self.max_workers * self._average_run()))
+
+    def _check_capacity(self, user_id: str) -> None:
+        """Reject if the pool or the user's own quota is full (caller holds the lock)"""
+        stats = self._user(user_id)
+        if self._queued + self._running >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            stats.rejected += 1
+            logger.warning(f"Compile queue full ({self._queued} waiting), rejecting request")
+            raise CompileQueueFullError(self._retry_after())
+
+        user_load = self._user_queued(user_id) + stats.running
+        if user_load >= self.user_concurrency + self.user_queue:
+            self._rejected += 1
+            stats.rejected += 1
+            logger.warning(f"User {user_id} has {user_load} compiles pending, rejecting request")
+            raise CompileQueueFullError(max(1, math.ceil(user_load / self.user_concurrency * self._average_run())))
+
+    def check_capacity(self, user_id: str = ANONYMOUS_USER) -> None:
+        """
+        Raise CompileQueueFullError if a submission right now would be rejected
+
+        Raises:
+            CompileQueueFullError: If the queue or the user's quota is at capacity
+        """
+        with self._cond:
+            self._check_capacity(user_id)
+
+    async def submit(
+        self,
+        fn: Callable,
+        *args,
+        user_id: str = ANONYMOUS_USER,
+        priority: str = PRIORITY_INTERACTIVE,
+        **kwargs
+    ) -> Any:
+        """
+        Run fn(*args, **kwargs) on a compile worker and await its result
+
+        Raises:
+            CompileQueueFullError: If the queue or the user's quota is at capacity
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown compile priority: {priority}")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        with self._cond:
+            self._check_capacity(user_id)
+
+            self._ensure_workers()
+            users = self._queues[priority]
+            users.setdefault(user_id, deque()).append(
+                _CompileTask(fn, args, kwargs, loop, future, user_id, priority)
+            )
+            self._queued += 1
+            self._submitted += 1
+            self._user(user_id).submitted += 1
+            self._cond.notify()
+
+        return await future
+
+    async def submit_shared(
+        self,
+        key: str,
+        fn: Callable,
+        *args,
+        on_progress: Optional[Callable] = None,
+        **kwargs
+    ) -> Any:
+        """
+        Like submit(), but identical concurrent submissions (same key) share
+        one run: later callers wait on the in-flight job and get its result
+        instead of queueing a duplicate compile.
+
+        Submissions with a `workspace` keyword only share a run with the same
+        workspace, whose files the run reads and writes. Every caller's
+        on_progress gets the run's progress events, the ones sent before it
+        joined first; the run counts against the first caller's user.
+        """
+        shared_key = (key, kwargs.get("workspace"))
+        shared = self._inflight.get(shared_key)
+        if shared is not None:
+            self._coalesced += 1
+            logger.info("Coalescing compile with identical in-flight request")
+        else:
+            shared = _SharedCompile()
+            shared.task = asyncio.ensure_future(self.submit(fn, *args, on_progress=shared.publish, **kwargs))
+            self._inflight[shared_key] = shared
+            shared.task.add_done_callback(lambda done: self._finish_shared(shared_key, shared))
+        shared.listen(on_progress)
+
+        # Shield so one caller disconnecting doesn't cancel the compile for the others
+        return await asyncio.shield(shared.task)
+
+    def _finish_shared(self, key: tuple, shared: _SharedCompile) -> None:
+        task = shared.task
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+        # Mark the outcome as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def _next_task(self) -> Optional[_CompileTask]:
+        """Pick the next task: priority first, then round-robin over users under their limit (caller holds the lock)"""
+        order = PRIORITIES
+        if self._interactive_streak >= COMPILE_BULK_EVERY and self._queues[PRIORITY_BULK]:
+            order = (PRIORITY_BULK, PRIORITY_INTERACTIVE)
+
+        for priority in order:
+            users = self._queues[priority]
+            # The eligible user served least recently goes next
+            eligible = [user_id for user_id in users if self._users[user_id].running < self.user_concurrency]
+            if not eligible:
+                continue
+            user_id = min(eligible, key=lambda candidate: self._users[candidate].last_served)
+            queue = users[user_id]
+            task = queue.popleft()
+            if not queue:
+                del users[user_id]
+            self._queued -= 1
+            self._dispatched += 1
+            self._users[user_id].last_served = self._dispatched
+            self._interactive_streak = self._interactive_streak + 1 if priority == PRIORITY_INTERACTIVE else 0
+            return task
+        return None
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    task = self._next_task()
+                    if task is None:
+                        self._cond.wait()
+                        continue
+                    # The request was cancelled (client disconnected) while queued
+                    if task.future.cancelled():
+                        self._cancelled += 1
+                        self._user(task.user_id).cancelled += 1
+                        continue
+                    break
+
+                wait = time.monotonic() - task.enqueued_at
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+                self._running += 1
+                user = self._user(task.user_id)
+                user.running += 1
+                user.total_wait += wait
+
+            logger.info(f"Compile started after waiting {wait * 1000:.0f}ms in queue ({task.priority})")
+            started = time.monotonic()
+            result, error = None, None
+            try:
+                result = task.fn(*task.args, **task.kwargs)
+            except BaseException as e:
+                error = e
+            elapsed = time.monotonic() - started
+
+            with self._cond:
+                self._running -= 1
+                self._total_run += elapsed
+                self._finished += 1
+                user = self._user(task.user_id)
+                user.running -= 1
+                if error is not None:
+                    self._failed += 1
+                    user.failed += 1
+                else:
+                    user.completed += 1
+                # The user may be eligible again, so wake every idle worker
+                self._cond.notify_all()
+
+            try:
+                task.loop.call_soon_threadsafe(_resolve_future, task.future, result, error)
+            except RuntimeError:
+                # Event loop already closed (shutdown)
+                pass
+
+    def user_stats(self, user_id: str) -> dict:
+        """Queue snapshot for one user"""
+        with self._cond:
+            stats = self._users.get(user_id) or _UserStats()
+            started = stats.completed + stats.failed + stats.running
+            return {
+                "user_concurrency": self.user_concurrency,
+                "user_queue": self.user_queue,
+                "running": stats.running,
+                "queued": {priority: len(self._queues[priority].get(user_id, ())) for priority in PRIORITIES},
+                "submitted": stats.submitted,
+                "completed": stats.completed,
+                "failed": stats.failed,
+                "rejected": stats.rejected,
+                "cancelled": stats.cancelled,
+                "avg_wait_ms": round(stats.total_wait / started * 1000, 1) if started else 0.0,
+            }
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and wait times"""
+        with self._cond:
+            started = self._finished + self._running
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": self._queued,
+                "queued_by_priority": {
+                    priority: sum(len(queue) for queue in self._queues[priority].values()) for priority in PRIORITIES
+                },
+                "max_queue": self.max_queue,
+                "user_concurrency": self.user_concurrency,
+                "user_queue": self.user_queue,
+                "active_users": sum(
+                    1 for user_id, user in self._users.items() if user.running or self._user_queued(user_id)
+                ),
+                "submitted": self._submitted,
+                "completed": self._finished - self._failed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "cancelled": self._cancelled,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._inflight),
+                "avg_wait_ms": round(self._total_wait / started * 1000, 1) if started else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 1),
+                "avg_run_ms": round(self._total_run / self._finished * 1000, 1) if self._finished else 0.0,
+            }
+
+
+# Singleton pool used by the compile endpoints
+compile_pool = CompileWorkerPool()
@@ -1,90 +1,202 @@
-import subprocess
 import tempfile
 import os
+import re
 import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Union, Tuple
+from typing import Union, Tuple, Optional, Iterator, Callable, List, Dict
 import logging
 
+from pdf_cache import pdf_cache, make_cache_key, CachedPDF
+from preamble_formats import preamble_formats, split_preamble, hash_preamble, PREAMBLE_FORMATS_ENABLED
+from tectonic_cache import tectonic_cache, WARM_UP_DOCUMENT
+from workspaces import workspaces, WORKSPACES_ENABLED
+from engine_registry import engine_registry
+from engine_selection import engine_selector, classify_failure, FAILURE_SOURCE
+from tex_process import run_tex, read_capped, TeXLimitExceeded
+from latex_precheck import check_structure, LaTeXDiagnostic, LATEX_PRECHECK_ENABLED
+import projects
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upper bound on pdflatex passes per compile
+PDFLATEX_MAX_PASSES = int(os.getenv("PDFLATEX_MAX_PASSES", "3"))
+
+# Log messages asking for another pass
+RERUN_PATTERN = re.compile(
+    r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|Rerun LaTeX",
+    re.IGNORECASE
+)
+# Compile modes: quick single-pass drafts for the editor, full quality for downloads
+MODE_PREVIEW = "preview"
+MODE_FINAL = "final"
+COMPILE_MODES = (MODE_PREVIEW, MODE_FINAL)
+# Prepended to the first line in preview mode (so error line numbers don't move):
+# boxes instead of images and no hyperref link processing
+PREVIEW_PRELUDE = "\\PassOptionsToPackage{draft}{graphicx}\\PassOptionsToPackage{draft}{hyperref}"
+
+# Auxiliary files read back at the start of the next pass
+AUX_EXTENSIONS = (".aux",)
+LIST_EXTENSIONS = (".toc", ".lof", ".lot")
+
 class LaTeXCompilationError(Exception):
     """Custom exception for LaTeX compilation errors"""
     pass
 
+class LaTeXResourceLimitError(LaTeXCompilationError):
+    """A compile was stopped by its time, CPU, memory or file size limit"""
+
+    def __init__(self, message: str, limit: str):
+        self.limit = limit
+        super().__init__(message)
+
+class LaTeXPrecheckError(LaTeXCompilationError):
+    """Structural errors found before any TeX engine was started"""
+
+    def __init__(self, diagnostics: List[LaTeXDiagnostic]):
+        self.diagnostics = diagnostics
+        lines = "\n".join(str(diagnostic) for diagnostic in diagnostics)
+        super().__init__(f"LaTeX source has {len(diagnostics)} structural error(s):\n{lines}")
+
+# Receives (phase, details) progress events from a running compile
+ProgressCallback = Callable[[str, dict], None]
+
+def _report(on_progress: Optional[ProgressCallback], phase: str, **details) -> None:
+    """Send a progress event, never letting a listener break the compile"""
+    if on_progress is None:
+        return
+    try:
+        on_progress(phase, details)
+    except Exception as e:
+        logger.debug(f"Progress listener failed: {str(e)}")
+
+@dataclass
+class CompileResult:
+    """Outcome of a successful compile"""
+    pdf: CachedPDF
+    engine: str
+    passes: int
+    cached: bool = False
+    mode: str = MODE_FINAL
+    
+    @property
+    def pdf_size(self) -> int:
+        return self.pdf.size
+    
+    @property
+    def pdf_bytes(self) -> bytes:
+        return self.pdf.read()
+
 class LaTeXCompiler:
     """
     LaTeX compiler that supports both Tectonic and pdflatex
     """
     
     def __init__(self):
-        self.tectonic_path = None
-        self.pdflatex_path = None
-        self.tectonic_available = self._check_tectonic()
-        self.pdflatex_available = self._check_pdflatex()
+        self.registry = engine_registry
+        self.cache = pdf_cache
+        self.formats = preamble_formats
+        self.tectonic_cache = tectonic_cache
+        self.workspaces = workspaces
+        self.engine_selector = engine_selector
         
         if not self.tectonic_available and not self.pdflatex_available:
             raise RuntimeError("Neither Tectonic nor pdflatex is available on this system")
     
-    def _check_tectonic(self) -> bool:
-        """Check if Tectonic is available"""
-        # Check common paths for Tectonic installation
-        tectonic_paths = [
-            "tectonic",  # In PATH
-            "/opt/homebrew/bin/tectonic",  # Homebrew on Apple Silicon
-            "/usr/local/bin/tectonic",  # Homebrew on Intel Mac
-            "/usr/bin/tectonic"  # System installation
-        ]
-        
-        for tectonic_path in tectonic_paths:
-            try:
-                result = subprocess.run(
-                    [tectonic_path, "--version"], 
-                    capture_output=True, 
-                    text=True, 
-                    timeout=5
-                )
-                if result.returncode == 0:
-                    self.tectonic_path = tectonic_path
-                    return True
-            except (subprocess.TimeoutExpired, FileNotFoundError):
-                continue
-        
-        return False
+    # Engine details come from the registry, which refreshes in the background
+    @property
+    def tectonic_available(self) -> bool:
+        return self.registry.get("tectonic") is not None
     
-    def _check_pdflatex(self) -> bool:
-        """Check if pdflatex is available"""
-        # Check common paths for pdflatex installation
-        pdflatex_paths = [
-            "pdflatex",  # In PATH
-            "/opt/homebrew/bin/pdflatex",  # Homebrew on Apple Silicon
-            "/usr/local/bin/pdflatex",  # Homebrew on Intel Mac
-            "/usr/bin/pdflatex",  # System installation
-            "/Library/TeX/texbin/pdflatex"  # MacTeX installation
-        ]
-        
-        for pdflatex_path in pdflatex_paths:
-            try:
-                result = subprocess.run(
-                    [pdflatex_path, "--version"], 
-                    capture_output=True, 
-                    text=True, 
-                    timeout=5
-                )
-                if result.returncode == 0:
-                    self.pdflatex_path = pdflatex_path
-                    return True
-            except (subprocess.TimeoutExpired, FileNotFoundError):
-                continue
+    @property
+    def pdflatex_available(self) -> bool:
+        return self.registry.get("pdflatex") is not None
+    
+    @property
+    def tectonic_path(self) -> Optional[str]:
+        info = self.registry.get("tectonic")
+        return info.path if info else None
+    
+    @property
+    def pdflatex_path(self) -> Optional[str]:
+        info = self.registry.get("pdflatex")
+        return info.path if info else None
+    
+    @property
+    def tectonic_version(self) -> Optional[str]:
+        info = self.registry.get("tectonic")
+        return info.version if info else None
+    
+    @property
+    def pdflatex_version(self) -> Optional[str]:
+        info = self.registry.get("pdflatex")
+        return info.version if info else None
+    
+    def supports(self, engine: str, feature: str) -> bool:
+        """Whether an engine has a feature; unknown features are assumed present"""
+        info = self.registry.get(engine)
+        return info is not None and info.features.get(feature, True)
+    
+    @property
+    def engine_fingerprint(self) -> str:
+        """Identify the engine chain (names and versions) a compile would use"""
+        engines = []
+        if self.tectonic_available:
+            engines.append(f"tectonic={self.tectonic_version}")
+        if self.pdflatex_available:
+            engines.append(f"pdflatex={self.pdflatex_version}")
+        return ";".join(engines)
+    
+    def cache_key(
+        self,
+        latex_content: str,
+        mode: str = MODE_FINAL,
+        files: Optional[Dict[str, str]] = None
+    ) -> str:
+        """Content-addressed key identifying a compile of this source (and project files) in this mode"""
+        engine = self.engine_fingerprint
+        if mode != MODE_FINAL:
+            # Previews are cached apart from the final PDFs
+            engine += f";mode={mode}"
+        return make_cache_key(projects.project_source(latex_content, files), engine)
+    
+    def lookup(
+        self,
+        latex_content: str,
+        mode: str = MODE_FINAL,
+        files: Optional[Dict[str, str]] = None
+    ) -> Optional[CompileResult]:
+        """
+        Return the cached result of compiling this source, or None on a miss
         
-        return False
+        Raises:
+            LaTeXCompilationError: If the same source failed to compile recently
+        """
+        cache_key = self.cache_key(latex_content, mode, files)
+        cached_pdf = self.cache.get(cache_key)
+        if cached_pdf is not None:
+            logger.info(f"Serving cached {mode} PDF ({cached_pdf.size} bytes)")
+            return CompileResult(pdf=cached_pdf, engine="cache", passes=0, cached=True, mode=mode)
+        
+        cached_error = self.cache.get_failure(cache_key)
+        if cached_error is not None:
+            logger.info("Source recently failed to compile, returning cached error")
+            raise LaTeXCompilationError(cached_error)
+        return None
     
-    def _validate_latex_content(self, latex_content: str) -> None:
+    def _validate_latex_content(self, latex_content: str, files: Optional[Dict[str, str]] = None) -> None:
         """Basic validation of LaTeX content"""
         if not latex_content.strip():
             raise LaTeXCompilationError("LaTeX content cannot be empty")
+        try:
+            projects.validate_project_files(files)
+        except projects.ProjectError as e:
+            raise LaTeXCompilationError(str(e))
         
         # Check for basic document structure if it's a complete document
         if "\\documentclass" in latex_content:
@@ -93,8 +205,50 @@ class LaTeXCompiler:
             if "\\end{document}" not in latex_content:
                 raise LaTeXCompilationError("Missing \\end{document}")
     
-    def _compile_with_tectonic(self, latex_file: Path, output_dir: Path) -> Tuple[bool, str]:
+    def _precheck(self, latex_content: str, files: Optional[Dict[str, str]] = None) -> List[LaTeXDiagnostic]:
+        """
+        Catch unbalanced braces, environments and math without spawning an engine
+        
+        Returns:
+            Advisory diagnostics, which are only reported if the engine fails too
+            
+        Raises:
+            LaTeXPrecheckError: If the source has errors every engine stops at
+        """
+        if not LATEX_PRECHECK_ENABLED:
+            return []
+        diagnostics = check_structure(latex_content)
+        for path, content in sorted((files or {}).items()):
+            if path.endswith(".tex"):
+                diagnostics += check_structure(content, fragment=True, file=path)
+        errors = [diagnostic for diagnostic in diagnostics if not diagnostic.advisory]
+        if errors:
+            raise LaTeXPrecheckError(errors)
+        return diagnostics
+    
+    def validate(self, latex_content: str, files: Optional[Dict[str, str]] = None) -> None:
+        """
+        Reject empty LaTeX and invalid project files before they are queued
+        (the structural check runs in the compile worker)
+        
+        Raises:
+            LaTeXCompilationError: If the source cannot compile
+        """
+        self._validate_latex_content(latex_content, files)
+    
+    def _compile_with_tectonic(
+        self,
+        latex_file: Path,
+        output_dir: Path,
+        only_cached: Optional[bool] = None,
+        keep_intermediates: bool = False,
+        single_pass: bool = False
+    ) -> Tuple[bool, str, int]:
         """Compile LaTeX using Tectonic"""
+        if only_cached is None:
+            only_cached = self.tectonic_cache.only_cached
+        only_cached = only_cached and self.supports("tectonic", "only_cached")
+        keep_intermediates = keep_intermediates and self.supports("tectonic", "keep_intermediates")
         try:
             # Tectonic command with output directory
             cmd = [
@@ -103,29 +257,138 @@ class LaTeXCompiler:
                 "--keep-logs",
                 str(latex_file)
             ]
+            if only_cached:
+                # Never block a compile on fetching bundle files
+                cmd.insert(1, "--only-cached")
+            if keep_intermediates:
+                # Leave .aux/.toc in persistent workspaces for the next build
+                cmd.insert(1, "--keep-intermediates")
+            if single_pass and self.supports("tectonic", "reruns"):
+                # Previews don't wait for cross-references to settle
+                cmd[1:1] = ["--reruns", "0"]
             
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=30,  # 30 second timeout
-                cwd=output_dir
-            )
+            # Runs under CPU/memory/file-size limits with capped output
+            result = run_tex(cmd, output_dir, env=self.tectonic_cache.env())
+            self.tectonic_cache.record(result.stderr)
+            # Tectonic reruns TeX itself and notes each extra pass
+            passes = 1 + result.stderr.count("Rerunning TeX")
             
             if result.returncode == 0:
-                logger.info("Tectonic compilation successful")
-                return True, result.stdout
+                logger.info(f"Tectonic compilation successful ({passes} passes)")
+                return True, result.stdout, passes
             else:
                 logger.error(f"Tectonic compilation failed: {result.stderr}")
-                return False, result.stderr
+                if only_cached and self.tectonic_cache.is_missing_resource(result.stderr):
+                    self._refill_tectonic_cache(latex_file.read_text(encoding="utf-8"))
+                return False, result.stderr, passes
                 
-        except subprocess.TimeoutExpired:
-            return False, "Compilation timed out (30 seconds)"
+        except TeXLimitExceeded as e:
+            # A runaway document would exhaust the other engine too
+            raise LaTeXResourceLimitError(str(e), e.limit)
         except Exception as e:
-            return False, f"Tectonic compilation error: {str(e)}"
+            return False, f"Tectonic compilation error: {str(e)}", 0
     
-    def _compile_with_pdflatex(self, latex_file: Path, output_dir: Path) -> Tuple[bool, str]:
-        """Compile LaTeX using pdflatex"""
+    def _fill_tectonic_cache(self, latex_content: str) -> bool:
+        """Compile a document online so everything it needs lands in the Tectonic cache"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            latex_file = temp_path / "document.tex"
+            latex_file.write_text(latex_content, encoding="utf-8")
+            try:
+                success, _, _ = self._compile_with_tectonic(latex_file, temp_path, only_cached=False)
+            except LaTeXResourceLimitError as e:
+                logger.warning(f"Filling the Tectonic cache stopped: {str(e)}")
+                return False
+            return success
+    
+    def _refill_tectonic_cache(self, latex_content: str) -> None:
+        """Fetch files missing from the cache in the background so the next compile finds them"""
+        if not self.tectonic_cache.begin_refill():
+            return
+        
+        def refill():
+            try:
+                logger.info("Fetching uncached Tectonic resources in the background")
+                self._fill_tectonic_cache(latex_content)
+            finally:
+                self.tectonic_cache.end_refill()
+        
+        threading.Thread(target=refill, name="tectonic-refill", daemon=True).start()
+    
+    def warm_up_tectonic(self) -> bool:
+        """
+        Compile a reference document to fill the persistent Tectonic cache.
+        Compiles switch to --only-cached once this succeeds.
+        """
+        if not self.tectonic_available:
+            return False
+        
+        logger.info(f"Warming up Tectonic cache in {self.tectonic_cache.directory}")
+        if self._fill_tectonic_cache(WARM_UP_DOCUMENT):
+            self.tectonic_cache.mark_warm()
+            logger.info("Tectonic cache is warm")
+            return True
+        
+        logger.warning("Tectonic warm-up failed, compiles will fetch resources on demand")
+        return False
+    
+    def _preamble_format(self, latex_content: str) -> Optional[str]:
+        """
+        Return the name of a precompiled format for the document's preamble, if any
+        
+        Only the user's source is dumped: the preview prelude and \\includeonly
+        written before its \\documentclass vary between builds of the same
+        document, and the format skips the preamble from \\documentclass on,
+        so they still run on top of it
+        """
+        if not PREAMBLE_FORMATS_ENABLED or not self.supports("pdflatex", "mylatexformat"):
+            return None
+        try:
+            preamble = split_preamble(latex_content)
+            if preamble is None:
+                return None
+            return self.formats.format_for(preamble, self.pdflatex_path, self.pdflatex_version)
+        except Exception as e:
+            logger.warning(f"Could not prepare preamble format: {str(e)}")
+            return None
+    
+    def _aux_snapshot(self, output_dir: Path, stem: str) -> dict:
+        """Hash the auxiliary files a pass reads back in"""
+        snapshot = {}
+        for ext in AUX_EXTENSIONS + LIST_EXTENSIONS:
+            path = output_dir / f"{stem}{ext}"
+            try:
+                snapshot[ext] = hashlib.sha256(path.read_bytes()).hexdigest()
+            except OSError:
+                snapshot[ext] = None
+        return snapshot
+    
+    def _needs_rerun(self, log_text: str, before: dict, after: dict) -> bool:
+        """Decide whether another pdflatex pass is needed to converge"""
+        if RERUN_PATTERN.search(log_text):
+            return True
+        # Lists (.toc/.lof/.lot) are only written at the end, so new or changed ones need a pass
+        for ext in LIST_EXTENSIONS:
+            if after[ext] is not None and after[ext] != before[ext]:
+                return True
+        # A changed .aux matters only if the pass read an earlier version of it
+        for ext in AUX_EXTENSIONS:
+            if before[ext] is not None and after[ext] != before[ext]:
+                return True
+        return False
+    
+    def _compile_with_pdflatex(
+        self,
+        latex_file: Path,
+        output_dir: Path,
+        latex_content: Optional[str] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        single_pass: bool = False
+    ) -> Tuple[bool, str, int]:
+        """
+        Compile LaTeX using pdflatex, rerunning only until references converge;
+        latex_content (the user's source) enables a precompiled preamble format
+        """
         try:
             # pdflatex command with output directory
             cmd = [
@@ -134,98 +397,252 @@ class LaTeXCompiler:
                 "-output-directory", str(output_dir),
                 str(latex_file)
             ]
+            if single_pass and self.supports("pdflatex", "halt_on_error"):
+                # Previews stop at the first error instead of recovering through the rest
+                cmd.insert(1, "-halt-on-error")
             
-            # Run pdflatex twice to resolve references
-            for run_number in [1, 2]:
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=30,  # 30 second timeout
-                    cwd=output_dir
-                )
-                
-                if result.returncode != 0 and run_number == 1:
-                    # If first run fails, don't attempt second run
-                    logger.error(f"pdflatex first run failed: {result.stderr}")
-                    return False, result.stderr
+            # Load the preamble from a precompiled format instead of re-reading packages
+            env = None
+            format_name = self._preamble_format(latex_content) if latex_content is not None else None
+            if format_name:
+                cmd.insert(1, f"-fmt={format_name}")
+                env = {**os.environ, "TEXFORMATS": f"{self.formats.directory}:"}
             
-            if result.returncode == 0:
-                logger.info("pdflatex compilation successful")
-                return True, result.stdout
-            else:
-                logger.error(f"pdflatex compilation failed: {result.stderr}")
-                return False, result.stderr
+            log_file = output_dir / f"{latex_file.stem}.log"
+            max_passes = 1 if single_pass else max(1, PDFLATEX_MAX_PASSES)
+            passes = 0
+            before = self._aux_snapshot(output_dir, latex_file.stem)
+            
+            while True:
+                passes += 1
+                _report(on_progress, "engine_pass", engine="pdflatex", number=passes)
+                result = run_tex(cmd, output_dir, env=env)
+                
+                if result.returncode != 0:
+                    if passes == 1 and format_name:
+                        # Retry without the format; if that succeeds the format was at fault
+                        logger.warning(f"pdflatex failed with format {format_name}, retrying full compile")
+                        success, message, retry_passes = self._compile_with_pdflatex(
+                            latex_file, output_dir, on_progress=on_progress, single_pass=single_pass
+                        )
+                        if success:
+                            self.formats.invalidate(format_name)
+                        return success, message, passes + retry_passes
+                    # Don't attempt further passes once one fails
+                    logger.error(f"pdflatex pass {passes} failed: {result.stderr}")
+                    return False, result.stderr or result.stdout, passes
                 
-        except subprocess.TimeoutExpired:
-            return False, "Compilation timed out (30 seconds)"
+                after = self._aux_snapshot(output_dir, latex_file.stem)
+                try:
+                    log_text = read_capped(log_file)
+                except OSError:
+                    log_text = result.stdout
+                
+                if not self._needs_rerun(log_text, before, after):
+                    break
+                if passes >= max_passes:
+                    logger.warning(f"pdflatex did not converge after {passes} passes")
+                    break
+                before = after
+            
+            logger.info(f"pdflatex compilation successful ({passes} passes)")
+            return True, result.stdout, passes
+                
+        except TeXLimitExceeded as e:
+            raise LaTeXResourceLimitError(str(e), e.limit)
+        except LaTeXResourceLimitError:
+            raise
         except Exception as e:
-            return False, f"pdflatex compilation error: {str(e)}"
+            return False, f"pdflatex compilation error: {str(e)}", 0
     
-    def compile_latex(self, latex_content: str) -> Union[bytes, None]:
+    @contextmanager
+    def _build_directory(self, latex_content: str, workspace: Optional[Tuple[str, str]]) -> Iterator[Path]:
+        """Yield the persistent workspace for (user_id, note_id), or a throwaway temp directory"""
+        if workspace and WORKSPACES_ENABLED:
+            user_id, note_id = workspace
+            preamble_hash = hash_preamble(split_preamble(latex_content) or "")
+            with self.workspaces.acquire(user_id, note_id, preamble_hash) as path:
+                yield path
+        else:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                yield Path(temp_dir)
+    
+    def _document_key(self, workspace: Optional[Tuple[str, str]]) -> Optional[str]:
+        """Identify a document across edits by its note; None without one (a shared preamble doesn't make documents related)"""
+        if workspace:
+            user_id, note_id = workspace
+            return f"note:{user_id}:{note_id}"
+        return None
+    
+    def compile(
+        self,
+        latex_content: str,
+        workspace: Optional[Tuple[str, str]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        mode: str = MODE_FINAL,
+        files: Optional[Dict[str, str]] = None
+    ) -> CompileResult:
         """
-        Compile LaTeX content to PDF and return PDF bytes
+        Compile LaTeX content to PDF
         
         Args:
             latex_content: The LaTeX source code as a string
+            workspace: Optional (user_id, note_id) whose persistent build
+                directory is reused between compiles
+            on_progress: Optional callback receiving (phase, details) events
+            mode: MODE_FINAL for a converged, full quality PDF, or
+                MODE_PREVIEW for a single draft pass that stops at the first error
+            files: Optional project files (relative path -> content) written
+                next to the main document; in preview mode only the
+                \\include'd chapters edited since the workspace's last build
+                are typeset
             
         Returns:
-            PDF bytes if successful, None if failed
+            CompileResult with the PDF bytes, engine and number of passes
             
         Raises:
             LaTeXCompilationError: If compilation fails
         """
         # Validate input
-        self._validate_latex_content(latex_content)
+        if mode not in COMPILE_MODES:
+            raise LaTeXCompilationError(f"Unknown compile mode: {mode}")
+        self._validate_latex_content(latex_content, files)
+        preview = mode == MODE_PREVIEW
         
-        # Create temporary directory for compilation
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
+        # Serve byte-identical sources from the cache (an identical compile may have finished while this one queued)
+        cache_key = self.cache_key(latex_content, mode, files)
+        _report(on_progress, "started", mode=mode)
+        cached = self.lookup(latex_content, mode, files)
+        if cached is not None:
+            return cached
+        
+        hints = self._precheck(latex_content, files)
+        
+        # Build in the note's workspace (keeping .aux/.toc) or a temporary directory;
+        # previews get their own workspace so they don't disturb the final build's files
+        document_key = self._document_key(workspace)
+        if workspace and preview:
+            workspace = (workspace[0], f"{workspace[1]}:{MODE_PREVIEW}")
+        persistent = bool(workspace and WORKSPACES_ENABLED)
+        with self._build_directory(latex_content, workspace) as temp_path:
             latex_file = temp_path / "document.tex"
             pdf_file = temp_path / "document.pdf"
             
             try:
+                # Don't mistake a PDF left by the previous build for this one
+                pdf_file.unlink(missing_ok=True)
+                
+                # Project files go next to the main document so \input/\include find them
+                manifest = projects.load_manifest(temp_path) if persistent else {}
+                projects.write_project_files(temp_path, files, manifest)
+                
+                # Previews of a project reuse the .aux of untouched chapters and typeset only the edited ones
+                chapters = projects.included_chapters(latex_content, files)
+                typeset = projects.changed_chapters(temp_path, chapters, manifest) if preview and persistent else None
+                if typeset is not None:
+                    logger.info(f"Typesetting {len(typeset)} of {len(chapters)} chapters")
+                    _report(on_progress, "partial", chapters=typeset)
+                
                 # Write LaTeX content to file
                 with open(latex_file, 'w', encoding='utf-8') as f:
+                    if preview:
+                        f.write(PREVIEW_PRELUDE)
+                    if typeset is not None:
+                        f.write(projects.include_only(typeset))
                     f.write(latex_content)
                 
-                # Try compilation with preferred compiler
+                # Start with the engine this document last built with
+                available = [
+                    name for name, ok in (("tectonic", self.tectonic_available), ("pdflatex", self.pdflatex_available)) if ok
+                ]
+                engines = self.engine_selector.order(document_key, available)
+                
                 success = False
-                error_message = ""
-                
-                if self.tectonic_available:
-                    logger.info("Attempting compilation with Tectonic")
-                    success, message = self._compile_with_tectonic(latex_file, temp_path)
-                    if not success:
-                        error_message = f"Tectonic error: {message}"
-                
-                # Fallback to pdflatex if Tectonic fails or is unavailable
-                if not success and self.pdflatex_available:
-                    logger.info("Attempting compilation with pdflatex")
-                    success, message = self._compile_with_pdflatex(latex_file, temp_path)
-                    if not success:
-                        if error_message:
-                            error_message += f"\npdflatex error: {message}"
-                        else:
-                            error_message = f"pdflatex error: {message}"
+                errors = []
+                engine = None
+                passes = 0
+                
+                for attempt, engine in enumerate(engines):
+                    if attempt > 0:
+                        # Another engine only helps if the first one failed for its own reasons
+                        if classify_failure(message) == FAILURE_SOURCE:
+                            logger.info(f"Not falling back to {engine}: the error is in the document")
+                            self.engine_selector.record_skipped_fallback()
+                            break
+                        logger.info(f"Falling back to {engine}")
+                    
+                    logger.info(f"Attempting compilation with {engine}")
+                    if engine == "tectonic":
+                        _report(on_progress, "engine_pass", engine="tectonic", number=1)
+                        success, message, passes = self._compile_with_tectonic(
+                            latex_file, temp_path, keep_intermediates=persistent, single_pass=preview
+                        )
+                    else:
+                        success, message, passes = self._compile_with_pdflatex(
+                            latex_file, temp_path, latex_content, on_progress=on_progress, single_pass=preview
+                        )
+                    
+                    if attempt > 0:
+                        self.engine_selector.record_fallback(document_key, engine, success)
+                    if success:
+                        break
+                    errors.append(f"{'Tectonic' if engine == 'tectonic' else 'pdflatex'} error: {message}")
                 
                 if not success:
-                    raise LaTeXCompilationError(f"Compilation failed with both compilers:\n{error_message}")
+                    if len(errors) > 1:
+                        failure = "Compilation failed with both compilers:\n" + "\n".join(errors)
+                    else:
+                        failure = "Compilation failed:\n" + "\n".join(errors)
+                    if hints:
+                        # The engine confirmed something is wrong; the pre-check may say where
+                        failure += "\nPossible causes found before compiling:\n" + "\n".join(str(hint) for hint in hints)
+                    raise LaTeXCompilationError(failure)
                 
                 # Check if PDF was created
                 if not pdf_file.exists():
                     raise LaTeXCompilationError("PDF file was not created despite successful compilation")
                 
-                # Read and return PDF bytes
-                with open(pdf_file, 'rb') as f:
-                    pdf_bytes = f.read()
+                if persistent:
+                    projects.record_chapters(manifest, chapters, typeset)
+                    projects.save_manifest(temp_path, manifest)
+                
+                if typeset is not None:
+                    # A partial preview lacks the other chapters and depends on this
+                    # workspace's .aux files, so it must not answer for the full source
+                    pdf = self.cache.put_uncached(pdf_file)
+                else:
+                    # Move the PDF into the cache so responses can stream it from disk
+                    pdf = self.cache.put_file(cache_key, pdf_file)
                 
-                logger.info(f"Successfully compiled LaTeX to PDF ({len(pdf_bytes)} bytes)")
-                return pdf_bytes
+                logger.info(f"Successfully compiled LaTeX to {mode} PDF with {engine} in {passes} passes ({pdf.size} bytes)")
+                return CompileResult(pdf=pdf, engine=engine, passes=passes, mode=mode)
                 
             except Exception as e:
                 logger.error(f"LaTeX compilation error: {str(e)}")
+                # Timeouts, missing packages and I/O errors may not happen again
+                if classify_failure(str(e)) == FAILURE_SOURCE and not isinstance(e, LaTeXResourceLimitError):
+                    self.cache.put_failure(cache_key, str(e))
+                if persistent:
+                    # Half-written .aux files would poison the next build
+                    self.workspaces.reset(temp_path)
+                if isinstance(e, LaTeXCompilationError):
+                    raise
                 raise LaTeXCompilationError(str(e))
+    
+    def compile_latex(self, latex_content: str) -> Union[bytes, None]:
+        """
+        Compile LaTeX content to PDF and return PDF bytes
+        
+        Args:
+            latex_content: The LaTeX source code as a string
+            
+        Returns:
+            PDF bytes if successful, None if failed
+            
+        Raises:
+            LaTeXCompilationError: If compilation fails
+        """
+        return self.compile(latex_content).pdf_bytes
 
 # Singleton compiler instance
 compiler = LaTeXCompiler()
@@ -244,3 +661,28 @@ def compile_latex_to_pdf(latex_content: str) -> bytes:
         LaTeXCompilationError: If compilation fails
     """
     return compiler.compile_latex(latex_content)
+
+def compile_latex_document(
+    latex_content: str,
+    workspace: Optional[Tuple[str, str]] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    mode: str = MODE_FINAL,
+    files: Optional[Dict[str, str]] = None
+) -> CompileResult:
+    """
+    Compile LaTeX content to PDF, reporting the engine and pass count
+    
+    Args:
+        latex_content: The LaTeX source code as a string
+        workspace: Optional (user_id, note_id) whose build directory is reused
+        on_progress: Optional callback receiving (phase, details) events
+        mode: MODE_FINAL or MODE_PREVIEW
+        files: Optional project files (relative path -> content)
+        
+    Returns:
+        CompileResult
+        
+    Raises:
+        LaTeXCompilationError: If compilation fails
+    """
+    return compiler.compile(latex_content, workspace=workspace, on_progress=on_progress, mode=mode, files=files)
@@ -0,0 +1,188 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Capability registry configuration
+ENGINE_REGISTRY_REFRESH = int(os.getenv("ENGINE_REGISTRY_REFRESH", "600"))
+
+# Install locations checked when a binary is not on PATH
+_EXTRA_DIRECTORIES = {
+    "tectonic": [
+        "/opt/homebrew/bin",  # Homebrew on Apple Silicon
+        "/usr/local/bin",  # Homebrew on Intel Mac
+        "/usr/bin",  # System installation
+    ],
+    "pdflatex": [
+        "/opt/homebrew/bin",  # Homebrew on Apple Silicon
+        "/usr/local/bin",  # Homebrew on Intel Mac
+        "/usr/bin",  # System installation
+        "/Library/TeX/texbin",  # MacTeX installation
+    ],
+}
+
+# Command-line options whose presence in --help output enables a feature
+_HELP_FEATURES = {
+    "tectonic": {
+        "only_cached": "--only-cached",
+        "keep_intermediates": "--keep-intermediates",
+        "keep_logs": "--keep-logs",
+        "reruns": "--reruns",
+    },
+    "pdflatex": {
+        "custom_formats": "-fmt",
+        "output_directory": "-output-directory",
+        "draftmode": "-draftmode",
+        "halt_on_error": "-halt-on-error",
+    },
+}
+
+
+@dataclass
+class EngineInfo:
+    """What is known about an installed TeX engine"""
+    name: str
+    path: str
+    version: str
+    features: Dict[str, bool] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {"path": self.path, "version": self.version, "features": dict(self.features)}
+
+
+def _resolve(name: str) -> Optional[str]:
+    """Find a binary on PATH or in the usual install locations without running it"""
+    found = shutil.which(name)
+    if found:
+        return found
+    for directory in _EXTRA_DIRECTORIES.get(name, []):
+        candidate = os.path.join(directory, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def _run(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    try:
+        return subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+
+
+def _probe(name: str, path: str) -> Optional[EngineInfo]:
+    """Run --version (and --help for features) once for a resolved binary"""
+    result = _run([path, "--version"])
+    if result is None or result.returncode != 0:
+        return None
+    output = result.stdout.strip()
+    version = output.splitlines()[0] if output else "unknown"
+
+    help_result = _run([path, "--help"])
+    help_text = (help_result.stdout + help_result.stderr) if help_result is not None else ""
+    features = {feature: option in help_text for feature, option in _HELP_FEATURES.get(name, {}).items()}
+
+    if name == "pdflatex":
+        # Preamble formats are dumped with mylatexformat
+        kpsewhich = shutil.which("kpsewhich", path=os.path.dirname(path)) or shutil.which("kpsewhich")
+        lookup = _run([kpsewhich, "mylatexformat.ltx"]) if kpsewhich else None
+        if lookup is not None:
+            features["mylatexformat"] = lookup.returncode == 0 and bool(lookup.stdout.strip())
+
+    return EngineInfo(name=name, path=path, version=version, features=features)
+
+
+class EngineRegistry:
+    """
+    Cached view of the installed TeX engines.
+
+    Binaries are resolved with a PATH lookup and probed once per refresh;
+    readers get the last snapshot without spawning any process. A daemon
+    thread refreshes the snapshot every ENGINE_REGISTRY_REFRESH seconds so
+    engine upgrades are picked up without a restart.
+    """
+
+    ENGINES = ("tectonic", "pdflatex")
+
+    def __init__(self, refresh_interval: int = ENGINE_REGISTRY_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._engines: Optional[Dict[str, EngineInfo]] = None
+        self._checked_at: Optional[float] = None
+        self._refresh_duration = 0.0
+        self._refreshes = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> Dict[str, EngineInfo]:
+        """Probe every engine and replace the snapshot"""
+        started = time.monotonic()
+        engines = {}
+        for name in self.ENGINES:
+            path = _resolve(name)
+            if path is None:
+                continue
+            info = _probe(name, path)
+            if info is not None:
+                engines[name] = info
+
+        with self._lock:
+            previous = self._engines
+            self._engines = engines
+            self._checked_at = time.time()
+            self._refresh_duration = time.monotonic() - started
+            self._refreshes += 1
+
+        if previous is not None:
+            for name in self.ENGINES:
+                before = previous[name].version if name in previous else None
+                after = engines[name].version if name in engines else None
+                if before != after:
+                    logger.info(f"{name} changed: {before} -> {after}")
+        return engines
+
+    def engines(self) -> Dict[str, EngineInfo]:
+        """Current snapshot, probing synchronously only the very first time"""
+        engines = self._engines
+        if engines is None:
+            engines = self.refresh()
+        return engines
+
+    def get(self, name: str) -> Optional[EngineInfo]:
+        return self.engines().get(name)
+
+    def start(self) -> None:
+        """Start the background refresh thread (idempotent)"""
+        with self._lock:
+            if self._thread is not None or self.refresh_interval <= 0:
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="engine-registry", daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Engine registry refresh failed: {str(e)}")
+
+    def snapshot(self) -> dict:
+        """Serializable view of the registry; never spawns a process"""
+        with self._lock:
+            engines = self._engines or {}
+            return {
+                "engines": {name: info.to_dict() for name, info in engines.items()},
+                "checked_at": self._checked_at,
+                "refresh_interval": self.refresh_interval,
+                "refresh_duration_ms": round(self._refresh_duration * 1000, 1),
+                "refreshes": self._refreshes,
+            }
+
+
+# Singleton registry shared by the compiler and /compiler/status
+engine_registry = EngineRegistry()
@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Engine selection configuration
+ENGINE_AFFINITY_TTL = int(os.getenv("ENGINE_AFFINITY_TTL", "3600"))
+ENGINE_AFFINITY_MAX = int(os.getenv("ENGINE_AFFINITY_MAX", "1024"))
+
+# Failure classes
+FAILURE_SOURCE = "source"  # the document itself is wrong; every engine will fail the same way
+FAILURE_ENGINE = "engine"  # the engine or its environment failed; another engine may succeed
+
+# Problems with the engine's environment, checked first: a missing package
+# often surfaces as a cascade of source-looking errors after it
+_ENGINE_FAILURE_PATTERN = re.compile(
+    r"File [`'].*?' not found"
+    r"|I can't find file"
+    r"|not found in bundle"
+    r"|only.cached"
+    r"|couldn't find"
+    r"|failed to open"
+    r"|[Dd]ownload(?:ing)? .*?fail"
+    r"|[Nn]etwork"
+    r"|timed out"
+    r"|compilation error:"  # exceptions raised while running the engine
+    r"|[Ff]ormat file .*? (?:not found|is corrupt|made by different executable)"
+    r"|can't find the format"
+    r"|Font \S+ not loadable"
+    r"|Killed"
+    r"|[Oo]ut of memory"
+)
+
+# TeX errors caused by the document; both engines report these identically
+_SOURCE_FAILURE_PATTERN = re.compile(
+    r"Undefined control sequence"
+    r"|Missing \$ inserted"
+    r"|Missing [{}] inserted"
+    r"|Extra [{}], or forgotten"
+    r"|Extra alignment tab"
+    r"|Misplaced alignment tab"
+    r"|Misplaced \\(?:noalign|omit|cr)"
+    r"|Environment \S+ undefined"
+    r"|\\begin\{[^}]*\} on input line \d+ ended by"
+    r"|Missing \\begin\{document\}"
+    r"|Missing \\(?:right|left)"
+    r"|Extra \\(?:right|left|endcsname|fi|else|or)"
+    r"|Paragraph ended before"
+    r"|Runaway argument"
+    r"|File ended while scanning"
+    r"|Display math should end with \$\$"
+    r"|Bad math environment delimiter"
+    r"|There's no line here to end"
+    r"|Double (?:super|sub)script"
+    r"|Illegal parameter number"
+    r"|Illegal unit of measure"
+    r"|Missing number, treated as zero"
+    r"|Command \S+ already defined"
+    r"|Lonely \\item"
+    r"|Something's wrong--perhaps a missing \\item"
+    r"|Too many \}'s"
+    r"|Argument of \S+ has an extra \}"
+    r"|Can be used only in preamble"
+    r"|Option clash for package"
+)
+
+
+def classify_failure(message: str) -> str:
+    """
+    Classify an engine failure from its output.
+
+    Returns FAILURE_SOURCE for errors in the document that another engine
+    would report too, and FAILURE_ENGINE otherwise. Unrecognised failures
+    count as engine failures so they still fall back.
+    """
+    if _ENGINE_FAILURE_PATTERN.search(message):
+        return FAILURE_ENGINE
+    if _SOURCE_FAILURE_PATTERN.search(message):
+        return FAILURE_SOURCE
+    return FAILURE_ENGINE
+
+
+class EngineSelector:
+    """
+    Chooses the engine order for a document and counts fallbacks.
+
+    A document that failed on its first engine for engine reasons and then
+    built with the other one remembers that engine, so its next compile
+    starts there. Affinities expire after a while (the Tectonic cache may
+    have been refilled since) and only the most recent ones are kept.
+    Compiles without a document key (no note) get no affinity.
+    """
+
+    def __init__(self, ttl: int = ENGINE_AFFINITY_TTL, max_entries: int = ENGINE_AFFINITY_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._affinity = OrderedDict()  # document key -> (engine, expires_at)
+
+        self.affinity_hits = 0
+        self.fallbacks = 0
+        self.fallback_successes = 0
+        self.wasted_fallbacks = 0
+        self.skipped_fallbacks = 0
+
+    def order(self, document_key: Optional[str], engines: List[str]) -> List[str]:
+        """Return engines with the document's preferred engine first"""
+        if document_key is None:
+            return list(engines)
+        with self._lock:
+            entry = self._affinity.get(document_key)
+            if entry is None:
+                return list(engines)
+            engine, expires_at = entry
+            if expires_at < time.monotonic() or engine not in engines:
+                del self._affinity[document_key]
+                return list(engines)
+            self._affinity.move_to_end(document_key)
+            self.affinity_hits += 1
+        return [engine] + [other for other in engines if other != engine]
+
+    def record_skipped_fallback(self) -> None:
+        """A source error made falling back pointless"""
+        with self._lock:
+            self.skipped_fallbacks += 1
+
+    def record_fallback(self, document_key: Optional[str], engine: str, success: bool) -> None:
+        """Record the outcome of running a fallback engine"""
+        with self._lock:
+            self.fallbacks += 1
+            if not success:
+                self.wasted_fallbacks += 1
+                return
+            self.fallback_successes += 1
+            if document_key is None:
+                return
+            self._affinity[document_key] = (engine, time.monotonic() + self.ttl)
+            self._affinity.move_to_end(document_key)
+            while len(self._affinity) > self.max_entries:
+                self._affinity.popitem(last=False)
+        logger.info(f"Document now prefers {engine}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "affinities": len(self._affinity),
+                "affinity_hits": self.affinity_hits,
+                "fallbacks": self.fallbacks,
+                "fallback_successes": self.fallback_successes,
+                "wasted_fallbacks": self.wasted_fallbacks,
+                "skipped_fallbacks": self.skipped_fallbacks,
+            }
+
+
+# Singleton selector shared by the compiler
+engine_selector = EngineSelector()
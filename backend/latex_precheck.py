@@ -0,0 +1,360 @@
+import os
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Structural pre-check configuration
+LATEX_PRECHECK_ENABLED = os.getenv("LATEX_PRECHECK_ENABLED", "true").lower() == "true"
+MAX_DIAGNOSTICS = 20
+
+# Everything the checker cares about; the text in between is skipped by the regex engine
+_TOKEN = re.compile(
+    r"\\([A-Za-z@]+)\*?"      # control word
+    r"|\\(.)"                 # control symbol (\{ \} \$ \% \\ \[ \] \( \) ...)
+    r"|(%)"                   # comment
+    r"|([{}])"                # group
+    r"|(\$\$|\$)"             # math shift
+    r"|(\n[ \t]*\n)",         # paragraph break
+    re.DOTALL
+)
+_ENV_NAME = re.compile(r"\s*\{([^{}]*)\}")
+_OPTIONS = re.compile(r"\s*\[[^\]\n]*\]")
+_CONDITIONAL = re.compile(r"\\(?:(if[A-Za-z@]*)|(else)|(fi))(?![A-Za-z@])")
+_CONTROL_SEQUENCE = re.compile(r"\\(?:[A-Za-z@]+|.)", re.DOTALL)
+
+# Constructs that change how TeX reads braces and $ (catcodes, short verbatim,
+# user-defined verbatim environments); with any of them brace and math errors
+# are only advisory
+_CATCODE_CHANGES = re.compile(
+    r"\\(?:catcode|ExplSyntaxOn|MakeShortVerb|DefineShortVerb|lstMakeShortInline|newmintinline|newminted|newmint"
+    r"|lstnewenvironment|DefineVerbatimEnvironment|CustomVerbatimEnvironment|VerbatimEnvironment"
+    r"|newtcblisting|NewTCBListing|directlua)(?![A-Za-z@])"
+)
+
+# Environments whose body TeX does not tokenize normally
+_VERBATIM_ENVIRONMENTS = {
+    "verbatim", "verbatim*", "lstlisting", "minted", "comment", "Verbatim", "Verbatim*", "BVerbatim", "LVerbatim",
+    "SaveVerbatim", "VerbatimOut", "spverbatim", "tcblisting", "luacode", "luacode*", "filecontents", "filecontents*",
+}
+
+# Commands that read their argument verbatim, in braces or between a delimiter character
+_VERBATIM_COMMANDS = {"verb", "Verb", "lstinline", "mintinline", "url", "path", "nolinkurl", "href", "detokenize"}
+_DELIMITED_ONLY = {"verb", "Verb"}  # \verb{...} would use "{" as its delimiter
+_BRACED_ONLY = {"detokenize"}
+
+# Commands whose arguments may legitimately contain half an environment or math
+_DEFINITION_COMMANDS = {
+    "def", "gdef", "edef", "xdef", "newcommand", "renewcommand", "providecommand",
+    "newenvironment", "renewenvironment", "DeclareRobustCommand", "NewDocumentCommand",
+    "RenewDocumentCommand", "NewDocumentEnvironment", "RenewDocumentEnvironment",
+}
+
+_MATH_CLOSERS = {"$": "$", "$$": "$$", "(": ")", "[": "]"}
+_MATH_NAMES = {"$": "$", "$$": "$$", "(": "\\(", "[": "\\["}
+
+
+@dataclass
+class LaTeXDiagnostic:
+    """A structural problem found before running any TeX engine"""
+    line: int
+    message: str
+    file: Optional[str] = None  # project file, None for the main document
+    advisory: bool = False  # may be a false positive: left for the engine to confirm
+
+    def to_dict(self) -> dict:
+        result = {"line": self.line, "message": self.message}
+        if self.file is not None:
+            result["file"] = self.file
+        if self.advisory:
+            result["advisory"] = True
+        return result
+
+    def __str__(self) -> str:
+        if self.file is not None:
+            return f"{self.file}, line {self.line}: {self.message}"
+        return f"Line {self.line}: {self.message}"
+
+
+class _Checker:
+    """Single left-to-right pass over the source"""
+
+    def __init__(self, source: str, fragment: bool = False, file: Optional[str] = None):
+        self.source = source
+        self.file = file
+        self.newlines = [match.start() for match in re.finditer("\n", source)]
+        self.diagnostics: List[LaTeXDiagnostic] = []
+        self.braces: List[Tuple[int, bool]] = []  # (offset, opens a macro argument) of open "{"
+        self.environments: List[Tuple[str, int]] = []  # (name, offset) of open \begin
+        self.math: List[Tuple[str, int]] = []  # (opener, offset) of open math
+        # Included files are body text from their first line
+        self.in_body = fragment
+        self.definition_depth: Optional[int] = None
+        self.macro_environments = set()  # environments a macro definition may open
+        self.macro_closed_environments = set()  # environments a macro definition may close
+        self.word_end = -1  # where the last control word ended
+        # Brace and math errors are certain unless the source changes how they are read
+        self.uncertain = _CATCODE_CHANGES.search(source) is not None
+
+    def line_of(self, offset: int) -> int:
+        return bisect_right(self.newlines, offset - 1) + 1
+
+    def report(self, offset: int, message: str, advisory: bool = False) -> None:
+        if len(self.diagnostics) < MAX_DIAGNOSTICS:
+            self.diagnostics.append(LaTeXDiagnostic(self.line_of(offset), message, self.file, advisory))
+
+    @property
+    def checking_body(self) -> bool:
+        """Environment and math checks only apply to document text outside definitions"""
+        return self.in_body and self.definition_depth is None
+
+    def open_math(self, opener: str, offset: int) -> None:
+        if not self.checking_body:
+            return
+        if opener == "$$" and self.math and self.math[-1][0] == "$":
+            # $x$$y$ is two inline formulas: close one and open the next
+            self.math[-1] = ("$", offset + 1)
+        elif opener in ("$", "$$") and self.math and self.math[-1][0] == opener:
+            self.math.pop()
+        else:
+            # Math can nest, e.g. \[ \text{if $x$} \]
+            self.math.append((opener, offset))
+
+    def close_math(self, closer: str, offset: int) -> None:
+        if not self.checking_body:
+            return
+        if not self.math:
+            self.report(offset, f"\\{closer} without matching opening math delimiter", advisory=self.uncertain)
+            return
+        current, opened = self.math.pop()
+        if _MATH_CLOSERS[current] != closer:
+            self.report(
+                offset,
+                f"\\{closer} closes {_MATH_NAMES[current]} math opened on line {self.line_of(opened)}",
+                advisory=self.uncertain
+            )
+
+    def unclosed_math(self, reason: str) -> None:
+        for opener, opened in self.math:
+            self.report(opened, f"{_MATH_NAMES[opener]} math is not closed before {reason}", advisory=self.uncertain)
+        self.math = []
+
+    def skip_verbatim_argument(self, word: str, position: int) -> int:
+        """Skip the verbatim argument of \\verb, \\url, \\lstinline and the like; returns where scanning resumes"""
+        source = self.source
+        options = _OPTIONS.match(source, position)
+        if options is not None and word in ("Verb", "lstinline", "mintinline"):
+            position = options.end()
+        if word == "mintinline":
+            # \mintinline{language}{code}
+            language = _ENV_NAME.match(source, position)
+            if language is None:
+                return position
+            position = language.end()
+        if word not in _DELIMITED_ONLY:
+            while position < len(source) and source[position] in " \t":
+                position += 1
+        if position >= len(source):
+            return position
+
+        # Verbatim arguments cannot span lines
+        line_end = source.find("\n", position)
+        if line_end == -1:
+            line_end = len(source)
+        delimiter = source[position]
+        if word in _BRACED_ONLY and delimiter != "{":
+            return position
+        if word == "path" and delimiter in "[(":
+            # TikZ's \path[draw] (0,0) -- (1,1); is not url's \path
+            return position
+        if delimiter != "{" or word in _DELIMITED_ONLY:
+            closing = source.find(delimiter, position + 1, line_end)
+            return line_end if closing == -1 else closing + 1
+
+        # Braces nest in \url{a{b}c}; \lstinline{a{b} ends at the first }
+        depth = 0
+        for index in range(position, line_end):
+            if source[index] == "{":
+                depth += 1
+            elif source[index] == "}":
+                depth -= 1
+                if depth == 0:
+                    return index + 1
+        first = source.find("}", position, line_end)
+        return line_end if first == -1 else first + 1
+
+    def skip_false_branch(self, position: int) -> int:
+        """Skip the text of \\iffalse up to its \\else or \\fi; returns where scanning resumes"""
+        depth = 0
+        for match in _CONDITIONAL.finditer(self.source, position):
+            conditional, otherwise, fi = match.groups()
+            if conditional is not None:
+                depth += 1
+            elif otherwise is not None and depth == 0:
+                return match.end()
+            elif fi is not None:
+                if depth == 0:
+                    return match.end()
+                depth -= 1
+        return len(self.source)
+
+    def begin_environment(self, name: str, offset: int, end: int) -> int:
+        """Handle \\begin{name}; returns where scanning resumes"""
+        if name == "document":
+            self.in_body = True
+        if name in _VERBATIM_ENVIRONMENTS:
+            closing = self.source.find(f"\\end{{{name}}}", end)
+            if closing == -1:
+                self.report(offset, f"\\begin{{{name}}} is never closed")
+                return len(self.source)
+            return closing + len(f"\\end{{{name}}}")
+        if self.definition_depth is not None:
+            self.macro_environments.add(name)
+        if self.checking_body or name == "document":
+            self.environments.append((name, offset))
+        return end
+
+    def macro_closed(self, name: str) -> bool:
+        """A macro may close this environment, so leaving it open may not be an error"""
+        return name in self.macro_closed_environments
+
+    def end_environment(self, name: str, offset: int) -> bool:
+        """Handle \\end{name}; returns True once the document has ended"""
+        if self.definition_depth is not None:
+            # Closed by a macro such as \newcommand{\ee}{\end{equation}}
+            self.macro_closed_environments.add(name)
+        if not (self.checking_body or name == "document"):
+            return False
+        if name in self.macro_environments and all(open_name != name for open_name, _ in self.environments):
+            # Opened by a macro such as \newcommand{\bi}{\begin{itemize}}
+            return False
+        if not self.environments:
+            self.report(offset, f"\\end{{{name}}} without matching \\begin{{{name}}}")
+            return name == "document"
+
+        if name == "document":
+            self.unclosed_math("\\end{document}")
+
+        top, opened = self.environments[-1]
+        if top == name:
+            self.environments.pop()
+        elif any(open_name == name for open_name, _ in self.environments):
+            # Everything opened after the matching \begin was left unclosed
+            while self.environments and self.environments[-1][0] != name:
+                inner, inner_offset = self.environments.pop()
+                self.report(
+                    inner_offset,
+                    f"\\begin{{{inner}}} is ended by \\end{{{name}}} on line {self.line_of(offset)}",
+                    advisory=self.macro_closed(inner)
+                )
+            self.environments.pop()
+        else:
+            self.report(
+                offset,
+                f"\\end{{{name}}} does not match \\begin{{{top}}} on line {self.line_of(opened)}",
+                advisory=self.macro_closed(top)
+            )
+
+        if name == "document":
+            self.in_body = False
+            return True
+        return False
+
+    def opens_argument(self, offset: int) -> bool:
+        """Whether the "{" at offset follows a control word or another argument"""
+        if self.source[max(0, offset - 64):offset].rstrip(" \t").endswith(("}", "]")):
+            return True
+        return 0 <= self.word_end and offset - self.word_end <= 64 and not self.source[self.word_end:offset].strip(" \t")
+
+    def run(self) -> List[LaTeXDiagnostic]:
+        source = self.source
+        position = 0
+        while True:
+            match = _TOKEN.search(source, position)
+            if match is None:
+                break
+            position = match.end()
+            word, symbol, comment, brace, dollars, paragraph = match.groups()
+
+            if word is not None:
+                if word in ("begin", "end"):
+                    name_match = _ENV_NAME.match(source, position)
+                    if name_match is None:
+                        continue
+                    name = name_match.group(1).strip()
+                    if word == "begin":
+                        position = self.begin_environment(name, match.start(), name_match.end())
+                    else:
+                        position = name_match.end()
+                        if self.end_environment(name, match.start()):
+                            # TeX stops reading at \end{document}
+                            break
+                elif word == "string" and position < len(source):
+                    # \string\end{itemize} typesets the name instead of running it
+                    escaped = _CONTROL_SEQUENCE.match(source, position)
+                    position = escaped.end() if escaped is not None else position + 1
+                elif word in _VERBATIM_COMMANDS:
+                    position = self.skip_verbatim_argument(word, position)
+                elif word == "iffalse" and self.definition_depth is None:
+                    # Commented-out text; a definition's braces count even inside \iffalse
+                    position = self.skip_false_branch(position)
+                elif word in _DEFINITION_COMMANDS and self.definition_depth is None:
+                    self.definition_depth = len(self.braces)
+                self.word_end = max(self.word_end, match.end())
+            elif symbol is not None:
+                if symbol in ("(", "["):
+                    self.open_math(symbol, match.start())
+                elif symbol in (")", "]"):
+                    self.close_math(symbol, match.start())
+            elif comment is not None:
+                newline = source.find("\n", position)
+                position = len(source) if newline == -1 else newline
+            elif brace == "{":
+                self.braces.append((match.start(), self.opens_argument(match.start())))
+            elif brace == "}":
+                if not self.braces:
+                    self.report(match.start(), "Unmatched closing brace }", advisory=self.uncertain)
+                    continue
+                self.braces.pop()
+                if self.definition_depth is not None and len(self.braces) == self.definition_depth:
+                    # A definition ends once its last argument group closes
+                    rest = source[position:position + 64].lstrip(" \t\n")
+                    if not rest.startswith(("{", "[")):
+                        self.definition_depth = None
+            elif dollars is not None:
+                self.open_math(dollars, match.start())
+            elif paragraph is not None and self.checking_body and any(opener in ("$", "(") for opener, _ in self.math):
+                # Inline math cannot span a paragraph break
+                self.unclosed_math("the paragraph ends")
+
+        self.unclosed_math("the end of the document")
+        for offset, argument in self.braces:
+            # A plain group left open is only a warning ("\\end occurred inside a group")
+            self.report(offset, "Unclosed brace {", advisory=self.uncertain or not argument)
+        for name, offset in self.environments:
+            self.report(offset, f"\\begin{{{name}}} is never closed", advisory=self.macro_closed(name))
+
+        self.diagnostics.sort(key=lambda diagnostic: diagnostic.line)
+        return self.diagnostics
+
+
+def check_structure(
+    latex_content: str,
+    fragment: bool = False,
+    file: Optional[str] = None
+) -> List[LaTeXDiagnostic]:
+    """
+    Find unbalanced braces, mismatched \\begin/\\end environments and
+    unclosed math in linear time, without starting a TeX engine.
+
+    Environment and math checks only look at the document body and skip
+    verbatim blocks and arguments, \\iffalse branches and the arguments of
+    macro definitions, so valid documents are not rejected. Diagnostics
+    that may still be false positives are marked advisory: brace and math
+    errors in sources that change catcodes or define verbatim commands,
+    environment errors involving an environment a macro opens or closes,
+    and groups left open (which TeX only warns about). A fragment (a project file pulled in with
+    \\input or \\include) is checked as body text throughout, and its
+    diagnostics carry the file name.
+    """
+    return _Checker(latex_content, fragment, file).run()
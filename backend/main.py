@@ -1,16 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal, Dict, Union, Tuple
+import base64
+import json
 import logging
 import os
+import threading
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
-from compiler import compile_latex_to_pdf, LaTeXCompilationError
-from auth import get_current_user, get_optional_user, require_verified_email, AuthMiddleware
+from compiler import compiler, compile_latex_document, CompileResult, LaTeXCompilationError, LaTeXResourceLimitError, MODE_FINAL, MODE_PREVIEW
+from compile_queue import compile_pool, CompileQueueFullError, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from compile_jobs import compile_jobs
+from pdf_cache import pdf_cache
+from pdf_response import pdf_response
+from preamble_formats import preamble_formats
+from tectonic_cache import tectonic_cache, TECTONIC_WARM_UP
+from workspaces import workspaces
+from projects import validate_project_files, ProjectError
+from notes_store import notes_store, NotesStoreUnavailable, NOTE_COLUMNS
+from note_patches import apply_text_ops, NotePatchError, TextOp
+from note_writes import note_writes, NoteVersionConflict, NoteWriteConflict
+from notes_cache import notes_cache, cached_json_response
+from auth import get_current_user, get_optional_user, require_verified_email, AuthMiddleware, supabase_auth
 
 # Load environment variables
 load_dotenv()
@@ -19,23 +34,44 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
+# Supabase configuration (notes are read and written through notes_store)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# GET /notes page size
+NOTES_PAGE_SIZE = int(os.getenv("NOTES_PAGE_SIZE", "50"))
+NOTES_PAGE_MAX = int(os.getenv("NOTES_PAGE_MAX", "200"))
+# Columns of a note without its bodies
+NOTE_SUMMARY_COLUMNS = "id,title,user_id,created_at,updated_at"
+# GET /notes/search page size
+NOTES_SEARCH_PAGE_SIZE = int(os.getenv("NOTES_SEARCH_PAGE_SIZE", "20"))
 
 # Pydantic models for request/response
 class LaTeXCompileRequest(BaseModel):
     latex_content: str
+    note_id: Optional[str] = None  # Reuse this note's build workspace between compiles
+    priority: Optional[Literal["interactive", "bulk"]] = None  # Defaults to interactive for previews, bulk for final builds and jobs
+    mode: Literal["preview", "final"] = MODE_FINAL  # preview: single draft pass, cached separately
+    files: Optional[Dict[str, str]] = None  # Project files (relative path -> content) next to the main document
     
 class LaTeXCompileResponse(BaseModel):
     success: bool
     message: str
     pdf_size: int = 0
+    engine: Optional[str] = None
+    passes: int = 0
+    cached: bool = False
+    mode: str = MODE_FINAL
+
+class CompileJobCreated(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+    pdf_url: str
+    events_url: str
 
 class UserInfo(BaseModel):
     id: str
@@ -46,24 +82,62 @@ class NoteCreate(BaseModel):
     title: str
     content: str
     latex_content: Optional[str] = None
+    files: Optional[Dict[str, str]] = None  # Project files compiled next to latex_content
 
 class NoteUpdate(BaseModel):
     title: Optional[str] = None
     content: Optional[str] = None
     latex_content: Optional[str] = None
+    files: Optional[Dict[str, str]] = None
+
+class NotePatch(BaseModel):
+    base_version: int  # Version the ops were computed against
+    title: Optional[str] = None
+    content: Optional[List[TextOp]] = None  # [start, delete, insert] ops in UTF-16 code units
+    latex_content: Optional[List[TextOp]] = None
+
+class NotePatchResponse(BaseModel):
+    id: str
+    version: int
+    updated_at: datetime
 
 class NoteResponse(BaseModel):
     id: str
     title: str
     content: str
     latex_content: Optional[str] = None
+    files: Optional[Dict[str, str]] = None
+    version: Optional[int] = None  # Bumped on every update; send as If-Match to update only this version
+    user_id: str
+    created_at: datetime
+    updated_at: datetime
+
+class NoteSummary(BaseModel):
+    id: str
+    title: str
     user_id: str
     created_at: datetime
     updated_at: datetime
 
 class NotesListResponse(BaseModel):
-    notes: List[NoteResponse]
-    total: int
+    notes: List[Union[NoteResponse, NoteSummary]]
+    total: int  # Notes in this page
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for the next page; None on the last page
+
+class NoteSearchResult(BaseModel):
+    id: str
+    title: str
+    user_id: str
+    version: Optional[int] = None
+    created_at: datetime
+    updated_at: datetime
+    rank: float
+    snippet: str  # HTML-escaped text around the matches, which are wrapped in <mark>
+
+class NoteSearchResponse(BaseModel):
+    results: List[NoteSearchResult]
+    total: int  # Results in this page
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for the next page; None on the last page
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -79,11 +153,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "ETag", "Content-Range", "Retry-After",
+        "X-Compile-Engine", "X-Compile-Passes", "X-Compile-Cache", "X-Compile-Mode", "X-Compile-Limit"
+    ],
 )
 
 # Add authentication middleware
 app.add_middleware(AuthMiddleware)
 
+@app.on_event("startup")
+async def warm_up_compiler():
+    """
+    Fill the persistent Tectonic cache in the background so health checks pass immediately
+    """
+    # Keep the engine registry current without probing on request paths
+    compiler.registry.start()
+    if TECTONIC_WARM_UP:
+        threading.Thread(target=compiler.warm_up_tectonic, name="tectonic-warm-up", daemon=True).start()
+
+@app.on_event("startup")
+async def start_note_writes():
+    """
+    Start the periodic flush of deferred note saves
+    """
+    note_writes.start()
+
+@app.on_event("shutdown")
+async def flush_note_writes():
+    """
+    Write deferred note saves before the database client is closed
+    """
+    await note_writes.stop()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """
+    Close pooled connections to Supabase
+    """
+    await supabase_auth.aclose()
+    await notes_store.aclose()
+
 @app.get("/")
 async def health_check():
     """
@@ -129,6 +239,31 @@ async def auth_status(request: Request):
         } if user else None
     }
 
+def compile_priority(request: LaTeXCompileRequest) -> str:
+    """Requested priority, else interactive for previews and bulk for final builds"""
+    if request.priority:
+        return request.priority
+    return PRIORITY_INTERACTIVE if request.mode == MODE_PREVIEW else PRIORITY_BULK
+
+async def compile_request(request: LaTeXCompileRequest, current_user: dict) -> CompileResult:
+    """
+    Compile the request's source; cache hits and recently failed sources are
+    answered here, so only misses wait for (or are refused) a worker slot
+    """
+    cached = await run_in_threadpool(compiler.lookup, request.latex_content, request.mode, request.files)
+    if cached is not None:
+        return cached
+    return await compile_pool.submit_shared(
+        compiler.cache_key(request.latex_content, request.mode, request.files),
+        compile_latex_document,
+        request.latex_content,
+        workspace=(current_user["id"], request.note_id) if request.note_id else None,
+        mode=request.mode,
+        files=request.files,
+        user_id=current_user["id"],
+        priority=compile_priority(request)
+    )
+
 @app.post("/compile", response_model=LaTeXCompileResponse)
 async def compile_latex(
     request: LaTeXCompileRequest,
@@ -139,15 +274,31 @@ async def compile_latex(
     """
     try:
         logger.info(f"User {current_user['email']} (ID: {current_user['id']}) compiling LaTeX")
-        pdf_bytes = compile_latex_to_pdf(request.latex_content)
+        # Empty sources and invalid project files fail here without taking a queue slot
+        compiler.validate(request.latex_content, request.files)
+        result = await compile_request(request, current_user)
         return LaTeXCompileResponse(
             success=True,
             message="LaTeX compiled successfully",
-            pdf_size=len(pdf_bytes)
+            pdf_size=result.pdf_size,
+            engine=result.engine,
+            passes=result.passes,
+            cached=result.cached,
+            mode=result.mode
         )
+    except LaTeXResourceLimitError as e:
+        logger.warning(f"LaTeX compilation for user {current_user['email']} hit the {e.limit} limit")
+        raise HTTPException(status_code=422, detail=str(e), headers={"X-Compile-Limit": e.limit})
     except LaTeXCompilationError as e:
         logger.error(f"LaTeX compilation failed for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
+    except CompileQueueFullError as e:
+        logger.warning(f"Compile queue full, rejecting request from user {current_user['email']}")
+        raise HTTPException(
+            status_code=503,
+            detail="Compiler is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Unexpected error during compilation for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error during compilation")
@@ -155,88 +306,440 @@ async def compile_latex(
 @app.post("/compile/pdf")
 async def compile_latex_to_pdf_endpoint(
     request: LaTeXCompileRequest,
+    http_request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """
     Compile LaTeX content to PDF and return the PDF file directly (requires authentication)
+    
+    The PDF is streamed from the compile cache with a strong ETag; a matching
+    If-None-Match returns 304 and Range requests return partial content.
     """
     try:
         logger.info(f"User {current_user['email']} (ID: {current_user['id']}) compiling LaTeX to PDF")
-        pdf_bytes = compile_latex_to_pdf(request.latex_content)
+        # Empty sources and invalid project files fail here without taking a queue slot
+        compiler.validate(request.latex_content, request.files)
+        result = await compile_request(request, current_user)
         
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
+        return pdf_response(
+            http_request,
+            result.pdf,
             headers={
-                "Content-Disposition": "inline; filename=document.pdf",
-                "Content-Length": str(len(pdf_bytes))
+                "X-Compile-Engine": result.engine,
+                "X-Compile-Passes": str(result.passes),
+                "X-Compile-Cache": "hit" if result.cached else "miss",
+                "X-Compile-Mode": result.mode
             }
         )
+    except LaTeXResourceLimitError as e:
+        logger.warning(f"LaTeX compilation for user {current_user['email']} hit the {e.limit} limit")
+        raise HTTPException(status_code=422, detail=str(e), headers={"X-Compile-Limit": e.limit})
     except LaTeXCompilationError as e:
         logger.error(f"LaTeX compilation failed for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
+    except CompileQueueFullError as e:
+        logger.warning(f"Compile queue full, rejecting request from user {current_user['email']}")
+        raise HTTPException(
+            status_code=503,
+            detail="Compiler is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Unexpected error during compilation for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error during compilation")
 
+@app.post("/compile/jobs", response_model=CompileJobCreated, status_code=202)
+async def create_compile_job(
+    request: LaTeXCompileRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Start a background compile and return its job id immediately (requires authentication)
+    """
+    try:
+        logger.info(f"User {current_user['email']} (ID: {current_user['id']}) starting compile job")
+        job = compile_jobs.create(
+            current_user["id"],
+            request.latex_content,
+            workspace=(current_user["id"], request.note_id) if request.note_id else None,
+            priority=request.priority or PRIORITY_BULK,
+            mode=request.mode,
+            files=request.files
+        )
+    except LaTeXCompilationError as e:
+        logger.error(f"LaTeX compilation failed for user {current_user['email']}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except CompileQueueFullError as e:
+        logger.warning(f"Compile queue full, rejecting job from user {current_user['email']}")
+        raise HTTPException(
+            status_code=503,
+            detail="Compiler is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    return CompileJobCreated(
+        job_id=job.id,
+        status=job.status,
+        status_url=f"/compile/jobs/{job.id}",
+        pdf_url=f"/compile/jobs/{job.id}/pdf",
+        events_url=f"/compile/jobs/{job.id}/events"
+    )
+
+@app.get("/compile/jobs/{job_id}")
+async def get_compile_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Get the status, phase events and diagnostics of a compile job
+    """
+    job = compile_jobs.get(job_id, current_user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Compile job not found")
+    return job.to_dict()
+
+@app.get("/compile/jobs/{job_id}/pdf")
+async def get_compile_job_pdf(job_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Download the PDF produced by a finished compile job (supports ETag and Range)
+    """
+    job = compile_jobs.get(job_id, current_user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Compile job not found")
+    if not job.done:
+        raise HTTPException(status_code=409, detail=f"Compile job is still {job.status}")
+    if job.result is None:
+        raise HTTPException(status_code=job.error_status or 400, detail=job.error)
+    
+    pdf = job.result.pdf
+    if pdf.data is None and not pdf.path.exists():
+        raise HTTPException(status_code=410, detail="Compiled PDF has expired, please compile again")
+    
+    return pdf_response(
+        request,
+        pdf,
+        headers={
+            "X-Compile-Engine": job.result.engine,
+            "X-Compile-Passes": str(job.result.passes),
+            "X-Compile-Cache": "hit" if job.result.cached else "miss"
+        }
+    )
+
+@app.get("/compile/jobs/{job_id}/events")
+async def stream_compile_job_events(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Stream a compile job's phase events (queued, engine pass N, done) as server-sent events
+    """
+    job = compile_jobs.get(job_id, current_user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Compile job not found")
+    return StreamingResponse(
+        compile_jobs.stream_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/compiler/status")
 async def get_compiler_status():
     """
     Check the status of available LaTeX compilers
+    
+    Reads the engine registry snapshot, which is refreshed in the
+    background, so this never starts a process.
     """
-    try:
-        from compiler import LaTeXCompiler
-        compiler = LaTeXCompiler()
-        return {
-            "tectonic_available": compiler.tectonic_available,
-            "pdflatex_available": compiler.pdflatex_available,
-            "status": "ready" if (compiler.tectonic_available or compiler.pdflatex_available) else "no_compilers",
-            "message": "LaTeX compilation is ready" if (compiler.tectonic_available or compiler.pdflatex_available) 
-                      else "No LaTeX compilers found. Please install Tectonic or pdflatex."
-        }
-    except RuntimeError as e:
-        return {
-            "tectonic_available": False,
-            "pdflatex_available": False,
-            "status": "error",
-            "message": str(e),
-            "installation_help": {
-                "tectonic": "brew install tectonic (recommended)",
-                "pdflatex": "brew install --cask mactex"
-            }
+    registry = compiler.registry.snapshot()
+    engines = registry["engines"]
+    ready = bool(engines)
+    status = {
+        "tectonic_available": "tectonic" in engines,
+        "pdflatex_available": "pdflatex" in engines,
+        "status": "ready" if ready else "no_compilers",
+        "message": "LaTeX compilation is ready" if ready
+                  else "No LaTeX compilers found. Please install Tectonic or pdflatex.",
+        **registry
+    }
+    if not ready:
+        status["installation_help"] = {
+            "tectonic": "brew install tectonic (recommended)",
+            "pdflatex": "brew install --cask mactex"
         }
+    return status
+
+def compiler_cache_stats() -> dict:
+    """Occupancy and hit rates of the compile caches (walks cache directories)"""
+    return {
+        "pdf": pdf_cache.stats(),
+        "preamble_formats": preamble_formats.stats(),
+        "tectonic": tectonic_cache.stats(),
+        "workspaces": workspaces.stats()
+    }
+
+@app.get("/compiler/cache")
+async def get_compiler_cache(current_user: dict = Depends(get_current_user)):
+    """
+    Report PDF, preamble format, Tectonic and workspace cache occupancy and hit rates (requires authentication)
+    """
+    # Directory scans stay off the event loop
+    return await run_in_threadpool(compiler_cache_stats)
+
+@app.get("/compiler/engines")
+async def get_compiler_engines(current_user: dict = Depends(get_current_user)):
+    """
+    Report engine fallbacks, wasted fallback runs and per-document engine affinity (requires authentication)
+    """
+    return compiler.engine_selector.stats()
+
+@app.get("/compiler/queue")
+async def get_compiler_queue(current_user: dict = Depends(get_current_user)):
+    """
+    Report compile queue depth, wait times and rejections (requires authentication)
+    """
+    return compile_pool.stats()
+
+@app.get("/compiler/queue/me")
+async def get_my_compiler_queue(current_user: dict = Depends(get_current_user)):
+    """
+    Report the current user's queued and running compiles and quota (requires authentication)
+    """
+    return compile_pool.user_stats(current_user["id"])
 
 # Notes CRUD endpoints
 
+def _parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def note_response(note: dict) -> NoteResponse:
+    """Build a NoteResponse from a notes row"""
+    return NoteResponse(
+        id=note["id"],
+        title=note["title"],
+        content=note["content"],
+        latex_content=note.get("latex_content"),
+        files=(note.get("files") or None),
+        version=note.get("version"),
+        user_id=note["user_id"],
+        created_at=_parse_timestamp(note["created_at"]),
+        updated_at=_parse_timestamp(note["updated_at"])
+    )
+
+def note_summary(note: dict) -> NoteSummary:
+    """Build a NoteSummary from a notes row"""
+    return NoteSummary(
+        id=note["id"],
+        title=note["title"],
+        user_id=note["user_id"],
+        created_at=_parse_timestamp(note["created_at"]),
+        updated_at=_parse_timestamp(note["updated_at"])
+    )
+
+def set_note_etag(response: Response, note: dict) -> None:
+    """Expose a note's version as its ETag, to be sent back as If-Match"""
+    if note.get("version") is not None:
+        response.headers["ETag"] = f'"{note["version"]}"'
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """
+    The note version an If-Match header requires, or None for no precondition
+    
+    Raises:
+        HTTPException: 400 if the header is not a note version
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a note version")
+
+async def raise_precondition_failed(user_id: str, note_id: str, status_code: int = 412) -> None:
+    """
+    A conditional write matched no row: status_code (412) if the note exists
+    at another version, 404 if it doesn't exist (only this failure path
+    reads the note)
+    """
+    current = await note_writes.get(user_id, note_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    raise HTTPException(
+        status_code=status_code,
+        detail="Note has been modified since it was loaded",
+        headers={"ETag": f'"{current.get("version")}"'}
+    )
+
+def raise_version_conflict(e: NoteVersionConflict, status_code: int = 412) -> None:
+    """A buffered save named a stale version"""
+    raise HTTPException(
+        status_code=status_code,
+        detail="Note has been modified since it was loaded",
+        headers={"ETag": f'"{e.current_version}"'}
+    )
+
+def raise_write_conflict(e: NoteWriteConflict) -> None:
+    """Deferred saves were not written; hand their changes back to the client"""
+    raise HTTPException(
+        status_code=409,
+        detail={
+            "message": "Note was modified elsewhere, deferred changes were not saved",
+            "version": e.current_version,
+            "rejected": e.changes
+        },
+        headers={"ETag": f'"{e.current_version}"'}
+    )
+
+def encode_notes_cursor(note: dict) -> str:
+    """Opaque cursor pointing just past a note in (created_at, id) descending order"""
+    raw = json.dumps([note["created_at"], note["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_notes_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Raises:
+        HTTPException: 400 if the cursor was not produced by encode_notes_cursor
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, note_id = json.loads(raw)
+        _parse_timestamp(created_at)
+        if not isinstance(note_id, str):
+            raise ValueError(note_id)
+        return created_at, note_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_search_cursor(offset: int) -> str:
+    """Opaque cursor for the search results starting at offset"""
+    raw = json.dumps({"offset": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_search_cursor(cursor: str) -> int:
+    """
+    Raises:
+        HTTPException: 400 if the cursor was not produced by encode_search_cursor
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        offset = json.loads(raw)["offset"]
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError(offset)
+        return offset
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/notes/stats")
+async def get_notes_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Report notes database call counts, timeouts and concurrency, deferred
+    saves and read cache hit rates (requires authentication)
+    """
+    return {"store": notes_store.stats(), "writes": note_writes.stats(), "cache": notes_cache.stats()}
+
+@app.get("/notes/search", response_model=NoteSearchResponse)
+async def search_notes(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(NOTES_SEARCH_PAGE_SIZE, ge=1, le=NOTES_PAGE_MAX),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Full-text search over the authenticated user's notes, best match first
+    
+    q is a web-style query ("exact phrase", or, -exclude). Titles weigh
+    more than bodies, and LaTeX commands, environment names, labels and
+    comments are not indexed. Each result carries a highlighted snippet.
+    Served from the notes cache until the user's next write, like GET /notes.
+    """
+    try:
+        user_id = current_user["id"]
+        offset = decode_search_cursor(cursor) if cursor else 0
+        cache_key = ("search", q, limit, cursor)
+        
+        cached = notes_cache.get(user_id, cache_key)
+        if cached is None:
+            token = notes_cache.token()
+            # One extra row tells whether another page follows
+            data = await notes_store.search(user_id, q, limit + 1, offset)
+            
+            rows = [note_writes.overlay(row) for row in data[:limit]]
+            results = [
+                NoteSearchResult(
+                    id=row["id"],
+                    title=row["title"],
+                    user_id=row["user_id"],
+                    version=row.get("version"),
+                    created_at=_parse_timestamp(row["created_at"]),
+                    updated_at=_parse_timestamp(row["updated_at"]),
+                    rank=row["rank"],
+                    snippet=row.get("snippet") or ""
+                )
+                for row in rows
+            ]
+            next_cursor = encode_search_cursor(offset + limit) if len(data) > limit else None
+            
+            page = NoteSearchResponse(results=results, total=len(results), next_cursor=next_cursor)
+            cached = notes_cache.put(user_id, cache_key, page.model_dump_json().encode("utf-8"), token)
+        
+        return cached_json_response(request, cached)
+    
+    except HTTPException:
+        raise
+    except NotesStoreUnavailable as e:
+        logger.warning(f"Notes database unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Notes database is unavailable, please retry")
+    except Exception as e:
+        logger.error(f"Error searching notes for user {current_user['email']}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to search notes")
+
 @app.get("/notes", response_model=NotesListResponse)
-async def get_notes(current_user: dict = Depends(get_current_user)):
+async def get_notes(
+    request: Request,
+    limit: int = Query(NOTES_PAGE_SIZE, ge=1, le=NOTES_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Literal["full", "summary"] = "full",
+    current_user: dict = Depends(get_current_user)
+):
     """
-    Get all notes for the authenticated user
+    Get a page of the authenticated user's notes, newest first
+    
+    Pages are keyed on (created_at, id), so a page costs the same however
+    deep it is and notes created meanwhile don't shift later pages.
+    fields=summary leaves out content, latex_content and files.
+    Pages are served from the notes cache until the user's next write, with
+    an ETag; If-None-Match with it gets 304 while the page is unchanged.
     """
     try:
-        result = supabase.table("notes").select("*").eq("user_id", current_user["id"]).order("created_at", desc=True).execute()
+        user_id = current_user["id"]
+        columns = NOTE_SUMMARY_COLUMNS if fields == "summary" else NOTE_COLUMNS
+        after = decode_notes_cursor(cursor) if cursor else None
+        cache_key = ("list", fields, limit, cursor)
         
-        notes = [
-            NoteResponse(
-                id=note["id"],
-                title=note["title"],
-                content=note["content"],
-                latex_content=note.get("latex_content"),
-                user_id=note["user_id"],
-                created_at=datetime.fromisoformat(note["created_at"].replace("Z", "+00:00")),
-                updated_at=datetime.fromisoformat(note["updated_at"].replace("Z", "+00:00"))
-            )
-            for note in result.data
-        ]
+        cached = notes_cache.get(user_id, cache_key)
+        if cached is None:
+            token = notes_cache.token()
+            # One extra row tells whether another page follows
+            data = await notes_store.list(user_id, limit + 1, after=after, columns=columns)
+            
+            rows = [note_writes.overlay(note) for note in data[:limit]]
+            build = note_summary if fields == "summary" else note_response
+            notes = [build(note) for note in rows]
+            next_cursor = encode_notes_cursor(rows[-1]) if len(data) > limit else None
+            
+            page = NotesListResponse(notes=notes, total=len(notes), next_cursor=next_cursor)
+            cached = notes_cache.put(user_id, cache_key, page.model_dump_json().encode("utf-8"), token)
         
-        return NotesListResponse(notes=notes, total=len(notes))
+        return cached_json_response(request, cached)
     
+    except HTTPException:
+        raise
+    except NotesStoreUnavailable as e:
+        logger.warning(f"Notes database unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Notes database is unavailable, please retry")
     except Exception as e:
         logger.error(f"Error fetching notes for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch notes")
 
 @app.post("/notes", response_model=NoteResponse)
-async def create_note(note_data: NoteCreate, current_user: dict = Depends(get_current_user)):
+async def create_note(note_data: NoteCreate, response: Response, current_user: dict = Depends(get_current_user)):
     """
     Create a new note for the authenticated user
     """
@@ -248,70 +751,84 @@ async def create_note(note_data: NoteCreate, current_user: dict = Depends(get_cu
             "latex_content": note_data.latex_content,
             "user_id": current_user["id"]
         }
+        if note_data.files is not None:
+            validate_project_files(note_data.files)
+            note_dict["files"] = note_data.files
         
-        result = supabase.table("notes").insert(note_dict).execute()
+        created_note = await notes_store.create(note_dict)
+        notes_cache.invalidate(current_user["id"])
         
-        if not result.data:
+        if not created_note:
             raise HTTPException(status_code=500, detail="Failed to create note")
         
-        created_note = result.data[0]
-        
-        return NoteResponse(
-            id=created_note["id"],
-            title=created_note["title"],
-            content=created_note["content"],
-            latex_content=created_note.get("latex_content"),
-            user_id=created_note["user_id"],
-            created_at=datetime.fromisoformat(created_note["created_at"].replace("Z", "+00:00")),
-            updated_at=datetime.fromisoformat(created_note["updated_at"].replace("Z", "+00:00"))
-        )
+        set_note_etag(response, created_note)
+        return note_response(created_note)
     
     except HTTPException:
         raise
+    except NotesStoreUnavailable as e:
+        logger.warning(f"Notes database unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Notes database is unavailable, please retry")
+    except ProjectError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error creating note for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create note")
 
 @app.get("/notes/{note_id}", response_model=NoteResponse)
-async def get_note(note_id: str, current_user: dict = Depends(get_current_user)):
+async def get_note(note_id: str, request: Request, current_user: dict = Depends(get_current_user)):
     """
     Get a specific note by ID (only if it belongs to the authenticated user)
+    
+    Served from the notes cache until the user's next write. The ETag is
+    the note version, so If-None-Match with it gets 304 while it is current.
     """
     try:
-        result = supabase.table("notes").select("*").eq("id", note_id).eq("user_id", current_user["id"]).execute()
-        
-        if not result.data:
-            raise HTTPException(status_code=404, detail="Note not found")
-        
-        note = result.data[0]
+        user_id = current_user["id"]
+        cached = notes_cache.get(user_id, ("note", note_id))
+        if cached is None:
+            token = notes_cache.token()
+            # Includes the user's deferred saves
+            note = await note_writes.get(user_id, note_id)
+            
+            if not note:
+                raise HTTPException(status_code=404, detail="Note not found")
+            
+            body = note_response(note).model_dump_json().encode("utf-8")
+            etag = f'"{note["version"]}"' if note.get("version") is not None else None
+            cached = notes_cache.put(user_id, ("note", note_id), body, token, etag=etag)
         
-        return NoteResponse(
-            id=note["id"],
-            title=note["title"],
-            content=note["content"],
-            latex_content=note.get("latex_content"),
-            user_id=note["user_id"],
-            created_at=datetime.fromisoformat(note["created_at"].replace("Z", "+00:00")),
-            updated_at=datetime.fromisoformat(note["updated_at"].replace("Z", "+00:00"))
-        )
+        return cached_json_response(request, cached)
     
     except HTTPException:
         raise
+    except NotesStoreUnavailable as e:
+        logger.warning(f"Notes database unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Notes database is unavailable, please retry")
     except Exception as e:
         logger.error(f"Error fetching note {note_id} for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch note")
 
 @app.put("/notes/{note_id}", response_model=NoteResponse)
-async def update_note(note_id: str, note_data: NoteUpdate, current_user: dict = Depends(get_current_user)):
+async def update_note(
+    note_id: str,
+    note_data: NoteUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    defer: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     """
     Update a specific note by ID (only if it belongs to the authenticated user)
+    
+    One filtered write checks ownership (and the If-Match version, when
+    given) and returns the updated note. A stale If-Match gets 412.
+    With defer=true the update is buffered and answered with 202; buffered
+    updates of a note are written together (see note_writes).
     """
     try:
-        # First check if the note exists and belongs to the user
-        existing_result = supabase.table("notes").select("*").eq("id", note_id).eq("user_id", current_user["id"]).execute()
-        
-        if not existing_result.data:
-            raise HTTPException(status_code=404, detail="Note not found")
+        user_id = current_user["id"]
+        expected_version = parse_if_match(if_match)
         
         # Prepare update data (only include fields that are not None)
         update_dict = {}
@@ -321,54 +838,161 @@ async def update_note(note_id: str, note_data: NoteUpdate, current_user: dict =
             update_dict["content"] = note_data.content
         if note_data.latex_content is not None:
             update_dict["latex_content"] = note_data.latex_content
+        if note_data.files is not None:
+            validate_project_files(note_data.files)
+            update_dict["files"] = note_data.files
         
         if not update_dict:
             # No fields to update, return existing note
-            note = existing_result.data[0]
+            note = await note_writes.get(user_id, note_id)
+            if note and expected_version is not None and note.get("version") != expected_version:
+                raise HTTPException(status_code=412, detail="Note has been modified since it was loaded")
+        elif defer and note_writes.enabled:
+            note = await note_writes.save(user_id, note_id, update_dict, expected_version)
+            response.status_code = 202
+        elif note_writes.pending(user_id, note_id):
+            # Write on top of the buffered updates, together with them
+            note = await note_writes.save(user_id, note_id, update_dict, expected_version)
+            await note_writes.flush_note(user_id, note_id)
         else:
-            # Update the note
-            result = supabase.table("notes").update(update_dict).eq("id", note_id).eq("user_id", current_user["id"]).execute()
-            
-            if not result.data:
-                raise HTTPException(status_code=500, detail="Failed to update note")
-            
-            note = result.data[0]
+            note = await notes_store.update(user_id, note_id, update_dict, expected_version)
+            if not note and expected_version is not None:
+                await raise_precondition_failed(user_id, note_id)
+        if update_dict:
+            notes_cache.invalidate(user_id)
         
-        return NoteResponse(
-            id=note["id"],
-            title=note["title"],
-            content=note["content"],
-            latex_content=note.get("latex_content"),
-            user_id=note["user_id"],
-            created_at=datetime.fromisoformat(note["created_at"].replace("Z", "+00:00")),
-            updated_at=datetime.fromisoformat(note["updated_at"].replace("Z", "+00:00"))
-        )
+        if not note:
+            raise HTTPException(status_code=404, detail="Note not found")
+        
+        set_note_etag(response, note)
+        return note_response(note)
     
     except HTTPException:
         raise
+    except NoteWriteConflict as e:
+        raise_write_conflict(e)
+    except NoteVersionConflict as e:
+        raise_version_conflict(e)
+    except NotesStoreUnavailable as e:
+        logger.warning(f"Notes database unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Notes database is unavailable, please retry")
+    except ProjectError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error updating note {note_id} for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to update note")
 
+@app.patch("/notes/{note_id}", response_model=NotePatchResponse)
+async def patch_note(
+    note_id: str,
+    patch: NotePatch,
+    response: Response,
+    defer: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Apply text edits to a note (only if it belongs to the authenticated user)
+    
+    The edits are applied to the note at base_version and written back only
+    if it is still at that version, so autosave sends a few bytes per burst
+    of typing instead of the whole document. A stale base gets 409 with the
+    current version as ETag. Returns only the new version; with defer=true
+    the edits are buffered (see note_writes) and answered with 202.
+    """
+    try:
+        user_id = current_user["id"]
+        # Deferred edits the database turned down come back before anything else
+        note_writes.raise_conflict(user_id, note_id)
+        note = await note_writes.get(user_id, note_id)
+        if not note:
+            raise HTTPException(status_code=404, detail="Note not found")
+        if note.get("version") != patch.base_version:
+            raise HTTPException(
+                status_code=409,
+                detail="Note has changed since base_version",
+                headers={"ETag": f'"{note.get("version")}"'}
+            )
+        
+        changes = {}
+        if patch.title is not None:
+            changes["title"] = patch.title
+        if patch.content:
+            changes["content"] = apply_text_ops(note.get("content") or "", patch.content)
+        if patch.latex_content:
+            changes["latex_content"] = apply_text_ops(note.get("latex_content") or "", patch.latex_content)
+        
+        if changes and note_writes.enabled and (defer or note_writes.pending(user_id, note_id)):
+            note = await note_writes.save(user_id, note_id, changes, patch.base_version, row=note)
+            if defer:
+                response.status_code = 202
+            else:
+                await note_writes.flush_note(user_id, note_id)
+        elif changes:
+            updated = await notes_store.update(
+                user_id, note_id, changes, patch.base_version, columns="id,version,updated_at"
+            )
+            if not updated:
+                # Another write landed between the read and this one
+                await raise_precondition_failed(user_id, note_id, status_code=409)
+            note = updated
+        if changes:
+            notes_cache.invalidate(user_id)
+        
+        set_note_etag(response, note)
+        return NotePatchResponse(id=note["id"], version=note["version"], updated_at=_parse_timestamp(note["updated_at"]))
+    
+    except HTTPException:
+        raise
+    except NoteWriteConflict as e:
+        raise_write_conflict(e)
+    except NoteVersionConflict as e:
+        raise_version_conflict(e, status_code=409)
+    except NotesStoreUnavailable as e:
+        logger.warning(f"Notes database unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Notes database is unavailable, please retry")
+    except NotePatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error patching note {note_id} for user {current_user['email']}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to patch note")
+
 @app.delete("/notes/{note_id}")
-async def delete_note(note_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_note(
+    note_id: str,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     """
     Delete a specific note by ID (only if it belongs to the authenticated user)
+    
+    One filtered delete checks ownership and the optional If-Match version.
     """
     try:
-        # First check if the note exists and belongs to the user
-        existing_result = supabase.table("notes").select("id").eq("id", note_id).eq("user_id", current_user["id"]).execute()
+        user_id = current_user["id"]
+        expected_version = parse_if_match(if_match)
         
-        if not existing_result.data:
-            raise HTTPException(status_code=404, detail="Note not found")
+        pending = note_writes.pending(user_id, note_id)
+        if pending is not None and pending.conflict_version is None:
+            # The version to match is the buffered one, not the row's
+            if expected_version is not None and pending.version != expected_version:
+                raise_version_conflict(NoteVersionConflict(pending.version))
+            expected_version = None
         
-        # Delete the note
-        result = supabase.table("notes").delete().eq("id", note_id).eq("user_id", current_user["id"]).execute()
+        if not await notes_store.delete(user_id, note_id, expected_version):
+            if expected_version is not None:
+                await raise_precondition_failed(user_id, note_id)
+            raise HTTPException(status_code=404, detail="Note not found")
+        # Buffered saves die with the note, and only once it is gone
+        note_writes.discard(user_id, note_id)
+        notes_cache.invalidate(user_id)
         
         return {"message": "Note deleted successfully", "note_id": note_id}
     
     except HTTPException:
         raise
+    except NotesStoreUnavailable as e:
+        logger.warning(f"Notes database unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Notes database is unavailable, please retry")
     except Exception as e:
         logger.error(f"Error deleting note {note_id} for user {current_user['email']}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to delete note")
@@ -0,0 +1,49 @@
+import os
+from typing import List, Tuple
+
+# Upper bound on edit operations per field in one PATCH
+NOTE_PATCH_MAX_OPS = int(os.getenv("NOTE_PATCH_MAX_OPS", "1000"))
+
+# Fields a PATCH may edit with text operations
+PATCHABLE_FIELDS = ("content", "latex_content")
+
+# (start, delete, insert): replace `delete` units at `start` of the base text with `insert`
+TextOp = Tuple[int, int, str]
+
+
+class NotePatchError(ValueError):
+    """Text operations that cannot be applied to the base text"""
+    pass
+
+
+def apply_text_ops(text: str, ops: List[TextOp]) -> str:
+    """
+    Apply edit operations to a text.
+
+    Positions count UTF-16 code units (what JavaScript string indices
+    count) in the base text; operations must be sorted and must not
+    overlap. Runs in time linear in the text and the inserts.
+
+    Raises:
+        NotePatchError: If an operation is out of range, out of order or
+            splits a surrogate pair
+    """
+    if len(ops) > NOTE_PATCH_MAX_OPS:
+        raise NotePatchError(f"At most {NOTE_PATCH_MAX_OPS} operations per field")
+
+    units = text.encode("utf-16-le")
+    length = len(units) // 2
+    parts = []
+    position = 0
+    for start, delete, insert in ops:
+        if start < position or delete < 0 or start + delete > length:
+            raise NotePatchError(f"Operation at {start} is out of order or out of range")
+        parts.append(units[2 * position:2 * start])
+        parts.append(insert.encode("utf-16-le", errors="surrogatepass"))
+        position = start + delete
+    parts.append(units[2 * position:])
+
+    try:
+        return b"".join(parts).decode("utf-16-le")
+    except UnicodeDecodeError:
+        raise NotePatchError("Operations split a character")
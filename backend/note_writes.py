@@ -0,0 +1,306 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Optional, Tuple
+import logging
+
+from notes_cache import notes_cache
+from notes_store import notes_store, NotesStore, NotesStoreError
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration (seconds between flushes; 0 writes every save through)
+NOTES_WRITE_BEHIND_INTERVAL = float(os.getenv("NOTES_WRITE_BEHIND_INTERVAL", "20"))
+NOTES_WRITE_BEHIND_MAX_PENDING = int(os.getenv("NOTES_WRITE_BEHIND_MAX_PENDING", "200"))
+# Seconds the changes of a conflicted note are kept for its client to collect
+NOTES_WRITE_CONFLICT_TTL = float(os.getenv("NOTES_WRITE_CONFLICT_TTL", "3600"))
+
+
+class NoteVersionConflict(Exception):
+    """A save named a version the note is no longer at"""
+
+    def __init__(self, current_version: Optional[int]):
+        self.current_version = current_version
+        super().__init__(f"Note is at version {current_version}")
+
+
+class NoteWriteConflict(NoteVersionConflict):
+    """Buffered saves were not written: the note changed outside the buffer"""
+
+    def __init__(self, current_version: Optional[int], changes: Dict[str, object]):
+        self.changes = changes  # The fields the rejected saves would have written
+        super().__init__(current_version)
+
+
+class PendingNote:
+    """Saves of one note accepted but not yet written to the database"""
+
+    def __init__(self, row: dict):
+        self.row = row  # The note as last read from the database
+        self.base_version = row.get("version")  # Version the database holds
+        self.version = self.base_version  # Version after the pending changes
+        self.changes: Dict[str, object] = {}
+        self.updated_at = row.get("updated_at")
+        self.saves = 0
+        self.conflict_version: Optional[int] = None  # Set when a flush found the note changed elsewhere
+        self.conflicted_at: Optional[float] = None
+
+    def view(self) -> dict:
+        """The note with the pending changes applied"""
+        return {**self.row, **self.changes, "version": self.version, "updated_at": self.updated_at}
+
+
+class NoteWriteBuffer:
+    """
+    Write-behind buffer for note saves.
+
+    A deferred save is merged into the note's pending changes and answered
+    at once with the version the note will have; repeated saves of the same
+    note collapse into one database write, made every NOTES_WRITE_BEHIND_INTERVAL
+    seconds or as soon as NOTES_WRITE_BEHIND_MAX_PENDING notes are pending,
+    and on shutdown. The flush writes that version explicitly (the version
+    trigger keeps the larger of it and the old version + 1) on the condition
+    that the row is still at the version the buffer started from.
+
+    Reads go through get() and overlay() so a client sees its own deferred
+    saves. The buffer lives in one process: with several API instances a
+    user's requests must reach the same one for that to hold.
+
+    If the row moved on outside the buffer, the flush writes nothing: the
+    note stays pending, marked with the version it is at, reads return the
+    row as it is, and the next save (or raise_conflict()) of it raises
+    NoteWriteConflict with the rejected changes. Unclaimed conflicts are
+    dropped after NOTES_WRITE_CONFLICT_TTL seconds.
+    """
+
+    def __init__(
+        self,
+        store: NotesStore = notes_store,
+        interval: float = NOTES_WRITE_BEHIND_INTERVAL,
+        max_pending: int = NOTES_WRITE_BEHIND_MAX_PENDING,
+        conflict_ttl: float = NOTES_WRITE_CONFLICT_TTL
+    ):
+        self.store = store
+        self.interval = interval
+        self.max_pending = max(1, max_pending)
+        self.conflict_ttl = conflict_ttl
+        self._pending: Dict[Tuple[str, str], PendingNote] = {}
+        self._flush_lock = asyncio.Lock()  # One full flush at a time
+        self._note_locks = {}  # (user_id, note_id) -> [lock, tasks holding or waiting for it]
+        self._loop_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.saves = 0
+        self.writes = 0
+        self.conflicts = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def pending(self, user_id: str, note_id: str) -> Optional[PendingNote]:
+        return self._pending.get((user_id, note_id))
+
+    def raise_conflict(self, user_id: str, note_id: str) -> None:
+        """
+        Hand back (once) the changes of a note whose buffered saves could not be written
+
+        Raises:
+            NoteWriteConflict: If a flush found the note changed elsewhere
+        """
+        entry = self.pending(user_id, note_id)
+        if entry is not None and entry.conflict_version is not None:
+            del self._pending[(user_id, note_id)]
+            raise NoteWriteConflict(entry.conflict_version, entry.changes)
+
+    def overlay(self, row: dict) -> dict:
+        """A (possibly partial) notes row with the columns it has brought up to date"""
+        entry = self._pending.get((row.get("user_id"), row.get("id")))
+        if entry is None or entry.conflict_version is not None:
+            return row
+        view = entry.view()
+        return {**row, **{key: view[key] for key in row if key in view}}
+
+    async def get(self, user_id: str, note_id: str) -> Optional[dict]:
+        """
+        A note including its pending saves; no database read while saves are
+        pending. A note whose saves were rejected is read as the database has it.
+        """
+        entry = self.pending(user_id, note_id)
+        if entry is not None and entry.conflict_version is None:
+            return entry.view()
+        return await self.store.get(user_id, note_id)
+
+    async def save(
+        self,
+        user_id: str,
+        note_id: str,
+        changes: Dict[str, object],
+        expected_version: Optional[int] = None,
+        row: Optional[dict] = None
+    ) -> Optional[dict]:
+        """
+        Accept changes to a note without writing them; returns the note as
+        it will be, or None if it doesn't exist. `row` is the note as just
+        read, to save a read when nothing is pending yet.
+
+        Raises:
+            NoteVersionConflict: If the note is not at expected_version
+            NoteWriteConflict: If its earlier pending saves could not be written
+        """
+        self.raise_conflict(user_id, note_id)
+        entry = self.pending(user_id, note_id)
+        if entry is None:
+            if row is None:
+                row = await self.store.get(user_id, note_id)
+                if row is None:
+                    return None
+            # Another request may have buffered the note while we read it
+            entry = self._pending.setdefault((user_id, note_id), PendingNote(row))
+
+        if expected_version is not None and entry.version != expected_version:
+            if not entry.changes:
+                del self._pending[(user_id, note_id)]
+            raise NoteVersionConflict(entry.version)
+
+        entry.changes.update(changes)
+        entry.version = (entry.version or 0) + 1
+        entry.updated_at = datetime.now(timezone.utc).isoformat()
+        entry.saves += 1
+        self.saves += 1
+
+        if len(self._pending) >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+        return entry.view()
+
+    def discard(self, user_id: str, note_id: str) -> Optional[PendingNote]:
+        """Drop a note's pending saves (the note is being deleted)"""
+        return self._pending.pop((user_id, note_id), None)
+
+    @asynccontextmanager
+    async def _note_lock(self, key: Tuple[str, str]) -> AsyncIterator[None]:
+        """Hold the flush lock of one note; its entry goes away with its last user"""
+        entry = self._note_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._note_locks[key]
+
+    async def _write(self, key: Tuple[str, str], entry: PendingNote) -> None:
+        user_id, note_id = key
+        version = entry.version
+        changes = {**entry.changes, "version": version}
+        written = await self.store.update(user_id, note_id, changes, entry.base_version, columns="id,version")
+        self.writes += 1
+        if written is None:
+            # Changed outside this buffer: don't overwrite it, tell the client on its next request
+            self.conflicts += 1
+            current = await self.store.get(user_id, note_id)
+            if current is None:
+                logger.warning(f"Dropping buffered saves of deleted note {note_id}")
+                if self._pending.get(key) is entry:
+                    del self._pending[key]
+                return
+            logger.warning(f"Note {note_id} changed outside the write buffer; not writing version {version}")
+            entry.conflict_version = current.get("version")
+            entry.conflicted_at = time.monotonic()
+            # Reads cached from the buffered saves would hide the conflict
+            notes_cache.invalidate(user_id)
+            return
+
+        if self._pending.get(key) is entry:
+            if entry.version == version:
+                del self._pending[key]
+            else:
+                # Saved again while this write was in flight
+                entry.base_version = written["version"] if written else version
+
+    async def flush_note(self, user_id: str, note_id: str) -> Optional[dict]:
+        """
+        Write one note's pending saves now; returns the note as written
+
+        Raises:
+            NoteWriteConflict: If the note changed outside the buffer
+        """
+        key = (user_id, note_id)
+        async with self._note_lock(key):
+            entry = self.pending(user_id, note_id)
+            if entry is None:
+                return None
+            view = entry.view()
+            if entry.conflict_version is None:
+                await self._write(key, entry)
+            self.raise_conflict(user_id, note_id)
+            return view
+
+    async def flush(self) -> int:
+        """Write every pending note; failed notes stay pending for the next flush"""
+        async with self._flush_lock:
+            flushed = 0
+            now = time.monotonic()
+            for key, entry in list(self._pending.items()):
+                if entry.conflict_version is not None:
+                    # Left for the client to collect, for a while
+                    if now - entry.conflicted_at > self.conflict_ttl:
+                        logger.warning(f"Dropping unclaimed rejected saves of note {key[1]}")
+                        del self._pending[key]
+                    continue
+                # A non-deferred save may be writing this note right now
+                async with self._note_lock(key):
+                    if self._pending.get(key) is not entry or entry.conflict_version is not None:
+                        continue
+                    try:
+                        await self._write(key, entry)
+                        flushed += 1
+                    except NotesStoreError as e:
+                        self.failures += 1
+                        logger.warning(f"Flushing note {key[1]} failed, will retry: {str(e)}")
+            return flushed
+
+    def start(self) -> None:
+        """Start the periodic flush (idempotent)"""
+        if self._loop_task is None and self.enabled:
+            self._loop_task = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Note write buffer flush failed: {str(e)}")
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write everything still pending"""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        started = time.monotonic()
+        await self.flush()
+        if self._pending:
+            logger.error(f"Shut down with {len(self._pending)} notes not written to the database")
+        elif self.saves:
+            logger.info(f"Flushed note write buffer in {time.monotonic() - started:.2f}s")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "pending": len(self._pending),
+            "saves": self.saves,
+            "writes": self.writes,
+            "conflicts": self.conflicts,
+            "failures": self.failures,
+            "saves_per_write": round(self.saves / self.writes, 1) if self.writes else None,
+        }
+
+
+# Singleton buffer shared by the notes endpoints
+note_writes = NoteWriteBuffer()
@@ -0,0 +1,163 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from pdf_response import etag_matches
+
+# Notes read cache configuration (0 MB disables it)
+NOTES_CACHE_MB = int(os.getenv("NOTES_CACHE_MB", "32"))
+NOTES_CACHE_TTL = float(os.getenv("NOTES_CACHE_TTL", "60"))
+
+
+@dataclass
+class CachedNotes:
+    """A serialized notes response and its ETag"""
+    body: bytes
+    etag: str
+    expires_at: float
+
+
+def body_etag(body: bytes) -> str:
+    """Strong ETag derived from a response body"""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+class NotesReadCache:
+    """
+    LRU of serialized GET /notes and GET /notes/{id} responses, per user,
+    bounded by NOTES_CACHE_MB. A write to any of a user's notes drops all
+    of that user's entries; NOTES_CACHE_TTL bounds how long a write made
+    outside this process (another instance, the Supabase dashboard) can
+    go unseen.
+
+    Reads that race a write must not store what they read before it: take
+    a token() before reading the database and pass it to put(), which
+    skips the entry if the user's notes were invalidated since.
+    """
+
+    def __init__(self, max_mb: int = NOTES_CACHE_MB, ttl: float = NOTES_CACHE_TTL):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, Hashable], CachedNotes]" = OrderedDict()
+        self._user_keys = {}  # user id -> set of keys in _entries
+        self._invalidated = OrderedDict()  # user id -> stamp of the last invalidation
+        self._stamps = itertools.count(1)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl > 0
+
+    def token(self) -> int:
+        """Stamp to take before reading the database for put()"""
+        return next(self._stamps)
+
+    def get(self, user_id: str, key: Hashable) -> Optional[CachedNotes]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    self._remove((user_id, key))
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_id, key))
+            self.hits += 1
+            return entry
+
+    def put(self, user_id: str, key: Hashable, body: bytes, token: int, etag: Optional[str] = None) -> CachedNotes:
+        """Cache a response body (ETag derived from it unless given) and return the entry"""
+        entry = CachedNotes(body=body, etag=etag or body_etag(body), expires_at=time.monotonic() + self.ttl)
+        # Entries over 1/8 of the budget would evict too much to be worth keeping
+        if not self.enabled or len(body) > self.max_bytes // 8:
+            return entry
+        with self._lock:
+            if self._invalidated.get(user_id, 0) > token:
+                return entry
+            self._remove((user_id, key))
+            self._entries[(user_id, key)] = entry
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+        return entry
+
+    def _remove(self, cache_key: Tuple[str, Hashable]) -> None:
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry.body)
+        user_id, key = cache_key
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's cached responses after a write to their notes"""
+        with self._lock:
+            self.invalidations += 1
+            self._invalidated[user_id] = next(self._stamps)
+            self._invalidated.move_to_end(user_id)
+            # Stamps only matter to reads in flight; keep a bounded history
+            while len(self._invalidated) > 10000:
+                self._invalidated.popitem(last=False)
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove((user_id, key))
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "users": len(self._user_keys),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "not_modified": self.not_modified,
+                "invalidations": self.invalidations,
+            }
+
+
+def cached_json_response(request: Request, entry: CachedNotes) -> Response:
+    """
+    Serve a cached notes body with its ETag, or 304 with no body if the
+    client's If-None-Match already names it
+    """
+    headers = {
+        "ETag": entry.etag,
+        # Browsers revalidate every time and get 304s while nothing changed
+        "Cache-Control": "private, no-cache",
+        "Vary": "Authorization",
+    }
+    if etag_matches(request.headers.get("If-None-Match"), entry.etag):
+        notes_cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+# Singleton cache shared by the notes endpoints
+notes_cache = NotesReadCache()
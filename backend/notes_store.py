@@ -0,0 +1,232 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# PostgREST endpoint of the Supabase project
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+SUPABASE_REST_URL = os.getenv("SUPABASE_REST_URL") or f"{SUPABASE_URL}/rest/v1"
+
+# Notes data access configuration
+NOTES_DB_TIMEOUT = float(os.getenv("NOTES_DB_TIMEOUT", "5"))
+NOTES_DB_CONCURRENCY = int(os.getenv("NOTES_DB_CONCURRENCY", "10"))
+NOTES_DB_MAX_CONNECTIONS = int(os.getenv("NOTES_DB_MAX_CONNECTIONS", "20"))
+
+# Columns of a note returned to clients (not the search_vector)
+NOTE_COLUMNS = "id,title,content,latex_content,files,version,user_id,created_at,updated_at"
+
+
+class NotesStoreError(Exception):
+    """PostgREST rejected a notes query"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+class NotesStoreUnavailable(NotesStoreError):
+    """The database did not answer in time or could not be reached"""
+
+    def __init__(self, message: str):
+        super().__init__(message, 503)
+
+
+class NotesStore:
+    """
+    Async access to the notes table through PostgREST.
+
+    Calls share one keep-alive connection pool, each call gets one
+    NOTES_DB_TIMEOUT deadline covering the wait for a slot and the request
+    (connect, send and read together), and at most
+    NOTES_DB_CONCURRENCY calls are in flight at once so a slow database
+    backs requests up here instead of exhausting connections.
+    """
+
+    TABLE = "notes"
+
+    def __init__(
+        self,
+        base_url: str = SUPABASE_REST_URL,
+        api_key: Optional[str] = SUPABASE_SERVICE_KEY,
+        timeout: float = NOTES_DB_TIMEOUT,
+        concurrency: int = NOTES_DB_CONCURRENCY
+    ):
+        self.base_url = base_url
+        self.api_key = api_key or ""
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._http: Optional[httpx.AsyncClient] = None
+
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._total_seconds = 0.0
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=NOTES_DB_MAX_CONNECTIONS,
+                    max_keepalive_connections=NOTES_DB_MAX_CONNECTIONS
+                ),
+                headers={
+                    "apikey": self.api_key,
+                    "Authorization": f"Bearer {self.api_key}",
+                }
+            )
+        return self._http
+
+    async def aclose(self) -> None:
+        """Close the connection pool"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _request(
+        self,
+        method: str,
+        params: List[Tuple[str, str]],
+        json: Optional[dict] = None,
+        prefer: Optional[str] = None,
+        path: Optional[str] = None
+    ) -> httpx.Response:
+        """
+        Run one PostgREST call on the shared pool (on the notes table unless
+        another path is given)
+
+        Raises:
+            NotesStoreUnavailable: On timeouts (waiting for a slot or for the database) and connection errors
+            NotesStoreError: If PostgREST answers with an error
+        """
+        headers = {"Prefer": prefer} if prefer else None
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise NotesStoreUnavailable("Timed out waiting for a database connection")
+
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # The request gets what is left of the deadline after waiting for a slot
+            remaining = max(0.0, self.timeout - (time.monotonic() - started))
+            response = await asyncio.wait_for(
+                self._client().request(method, path or f"/{self.TABLE}", params=params, json=json, headers=headers),
+                remaining
+            )
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            self.timeouts += 1
+            raise NotesStoreUnavailable("Database request timed out")
+        except httpx.HTTPError as e:
+            self.failures += 1
+            raise NotesStoreUnavailable(f"Database request failed: {type(e).__name__} {str(e)}")
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._total_seconds += time.monotonic() - started
+
+        if response.status_code >= 400:
+            self.failures += 1
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise NotesStoreError(f"PostgREST error {response.status_code}: {message}", response.status_code)
+        return response
+
+    async def list(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[Tuple[str, str]] = None,
+        columns: str = NOTE_COLUMNS
+    ) -> List[dict]:
+        """A user's notes, newest first, starting after the (created_at, id) keyset position"""
+        params = [("select", columns), ("user_id", f"eq.{user_id}")]
+        if after is not None:
+            created_at, note_id = after
+            # Rows strictly after the cursor in (created_at DESC, id DESC) order
+            params.append(
+                ("or", f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{note_id}"))')
+            )
+        params += [("order", "created_at.desc,id.desc"), ("limit", str(limit))]
+        response = await self._request("GET", params)
+        return response.json()
+
+    async def get(self, user_id: str, note_id: str) -> Optional[dict]:
+        params = [("select", NOTE_COLUMNS), ("id", f"eq.{note_id}"), ("user_id", f"eq.{user_id}")]
+        rows = (await self._request("GET", params)).json()
+        return rows[0] if rows else None
+
+    async def create(self, note: dict) -> Optional[dict]:
+        response = await self._request("POST", [("select", NOTE_COLUMNS)], json=note, prefer="return=representation")
+        rows = response.json()
+        return rows[0] if rows else None
+
+    def _row_filter(self, user_id: str, note_id: str, expected_version: Optional[int]) -> List[Tuple[str, str]]:
+        params = [("id", f"eq.{note_id}"), ("user_id", f"eq.{user_id}")]
+        if expected_version is not None:
+            params.append(("version", f"eq.{expected_version}"))
+        return params
+
+    async def update(
+        self,
+        user_id: str,
+        note_id: str,
+        changes: Dict[str, object],
+        expected_version: Optional[int] = None,
+        columns: str = NOTE_COLUMNS
+    ) -> Optional[dict]:
+        """
+        Update a note in one filtered write that returns the new row
+        (only `columns` of it). Returns None if no row matched: the note
+        doesn't exist, belongs to someone else, or is no longer at
+        expected_version.
+        """
+        params = self._row_filter(user_id, note_id, expected_version) + [("select", columns)]
+        response = await self._request("PATCH", params, json=changes, prefer="return=representation")
+        rows = response.json()
+        return rows[0] if rows else None
+
+    async def delete(self, user_id: str, note_id: str, expected_version: Optional[int] = None) -> bool:
+        """Delete a note in one filtered write; False if no row matched (as for update)"""
+        params = self._row_filter(user_id, note_id, expected_version) + [("select", "id")]
+        response = await self._request("DELETE", params, prefer="return=representation")
+        return bool(response.json())
+
+    async def search(self, user_id: str, query: str, limit: int, offset: int = 0) -> List[dict]:
+        """
+        A page of a user's notes matching a web-style query, best match first,
+        with rank and highlighted snippet (the search_notes database function)
+        """
+        body = {"p_user_id": user_id, "p_query": query, "p_limit": limit, "p_offset": offset}
+        response = await self._request("POST", [], json=body, path="/rpc/search_notes")
+        return response.json()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "concurrency": self.concurrency,
+            "avg_ms": round(self._total_seconds / self.calls * 1000, 1) if self.calls else 0.0,
+        }
+
+
+# Singleton store shared by the notes endpoints
+notes_store = NotesStore()
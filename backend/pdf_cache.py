@@ -0,0 +1,346 @@
+import hashlib
+import os
+import tempfile
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration (the latex_cache volume is mounted here on Fly.io)
+LATEX_CACHE_DIR = os.getenv("LATEX_CACHE_DIR", "/app/latex_cache")
+PDF_CACHE_MEMORY_MB = int(os.getenv("PDF_CACHE_MEMORY_MB", "32"))
+PDF_CACHE_MEMORY_MAX_ENTRY_KB = int(os.getenv("PDF_CACHE_MEMORY_MAX_ENTRY_KB", "512"))
+PDF_CACHE_DISK_MB = int(os.getenv("PDF_CACHE_DISK_MB", "512"))
+PDF_CACHE_NEGATIVE_TTL = float(os.getenv("PDF_CACHE_NEGATIVE_TTL", "30"))
+# Seconds PDFs that bypass the cache (partial previews) stay on disk for responses and compile jobs
+PDF_CACHE_UNCACHED_TTL = float(os.getenv("PDF_CACHE_UNCACHED_TTL", "600"))
+
+_cache_root: Optional[Path] = None
+
+
+def get_cache_root() -> Path:
+    """
+    Return the writable cache root, falling back to a temp directory when
+    the configured volume is missing or not writable by this user
+    """
+    global _cache_root
+    if _cache_root is not None:
+        return _cache_root
+
+    root = Path(LATEX_CACHE_DIR)
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        if not os.access(root, os.W_OK):
+            raise PermissionError(f"{root} is not writable")
+    except OSError as e:
+        fallback = Path(tempfile.gettempdir()) / "latex_cache"
+        logger.warning(f"Cache directory {root} unavailable ({str(e)}), using {fallback}")
+        fallback.mkdir(parents=True, exist_ok=True)
+        root = fallback
+
+    _cache_root = root
+    return root
+
+
+def make_cache_key(latex_content: str, engine: str) -> str:
+    """
+    Content-addressed key for a compile: hash of the engine fingerprint
+    (names and versions) and the LaTeX source
+    """
+    digest = hashlib.sha256()
+    digest.update(engine.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(latex_content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """sha256 of a file's content, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedPDF:
+    """
+    A cached PDF, backed by a file on the cache volume and, for small hot
+    PDFs, also by bytes held in memory
+    """
+    size: int
+    etag: str
+    path: Optional[Path] = None
+    data: Optional[bytes] = None
+
+    def read(self) -> bytes:
+        return self.data if self.data is not None else self.path.read_bytes()
+
+
+class PDFCache:
+    """
+    Two-tier cache of compiled PDFs.
+
+    A small in-memory LRU holds the bytes of the hottest small PDFs and a
+    size-bounded on-disk LRU on the latex_cache volume holds every PDF as a
+    file that responses can stream from. Each entry carries a strong ETag
+    (sha256 of the PDF). Errors in the document itself are cached for a
+    short time so a broken document that autosave keeps resubmitting does
+    not re-run the engine. Files are read and hashed outside the lock.
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        memory_bytes: int = PDF_CACHE_MEMORY_MB * 1024 * 1024,
+        disk_bytes: int = PDF_CACHE_DISK_MB * 1024 * 1024,
+        negative_ttl: float = PDF_CACHE_NEGATIVE_TTL,
+        memory_max_entry: int = PDF_CACHE_MEMORY_MAX_ENTRY_KB * 1024,
+        uncached_ttl: float = PDF_CACHE_UNCACHED_TTL
+    ):
+        self._root = root
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.negative_ttl = negative_ttl
+        self.memory_max_entry = memory_max_entry
+        self.uncached_ttl = uncached_ttl
+        self._lock = threading.Lock()
+
+        self._memory = OrderedDict()  # key -> CachedPDF with data
+        self._memory_size = 0
+        self._disk = None  # key -> size, loaded lazily
+        self._disk_size = 0
+        self._etags = {}  # key -> etag of the file on disk
+        self._failures = {}  # key -> (message, expires_at)
+
+        self._hits = {"memory": 0, "disk": 0, "negative": 0}
+        self._misses = 0
+
+    @property
+    def directory(self) -> Path:
+        return (self._root or get_cache_root()) / "pdf"
+
+    @property
+    def uncached_directory(self) -> Path:
+        return (self._root or get_cache_root()) / "uncached"
+
+    def _path_for(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.pdf"
+
+    def _load_disk_index(self) -> None:
+        """Scan the cache directory once, ordering entries by last use (caller holds the lock)"""
+        if self._disk is not None:
+            return
+
+        entries = []
+        try:
+            for path in self.directory.glob("*/*.pdf"):
+                try:
+                    stat = path.stat()
+                    entries.append((stat.st_mtime, path.stem, stat.st_size))
+                except OSError:
+                    continue
+        except OSError as e:
+            logger.warning(f"Could not scan PDF cache directory: {str(e)}")
+
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _remember_in_memory(self, key: str, pdf: CachedPDF) -> None:
+        """Insert into the memory tier and evict down to budget (caller holds the lock)"""
+        if pdf.data is None or pdf.size > min(self.memory_max_entry, self.memory_bytes):
+            return
+        if key in self._memory:
+            self._memory_size -= self._memory.pop(key).size
+        self._memory[key] = pdf
+        self._memory_size += pdf.size
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= evicted.size
+
+    def _evict_disk(self) -> None:
+        """Remove least recently used files until the disk tier fits its budget (caller holds the lock)"""
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._etags.pop(key, None)
+            self._memory_size -= self._memory.pop(key).size if key in self._memory else 0
+            try:
+                # Responses that already opened the file keep reading it after unlink
+                self._path_for(key).unlink()
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[CachedPDF]:
+        """Return the cached PDF for key, or None on a miss"""
+        with self._lock:
+            pdf = self._memory.get(key)
+            if pdf is not None:
+                self._memory.move_to_end(key)
+                self._hits["memory"] += 1
+                return pdf
+
+            self._load_disk_index()
+            if key not in self._disk:
+                self._misses += 1
+                return None
+
+            self._disk.move_to_end(key)
+            path = self._path_for(key)
+            size = self._disk[key]
+            etag = self._etags.get(key)
+
+        # Reading and hashing don't hold up other lookups; an eviction meanwhile shows up as OSError
+        try:
+            if etag is None:
+                # Entries left by a previous process are hashed on first use
+                etag = hash_file(path)
+            data = path.read_bytes() if size <= self.memory_max_entry else None
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                if key in self._disk:
+                    self._disk_size -= self._disk.pop(key)
+                    self._etags.pop(key, None)
+                self._misses += 1
+            return None
+
+        pdf = CachedPDF(size=size, etag=etag, path=path, data=data)
+        with self._lock:
+            if self._disk.get(key) == size:
+                self._etags.setdefault(key, etag)
+                self._remember_in_memory(key, pdf)
+            self._hits["disk"] += 1
+        return pdf
+
+    def put_file(self, key: str, source: Path) -> CachedPDF:
+        """
+        Move a freshly built PDF into the disk tier (and the memory tier if
+        it is small) and return the cache entry
+
+        Raises:
+            OSError: If the PDF cannot be stored on the cache volume
+        """
+        size = source.stat().st_size
+        etag = hash_file(source)
+        data = source.read_bytes() if size <= self.memory_max_entry else None
+
+        # Move next to the destination first (a copy if the build directory is on
+        # another volume), so the lock only covers the rename readers never see half of
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.move(str(source), tmp_name)
+        except OSError:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self._failures.pop(key, None)
+            self._load_disk_index()
+            try:
+                os.replace(tmp_name, path)
+            except OSError:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)
+            self._disk[key] = size
+            self._disk_size += size
+            self._etags[key] = etag
+
+            pdf = CachedPDF(size=size, etag=etag, path=path, data=data)
+            self._remember_in_memory(key, pdf)
+            self._evict_disk()
+            return pdf
+
+    def get_failure(self, key: str) -> Optional[str]:
+        """Return the error message of a recently failed compile"""
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure is None:
+                return None
+            message, expires_at = failure
+            if expires_at < time.monotonic():
+                del self._failures[key]
+                return None
+            self._hits["negative"] += 1
+            return message
+
+    def put_failure(self, key: str, message: str) -> None:
+        """
+        Remember a compile failure for negative_ttl seconds; only for errors
+        in the document, which the same source will hit again
+        """
+        if self.negative_ttl <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # Drop expired entries so the map stays small
+            for stale in [k for k, (_, exp) in self._failures.items() if exp < now]:
+                del self._failures[stale]
+            self._failures[key] = (message, now + self.negative_ttl)
+
+    def put_uncached(self, source: Path) -> CachedPDF:
+        """
+        Move a PDF that must not answer for its cache key (a partial preview)
+        into a short-lived area of the cache volume, so it is streamed from
+        disk like cached PDFs; files older than uncached_ttl are deleted as
+        new ones arrive
+
+        Raises:
+            OSError: If the PDF cannot be stored on the cache volume
+        """
+        size = source.stat().st_size
+        etag = hash_file(source)
+
+        directory = self.uncached_directory
+        directory.mkdir(parents=True, exist_ok=True)
+        expired = time.time() - self.uncached_ttl
+        for path in directory.glob("*.pdf"):
+            try:
+                if path.stat().st_mtime < expired:
+                    # Responses that already opened the file keep reading it after unlink
+                    path.unlink()
+            except OSError:
+                continue
+
+        fd, name = tempfile.mkstemp(dir=directory, suffix=".pdf")
+        os.close(fd)
+        path = Path(name)
+        try:
+            shutil.move(str(source), path)
+            os.utime(path)
+        except OSError:
+            path.unlink(missing_ok=True)
+            raise
+        return CachedPDF(size=size, etag=etag, path=path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_entries": len(self._disk) if self._disk is not None else None,
+                "disk_bytes": self._disk_size if self._disk is not None else None,
+                "negative_entries": len(self._failures),
+                "hits": dict(self._hits),
+                "misses": self._misses,
+            }
+
+
+# Singleton cache shared by the compiler
+pdf_cache = PDFCache()
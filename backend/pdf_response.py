@@ -0,0 +1,121 @@
+import re
+from typing import Iterator, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from pdf_cache import CachedPDF
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match / If-Range header against a strong ETag"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=" header into an inclusive (start, end)
+
+    Returns None for multi-range or malformed headers (served in full) and
+    raises ValueError if the range cannot be satisfied.
+    """
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def _iter_file(file, start: int, length: int) -> Iterator[bytes]:
+    """Stream a slice of an already open file and close it afterwards"""
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def pdf_response(request: Request, pdf: CachedPDF, filename: str = "document.pdf", headers: Optional[dict] = None) -> Response:
+    """
+    Serve a cached PDF with a strong ETag, If-None-Match (304) and single
+    Range (206) support. File-backed PDFs are streamed from disk in chunks
+    instead of being read into memory.
+    """
+    etag = f'"{pdf.etag}"'
+    response_headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f"inline; filename={filename}",
+        **(headers or {})
+    }
+
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=response_headers)
+
+    start, end = 0, pdf.size - 1
+    status_code = 200
+    range_header = request.headers.get("Range")
+    if range_header and pdf.size > 0:
+        # If-Range: only honour the range if the client still has this version
+        if_range = request.headers.get("If-Range")
+        if if_range is None or etag_matches(if_range, etag):
+            try:
+                byte_range = _parse_range(range_header, pdf.size)
+            except ValueError:
+                return Response(
+                    status_code=416,
+                    headers={**response_headers, "Content-Range": f"bytes */{pdf.size}"}
+                )
+            if byte_range is not None:
+                start, end = byte_range
+                status_code = 206
+                response_headers["Content-Range"] = f"bytes {start}-{end}/{pdf.size}"
+
+    length = end - start + 1
+    response_headers["Content-Length"] = str(length)
+
+    if pdf.data is not None:
+        return Response(
+            content=pdf.data[start:end + 1],
+            status_code=status_code,
+            media_type="application/pdf",
+            headers=response_headers
+        )
+
+    # Open now so a concurrent cache eviction (unlink) can't break the response
+    file = open(pdf.path, "rb")
+    return StreamingResponse(
+        _iter_file(file, start, length),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=response_headers
+    )
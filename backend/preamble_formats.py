@@ -0,0 +1,227 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+import logging
+
+from pdf_cache import get_cache_root
+from tex_process import run_tex, TeXLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Preamble format configuration
+PREAMBLE_FORMATS_ENABLED = os.getenv("PREAMBLE_FORMATS_ENABLED", "true").lower() == "true"
+PREAMBLE_FORMATS_MAX = int(os.getenv("PREAMBLE_FORMATS_MAX", "16"))
+# Seconds before a preamble that failed to dump is tried again, and how many failures are remembered
+PREAMBLE_FORMATS_RETRY_AFTER = float(os.getenv("PREAMBLE_FORMATS_RETRY_AFTER", "600"))
+PREAMBLE_FORMATS_FAILED_MAX = int(os.getenv("PREAMBLE_FORMATS_FAILED_MAX", "256"))
+
+BEGIN_DOCUMENT = "\\begin{document}"
+
+
+def split_preamble(latex_content: str) -> Optional[str]:
+    """
+    Return everything before \\begin{document}, or None if the source is
+    not a complete document with a \\documentclass preamble
+    """
+    index = latex_content.find(BEGIN_DOCUMENT)
+    if index == -1:
+        return None
+    preamble = latex_content[:index]
+    if "\\documentclass" not in preamble:
+        return None
+    return preamble
+
+
+def hash_preamble(preamble: str) -> str:
+    return hashlib.sha256(preamble.encode("utf-8")).hexdigest()
+
+
+class PreambleFormatCache:
+    """
+    Precompiled pdflatex format files keyed by preamble hash.
+
+    The preamble of a document is dumped once with `pdflatex -ini` and
+    mylatexformat into a .fmt file. Later compiles of a document with the
+    same preamble load that format and skip re-reading its packages.
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        max_formats: int = PREAMBLE_FORMATS_MAX,
+        retry_after: float = PREAMBLE_FORMATS_RETRY_AFTER,
+        max_failed: int = PREAMBLE_FORMATS_FAILED_MAX
+    ):
+        self._root = root
+        self.max_formats = max_formats
+        self.retry_after = retry_after
+        self.max_failed = max_failed
+        self._lock = threading.Lock()
+        self._key_locks = {}  # format name -> [lock, threads holding or waiting for it]
+        self._failed = OrderedDict()  # format name -> monotonic time it may be tried again
+
+        self.hits = 0
+        self.dumps = 0
+        self.dump_failures = 0
+
+    @property
+    def directory(self) -> Path:
+        return (self._root or get_cache_root()) / "formats"
+
+    def _format_name(self, preamble: str, engine_version: str) -> str:
+        version_hash = hashlib.sha256(engine_version.encode("utf-8")).hexdigest()[:8]
+        return f"pre_{version_hash}_{hash_preamble(preamble)[:16]}"
+
+    def _is_failed(self, name: str) -> bool:
+        """Whether the format failed recently (caller holds the lock)"""
+        retry_at = self._failed.get(name)
+        if retry_at is None:
+            return False
+        if retry_at <= time.monotonic():
+            del self._failed[name]
+            return False
+        return True
+
+    def _mark_failed(self, name: str) -> None:
+        """Skip the format until retry_after has passed, forgetting the oldest failures (caller holds the lock)"""
+        self._failed.pop(name, None)
+        self._failed[name] = time.monotonic() + self.retry_after
+        while len(self._failed) > self.max_failed:
+            self._failed.popitem(last=False)
+
+    def _prune(self, version_prefix: str) -> None:
+        """Evict formats built by another engine version and the least recently used extras"""
+        try:
+            formats = list(self.directory.glob("pre_*.fmt"))
+        except OSError:
+            return
+
+        current = []
+        for path in formats:
+            if not path.name.startswith(version_prefix):
+                path.unlink(missing_ok=True)
+            else:
+                current.append(path)
+
+        if len(current) > self.max_formats:
+            try:
+                current.sort(key=lambda p: p.stat().st_mtime)
+            except OSError:
+                return
+            for path in current[:len(current) - self.max_formats]:
+                path.unlink(missing_ok=True)
+
+    @contextmanager
+    def _name_lock(self, name: str) -> Iterator[None]:
+        """Hold the lock of one format name; its entry goes away with its last user"""
+        with self._lock:
+            entry = self._key_locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[name]
+
+    def format_for(self, preamble: str, pdflatex_path: str, engine_version: str) -> Optional[str]:
+        """
+        Return the name of a format file with this preamble dumped into it,
+        building it on first use. Returns None if the preamble cannot be dumped.
+        """
+        name = self._format_name(preamble, engine_version)
+        fmt_path = self.directory / f"{name}.fmt"
+
+        with self._lock:
+            if self._is_failed(name):
+                return None
+
+        # Only one thread dumps a given preamble; others wait and reuse it
+        with self._name_lock(name):
+            if fmt_path.exists():
+                try:
+                    os.utime(fmt_path)
+                except OSError:
+                    pass
+                with self._lock:
+                    self.hits += 1
+                return name
+
+            if not self._dump(preamble, name, pdflatex_path):
+                with self._lock:
+                    self._mark_failed(name)
+                    self.dump_failures += 1
+                return None
+
+        with self._lock:
+            self.dumps += 1
+        # Pruning stats every format, so it runs outside the lock; racing prunes only unlink twice
+        self._prune(name[:len("pre_") + 8])
+        return name
+
+    def _dump(self, preamble: str, name: str, pdflatex_path: str) -> bool:
+        """Dump the preamble into <name>.fmt using mylatexformat"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(dir=self.directory) as temp_dir:
+            temp_path = Path(temp_dir)
+            source = temp_path / f"{name}.tex"
+            source.write_text(preamble + BEGIN_DOCUMENT + "\n\\end{document}\n", encoding="utf-8")
+
+            cmd = [
+                pdflatex_path,
+                "-ini",
+                "-interaction=nonstopmode",
+                f"-jobname={name}",
+                "&pdflatex",
+                "mylatexformat.ltx",
+                source.name
+            ]
+            try:
+                result = run_tex(cmd, temp_path, timeout=60)
+            except (TeXLimitExceeded, OSError) as e:
+                logger.warning(f"Preamble format dump failed: {str(e)}")
+                return False
+
+            dumped = temp_path / f"{name}.fmt"
+            if result.returncode != 0 or not dumped.exists():
+                logger.warning(f"Preamble format dump failed for {name}, falling back to full compiles")
+                return False
+
+            shutil.move(str(dumped), self.directory / f"{name}.fmt")
+            logger.info(f"Dumped preamble format {name}")
+            return True
+
+    def invalidate(self, name: str) -> None:
+        """Drop a format that failed to load so it is not used again for a while"""
+        with self._lock:
+            self._mark_failed(name)
+        (self.directory / f"{name}.fmt").unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        try:
+            count = len(list(self.directory.glob("pre_*.fmt")))
+        except OSError:
+            count = 0
+        with self._lock:
+            return {
+                "enabled": PREAMBLE_FORMATS_ENABLED,
+                "formats": count,
+                "failed": len(self._failed),
+                "hits": self.hits,
+                "dumps": self.dumps,
+                "dump_failures": self.dump_failures,
+            }
+
+
+# Singleton format cache shared by the compiler
+preamble_formats = PreambleFormatCache()
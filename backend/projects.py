@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Multi-file project limits
+PROJECT_MAX_FILES = int(os.getenv("PROJECT_MAX_FILES", "64"))
+PROJECT_MAX_MB = int(os.getenv("PROJECT_MAX_MB", "8"))
+
+# Files a project may contain next to the main document
+PROJECT_EXTENSIONS = {".tex", ".bib", ".bst", ".sty", ".cls", ".cfg", ".txt", ".csv", ".dat"}
+_PATH_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+(?:/[A-Za-z0-9_\-]+)*\.[A-Za-z0-9]+$")
+# The main document is written as document.tex, so its outputs are reserved
+_RESERVED_STEM = "document"
+
+_INCLUDE_PATTERN = re.compile(r"\\include\s*\{([^}]+)\}")
+
+# Workspace file remembering which project files and chapter versions the last build used
+MANIFEST = ".project"
+
+
+class ProjectError(ValueError):
+    """A project file set that cannot be written into a build directory"""
+    pass
+
+
+def validate_project_files(files: Optional[Dict[str, str]]) -> None:
+    """
+    Check project file names and sizes
+
+    Raises:
+        ProjectError: If a path is unsafe or the project is too large
+    """
+    if not files:
+        return
+    if len(files) > PROJECT_MAX_FILES:
+        raise ProjectError(f"Projects are limited to {PROJECT_MAX_FILES} files")
+
+    total = 0
+    for path, content in files.items():
+        if not _PATH_PATTERN.match(path):
+            raise ProjectError(f"Invalid project file name: {path}")
+        if Path(path).suffix.lower() not in PROJECT_EXTENSIONS:
+            raise ProjectError(f"Unsupported project file type: {path}")
+        if "/" not in path and Path(path).stem == _RESERVED_STEM:
+            raise ProjectError(f"{path} is reserved for the main document")
+        total += len(content.encode("utf-8"))
+    if total > PROJECT_MAX_MB * 1024 * 1024:
+        raise ProjectError(f"Projects are limited to {PROJECT_MAX_MB} MB")
+
+
+def project_source(latex_content: str, files: Optional[Dict[str, str]]) -> str:
+    """The main document and every project file as one string, for cache keys"""
+    if not files:
+        return latex_content
+    parts = [latex_content]
+    for path in sorted(files):
+        parts.append(path)
+        parts.append(files[path])
+    return "\0".join(parts)
+
+
+def _hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def load_manifest(build_dir: Path) -> dict:
+    try:
+        return json.loads((build_dir / MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(build_dir: Path, manifest: dict) -> None:
+    try:
+        (build_dir / MANIFEST).write_text(json.dumps(manifest), encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"Could not save project manifest: {str(e)}")
+
+
+def write_project_files(build_dir: Path, files: Optional[Dict[str, str]], manifest: dict) -> None:
+    """
+    Write project files next to the main document, removing files an
+    earlier build of the same workspace wrote that are no longer in the project
+    """
+    files = files or {}
+    for stale in set(manifest.get("files", [])) - set(files):
+        (build_dir / stale).unlink(missing_ok=True)
+
+    for path, content in files.items():
+        target = build_dir / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Rewriting identical files would only bump mtimes
+        try:
+            if target.read_text(encoding="utf-8") == content:
+                continue
+        except OSError:
+            pass
+        target.write_text(content, encoding="utf-8")
+    manifest["files"] = sorted(files)
+
+
+def _strip_comments(latex_content: str) -> str:
+    return "\n".join(re.sub(r"(?<!\\)%.*", "", line) for line in latex_content.splitlines())
+
+
+def included_chapters(latex_content: str, files: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """Map each \\include{name} of the main document that is a project file to that file's content"""
+    chapters = {}
+    for name in _INCLUDE_PATTERN.findall(_strip_comments(latex_content)):
+        name = name.strip()
+        content = (files or {}).get(f"{name}.tex")
+        if content is not None:
+            chapters[name] = content
+    return chapters
+
+
+def changed_chapters(build_dir: Path, chapters: Dict[str, str], manifest: dict) -> Optional[List[str]]:
+    """
+    Chapters edited since the last build of this workspace, or None when
+    the whole document should be typeset (first build, nothing or
+    everything changed, or a chapter's .aux is missing)
+    """
+    if len(chapters) < 2:
+        return None
+    built = manifest.get("chapters", {})
+    changed = []
+    for name, content in chapters.items():
+        if built.get(name) != _hash(content):
+            changed.append(name)
+        elif not (build_dir / f"{name}.aux").exists():
+            # Excluded chapters are typeset from their .aux; without one the numbering is lost
+            return None
+    if not changed or len(changed) == len(chapters):
+        return None
+    return changed
+
+
+def record_chapters(manifest: dict, chapters: Dict[str, str], typeset: Optional[List[str]]) -> None:
+    """Remember the chapter versions a successful build typeset"""
+    built = {name: digest for name, digest in manifest.get("chapters", {}).items() if name in chapters}
+    for name, content in chapters.items():
+        if typeset is None or name in typeset:
+            built[name] = _hash(content)
+    manifest["chapters"] = built
+
+
+def include_only(chapters: List[str]) -> str:
+    return "\\includeonly{" + ",".join(chapters) + "}"
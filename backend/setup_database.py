@@ -50,6 +50,8 @@ def setup_database():
             title TEXT NOT NULL,
             content TEXT NOT NULL,
             latex_content TEXT,
+            files JSONB,  -- project files: relative path -> content
+            version INTEGER NOT NULL DEFAULT 1,  -- bumped on every update, used for If-Match
             user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
             created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
             updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
@@ -57,13 +59,21 @@ def setup_database():
         """,
         
         """
-        -- Create an index on user_id for faster queries
-        CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes(user_id);
+        -- Add the project files and version columns to tables created before they existed
+        ALTER TABLE notes ADD COLUMN IF NOT EXISTS files JSONB;
+        ALTER TABLE notes ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
         """,
         
         """
-        -- Create an index on created_at for sorting
-        CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(created_at DESC);
+        -- Create a composite index matching GET /notes: a user's notes, newest first,
+        -- paginated on (created_at, id)
+        CREATE INDEX IF NOT EXISTS idx_notes_user_created_id ON notes(user_id, created_at DESC, id DESC);
+        """,
+        
+        """
+        -- The composite index replaces the single-column indexes of earlier setups
+        DROP INDEX IF EXISTS idx_notes_user_id;
+        DROP INDEX IF EXISTS idx_notes_created_at;
         """,
         
         """
@@ -111,6 +121,98 @@ def setup_database():
         DROP TRIGGER IF EXISTS update_notes_updated_at ON notes;
         CREATE TRIGGER update_notes_updated_at BEFORE UPDATE
             ON notes FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+        """,
+        
+        """
+        -- Create a function to bump a note's version on every update, so clients
+        -- can make writes conditional on the version they loaded (If-Match).
+        -- A write may set a higher version itself: the API's write buffer does,
+        -- to keep the versions it handed out for saves it coalesced
+        CREATE OR REPLACE FUNCTION bump_note_version()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.version = GREATEST(NEW.version, OLD.version + 1);
+            RETURN NEW;
+        END;
+        $$ language 'plpgsql';
+        """,
+        
+        """
+        -- Create trigger to bump version on row updates
+        DROP TRIGGER IF EXISTS bump_notes_version ON notes;
+        CREATE TRIGGER bump_notes_version BEFORE UPDATE
+            ON notes FOR EACH ROW EXECUTE FUNCTION bump_note_version();
+        """,
+        
+        r"""
+        -- Strip LaTeX markup from text for full-text search: comments, environment
+        -- names, labels, references and package names go, as do command names;
+        -- the arguments of other commands (the words) stay
+        CREATE OR REPLACE FUNCTION strip_latex(src TEXT)
+        RETURNS TEXT AS $$
+            SELECT regexp_replace(
+                regexp_replace(
+                    regexp_replace(coalesce(src, ''), '(^|[^\\])%.*', '\1', 'gn'),
+                    '\\(begin|end|documentclass|usepackage|label|ref|eqref|cite|input|include|includegraphics|bibliography|bibliographystyle)\s*(\[[^]]*\])?\s*\{[^}]*\}', ' ', 'g'
+                ),
+                '\\([a-zA-Z@]+\*?|.)', ' ', 'g'
+            );
+        $$ LANGUAGE sql IMMUTABLE;
+        """,
+        
+        """
+        -- Add a search vector over title, content and latex_content (the latter only
+        -- where it differs from content), kept up to date by Postgres
+        ALTER TABLE notes ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', strip_latex(content)), 'B') ||
+            setweight(to_tsvector('english', CASE WHEN latex_content IS DISTINCT FROM content
+                                                  THEN strip_latex(latex_content) ELSE '' END), 'C')
+        ) STORED;
+        """,
+        
+        """
+        -- Create a GIN index for GET /notes/search
+        CREATE INDEX IF NOT EXISTS idx_notes_search ON notes USING GIN (search_vector);
+        """,
+        
+        """
+        -- Create a function for GET /notes/search: a page of a user's notes matching
+        -- a web-style query, best match first, with highlighted snippets (computed
+        -- for the page only; the text is HTML-escaped so only <mark> is markup)
+        CREATE OR REPLACE FUNCTION search_notes(p_user_id UUID, p_query TEXT, p_limit INTEGER DEFAULT 20, p_offset INTEGER DEFAULT 0)
+        RETURNS TABLE (
+            id UUID, title TEXT, user_id UUID, version INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE, updated_at TIMESTAMP WITH TIME ZONE,
+            rank REAL, snippet TEXT
+        ) AS $$
+            WITH query AS (
+                SELECT websearch_to_tsquery('english', p_query) AS q
+            ), page AS (
+                SELECT n.id, n.title, n.user_id, n.version, n.created_at, n.updated_at,
+                       coalesce(nullif(n.content, ''), n.latex_content) AS body,
+                       ts_rank_cd(n.search_vector, query.q) AS rank
+                FROM notes n, query
+                WHERE n.user_id = p_user_id AND n.search_vector @@ query.q
+                ORDER BY rank DESC, n.updated_at DESC, n.id DESC
+                LIMIT p_limit OFFSET p_offset
+            )
+            SELECT page.id, page.title, page.user_id, page.version, page.created_at, page.updated_at, page.rank,
+                   ts_headline(
+                       'english',
+                       replace(replace(replace(strip_latex(page.body), '&', '&amp;'), '<', '&lt;'), '>', '&gt;'),
+                       query.q,
+                       'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=8'
+                   )
+            FROM page, query
+            ORDER BY page.rank DESC, page.updated_at DESC, page.id DESC;
+        $$ LANGUAGE sql STABLE;
+        """,
+        
+        """
+        -- search_notes takes any user id: only the API (service role) may call it
+        REVOKE EXECUTE ON FUNCTION search_notes(UUID, TEXT, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+        GRANT EXECUTE ON FUNCTION search_notes(UUID, TEXT, INTEGER, INTEGER) TO service_role;
         """
     ]
     
@@ -130,6 +232,8 @@ def setup_database():
             title TEXT NOT NULL,
             content TEXT NOT NULL,
             latex_content TEXT,
+            files JSONB,  -- project files: relative path -> content
+            version INTEGER NOT NULL DEFAULT 1,  -- bumped on every update, used for If-Match
             user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
             created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
             updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
@@ -0,0 +1,147 @@
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+import logging
+
+from pdf_cache import get_cache_root
+
+logger = logging.getLogger(__name__)
+
+# Tectonic cache configuration
+TECTONIC_CACHE_DIR = os.getenv("TECTONIC_CACHE_DIR")
+TECTONIC_ONLY_CACHED = os.getenv("TECTONIC_ONLY_CACHED", "true").lower() == "true"
+TECTONIC_WARM_UP = os.getenv("TECTONIC_WARM_UP", "true").lower() == "true"
+# Seconds a measured cache size is reported before the directory is walked again
+TECTONIC_CACHE_SIZE_TTL = float(os.getenv("TECTONIC_CACHE_SIZE_TTL", "300"))
+
+# Reference document compiled at startup to fill the bundle cache and format
+WARM_UP_DOCUMENT = r"""\documentclass{article}
+\usepackage{amsmath}
+\usepackage{amssymb}
+\usepackage{graphicx}
+\usepackage{hyperref}
+\begin{document}
+\section{Warm-up}
+Inline math $\int_0^1 x^2\,dx = \frac{1}{3}$ and a reference to Section~\ref{sec:end}.
+\begin{align}
+  e^{i\pi} + 1 &= 0
+\end{align}
+\section{End}\label{sec:end}
+\end{document}
+"""
+
+# Tectonic reports bundle fetches as "note: downloading <file>"
+_DOWNLOAD_PATTERN = re.compile(r"downloading", re.IGNORECASE)
+# Failures in --only-cached mode caused by files missing from the cache
+_MISSING_RESOURCE_PATTERN = re.compile(r"not (?:found|available)|only.cached|couldn't find|failed to open", re.IGNORECASE)
+
+
+class TectonicCache:
+    """
+    Persistent Tectonic bundle/format cache on the latex_cache volume.
+
+    Tectonic's cache directory is pinned to the volume so it survives
+    machine restarts. Once the startup warm-up has filled it, compiles run
+    with --only-cached so they never block on the network.
+    """
+
+    def __init__(self, directory: Optional[str] = TECTONIC_CACHE_DIR, only_cached: bool = TECTONIC_ONLY_CACHED):
+        self._directory = Path(directory) if directory else None
+        self.only_cached_enabled = only_cached
+        self._lock = threading.Lock()
+        self._warm = False
+        self._refilling = False
+        self._size: Optional[Tuple[int, int, float]] = None  # (bytes, files, measured_at)
+
+        self.hits = 0
+        self.misses = 0
+        self.offline_misses = 0
+
+    @property
+    def directory(self) -> Path:
+        directory = self._directory or get_cache_root() / "tectonic"
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    @property
+    def warm(self) -> bool:
+        return self._warm
+
+    @property
+    def only_cached(self) -> bool:
+        """Use --only-cached once the cache is known to be populated"""
+        return self.only_cached_enabled and self._warm
+
+    def env(self) -> dict:
+        """Environment for Tectonic subprocesses with the cache directory pinned"""
+        return {**os.environ, "TECTONIC_CACHE_DIR": str(self.directory)}
+
+    def mark_warm(self) -> None:
+        with self._lock:
+            self._warm = True
+
+    def record(self, output: str) -> None:
+        """Count a compile as a cache miss if Tectonic had to download anything"""
+        with self._lock:
+            if _DOWNLOAD_PATTERN.search(output or ""):
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def is_missing_resource(self, output: str) -> bool:
+        """Whether an --only-cached failure was caused by an uncached file"""
+        return bool(_MISSING_RESOURCE_PATTERN.search(output or ""))
+
+    def begin_refill(self) -> bool:
+        """Claim the single background refill slot; False if one is already running"""
+        with self._lock:
+            self.offline_misses += 1
+            if self._refilling:
+                return False
+            self._refilling = True
+            return True
+
+    def end_refill(self) -> None:
+        with self._lock:
+            self._refilling = False
+
+    def _measure(self) -> Tuple[int, int]:
+        """(bytes, files) of the cache directory, walked at most every TECTONIC_CACHE_SIZE_TTL seconds"""
+        with self._lock:
+            if self._size is not None and time.monotonic() - self._size[2] < TECTONIC_CACHE_SIZE_TTL:
+                return self._size[0], self._size[1]
+
+        size = 0
+        files = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+                    files += 1
+                except OSError:
+                    continue
+        with self._lock:
+            self._size = (size, files, time.monotonic())
+        return size, files
+
+    def stats(self) -> dict:
+        """Cache counters; walks the directory now and then, so call it off the event loop"""
+        size, files = self._measure()
+        with self._lock:
+            return {
+                "directory": str(self.directory),
+                "warm": self._warm,
+                "only_cached": self.only_cached,
+                "size_bytes": size,
+                "files": files,
+                "hits": self.hits,
+                "misses": self.misses,
+                "offline_misses": self.offline_misses,
+            }
+
+
+# Singleton Tectonic cache shared by the compiler
+tectonic_cache = TectonicCache()
@@ -0,0 +1,180 @@
+import os
+import signal
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+import logging
+
+try:
+    import resource
+except ImportError:  # Windows development machines
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Resource limits for every TeX subprocess
+TEX_TIMEOUT = int(os.getenv("TEX_TIMEOUT", "30"))
+TEX_CPU_SECONDS = int(os.getenv("TEX_CPU_SECONDS", "30"))
+TEX_MEMORY_MB = int(os.getenv("TEX_MEMORY_MB", "768"))
+TEX_MAX_FILE_MB = int(os.getenv("TEX_MAX_FILE_MB", "64"))
+TEX_OUTPUT_LIMIT_KB = int(os.getenv("TEX_OUTPUT_LIMIT_KB", "64"))
+TEX_NICE = int(os.getenv("TEX_NICE", "10"))
+
+# Messages printed when an allocation fails under the address-space limit
+_MEMORY_MARKERS = ("memory allocation of", "out of memory", "Cannot allocate memory", "I can't allocate memory")
+
+
+class TeXLimitExceeded(Exception):
+    """A TeX process was stopped by one of the resource limits"""
+
+    def __init__(self, limit: str, message: str):
+        self.limit = limit
+        super().__init__(message)
+
+
+@dataclass
+class TeXRun:
+    """Outcome of a TeX process, with output capped to TEX_OUTPUT_LIMIT_KB"""
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+def read_capped(path: Path, limit: int = TEX_OUTPUT_LIMIT_KB * 1024) -> str:
+    """
+    Read at most limit bytes of a file, keeping its beginning and end:
+    TeX reports the first error early and a summary at the end
+    """
+    with open(path, "rb") as f:
+        return _read_capped(f, limit)
+
+
+def _read_capped(f, limit: int) -> str:
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    if size <= limit:
+        data = f.read()
+    else:
+        half = limit // 2
+        head = f.read(half)
+        f.seek(size - half)
+        data = head + f"\n[... {size - 2 * half} bytes of output truncated ...]\n".encode() + f.read()
+    return data.decode("utf-8", errors="replace")
+
+
+def _limits() -> List[tuple]:
+    if resource is None:
+        return []
+    limits = []
+    if TEX_CPU_SECONDS > 0:
+        # SIGXCPU at the soft limit, SIGKILL at the hard one
+        limits.append((resource.RLIMIT_CPU, (TEX_CPU_SECONDS, TEX_CPU_SECONDS + 5)))
+    if TEX_MEMORY_MB > 0 and hasattr(resource, "RLIMIT_AS"):
+        limits.append((resource.RLIMIT_AS, (TEX_MEMORY_MB * 1024 * 1024,) * 2))
+    if TEX_MAX_FILE_MB > 0:
+        limits.append((resource.RLIMIT_FSIZE, (TEX_MAX_FILE_MB * 1024 * 1024,) * 2))
+    return limits
+
+
+def _apply_limits_in_child() -> None:
+    """preexec_fn fallback for platforms without prlimit (macOS)"""
+    for limit, value in _limits():
+        try:
+            resource.setrlimit(limit, value)
+        except (ValueError, OSError):
+            pass
+    try:
+        os.nice(TEX_NICE)
+    except OSError:
+        pass
+
+
+def _apply_limits(pid: int) -> None:
+    """Limit an already started process; avoids preexec_fn in a threaded server"""
+    for limit, value in _limits():
+        try:
+            resource.prlimit(pid, limit, value)
+        except (ValueError, OSError) as e:
+            logger.debug(f"Could not set rlimit {limit} on {pid}: {str(e)}")
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, TEX_NICE)
+    except OSError:
+        pass
+
+
+def _kill_group(process: subprocess.Popen) -> None:
+    """Kill the process and everything it started"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        process.kill()
+    process.wait()
+
+
+def _limit_hit(returncode: int, output: str) -> Optional[TeXLimitExceeded]:
+    """Recognise a process that died because of a resource limit"""
+    if returncode == -signal.SIGXCPU:
+        return TeXLimitExceeded("cpu", f"Compilation exceeded the CPU time limit ({TEX_CPU_SECONDS} seconds)")
+    if returncode == -signal.SIGKILL:
+        # The hard CPU limit or the kernel's OOM killer
+        return TeXLimitExceeded("killed", "Compilation was killed after exceeding its CPU or memory limit")
+    if returncode == -signal.SIGXFSZ:
+        return TeXLimitExceeded("file_size", f"Compilation exceeded the output file size limit ({TEX_MAX_FILE_MB} MB)")
+    if returncode != 0 and any(marker in output for marker in _MEMORY_MARKERS):
+        return TeXLimitExceeded("memory", f"Compilation exceeded the memory limit ({TEX_MEMORY_MB} MB)")
+    return None
+
+
+def run_tex(
+    cmd: List[str],
+    cwd: Path,
+    env: Optional[dict] = None,
+    timeout: int = TEX_TIMEOUT
+) -> TeXRun:
+    """
+    Run a TeX engine under CPU, address-space and file-size limits, at a
+    lower priority, in its own process group, with output captured to
+    temporary files and read back capped
+
+    Raises:
+        TeXLimitExceeded: If the process hit the timeout or a resource limit
+        OSError: If the engine cannot be started
+    """
+    use_prlimit = resource is not None and hasattr(resource, "prlimit")
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=stdout,
+            stderr=stderr,
+            cwd=cwd,
+            env=env,
+            start_new_session=True,
+            preexec_fn=None if use_prlimit or resource is None else _apply_limits_in_child
+        )
+        if use_prlimit:
+            _apply_limits(process.pid)
+
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill_group(process)
+            raise TeXLimitExceeded("timeout", f"Compilation timed out ({timeout} seconds)")
+        finally:
+            # Helpers the engine started (e.g. mktexpk) must not outlive it
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        limit = TEX_OUTPUT_LIMIT_KB * 1024
+        run = TeXRun(returncode=returncode, stdout=_read_capped(stdout, limit), stderr=_read_capped(stderr, limit))
+
+    hit = _limit_hit(run.returncode, run.stdout + run.stderr)
+    if hit is not None:
+        logger.warning(f"{Path(cmd[0]).name} hit the {hit.limit} limit")
+        raise hit
+    return run
@@ -0,0 +1,203 @@
+import hashlib
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+import logging
+
+from pdf_cache import get_cache_root
+
+logger = logging.getLogger(__name__)
+
+# Build workspace configuration
+WORKSPACES_ENABLED = os.getenv("WORKSPACES_ENABLED", "true").lower() == "true"
+WORKSPACES_MAX = int(os.getenv("WORKSPACES_MAX", "64"))
+WORKSPACES_MAX_MB = int(os.getenv("WORKSPACES_MAX_MB", "256"))
+
+PREAMBLE_MARKER = ".preamble"
+
+
+def _directory_size(path: Path) -> int:
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+    return size
+
+
+class WorkspaceManager:
+    """
+    Persistent per-note build directories.
+
+    Keeping .aux/.toc/.out between compiles of the same note lets a single
+    pass converge most of the time. Each workspace is locked while in use,
+    wiped when the preamble changes, and the least recently used ones are
+    evicted once the count or total size exceeds its budget. Each workspace
+    is measured when its build finishes, so checking the budget doesn't
+    walk the others.
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        max_workspaces: int = WORKSPACES_MAX,
+        max_bytes: int = WORKSPACES_MAX_MB * 1024 * 1024
+    ):
+        self._root = root
+        self.max_workspaces = max_workspaces
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._locks = {}  # workspace key -> [lock, threads holding or waiting for it]
+        self._sizes: Optional[Dict[str, int]] = None  # workspace key -> bytes after its last build, loaded lazily
+
+        self.reuses = 0
+        self.rebuilds = 0
+        self.evictions = 0
+
+    @property
+    def directory(self) -> Path:
+        return (self._root or get_cache_root()) / "workspaces"
+
+    def _key(self, user_id: str, note_id: str) -> str:
+        return hashlib.sha256(f"{user_id}:{note_id}".encode("utf-8")).hexdigest()[:32]
+
+    @contextmanager
+    def _locked(self, key: str, blocking: bool = True) -> Iterator[bool]:
+        """
+        Hold a workspace's lock (yields False if not blocking and it is
+        taken); its entry goes away with its last user
+        """
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        acquired = entry[0].acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                entry[0].release()
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def _load_sizes(self) -> None:
+        """Measure the workspaces left by a previous process, once"""
+        if self._sizes is not None:
+            return
+        sizes = {}
+        try:
+            for path in self.directory.iterdir():
+                if path.is_dir():
+                    sizes[path.name] = _directory_size(path)
+        except OSError as e:
+            logger.warning(f"Could not scan workspace directory: {str(e)}")
+        with self._lock:
+            if self._sizes is None:
+                self._sizes = sizes
+
+    def _clear(self, path: Path) -> None:
+        for child in path.iterdir():
+            if child.is_dir():
+                shutil.rmtree(child, ignore_errors=True)
+            else:
+                child.unlink(missing_ok=True)
+
+    @contextmanager
+    def acquire(self, user_id: str, note_id: str, preamble_hash: str) -> Iterator[Path]:
+        """
+        Lock and yield the build directory for a note, starting from a clean
+        directory if it is new or its preamble changed
+        """
+        key = self._key(user_id, note_id)
+        path = self.directory / key
+
+        with self._locked(key):
+            path.mkdir(parents=True, exist_ok=True)
+            marker = path / PREAMBLE_MARKER
+            try:
+                previous = marker.read_text(encoding="utf-8")
+            except OSError:
+                previous = None
+
+            if previous != preamble_hash:
+                # New workspace or changed preamble: intermediate files are no longer valid
+                self._clear(path)
+                marker.write_text(preamble_hash, encoding="utf-8")
+                with self._lock:
+                    self.rebuilds += 1
+            else:
+                with self._lock:
+                    self.reuses += 1
+
+            os.utime(path)
+            try:
+                yield path
+            finally:
+                # The workspace is still ours, so nothing changes it while it is measured
+                size = _directory_size(path)
+                self._load_sizes()
+                with self._lock:
+                    self._sizes[key] = size
+
+        self._evict(exclude=key)
+
+    def reset(self, path: Path) -> None:
+        """Discard intermediate files after a failed build (caller holds the workspace)"""
+        self._clear(path)
+
+    def _evict(self, exclude: str) -> None:
+        """Remove least recently used workspaces beyond the count/size budget"""
+        with self._lock:
+            count = len(self._sizes)
+            total = sum(self._sizes.values())
+        if count <= self.max_workspaces and total <= self.max_bytes:
+            return
+
+        try:
+            entries = sorted(
+                (path.stat().st_mtime, path) for path in self.directory.iterdir() if path.is_dir()
+            )
+        except OSError:
+            return
+        with self._lock:
+            # Forget workspaces removed behind our back
+            present = {path.name for _, path in entries}
+            for key in [key for key in self._sizes if key not in present]:
+                count -= 1
+                total -= self._sizes.pop(key)
+
+        for _, path in entries:
+            if count <= self.max_workspaces and total <= self.max_bytes:
+                break
+            if path.name == exclude:
+                continue
+            with self._locked(path.name, blocking=False) as acquired:
+                # Skip workspaces that are being compiled right now
+                if not acquired:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                total -= self._sizes.pop(path.name, 0)
+                self.evictions += 1
+            count -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": WORKSPACES_ENABLED,
+                "workspaces": len(self._sizes) if self._sizes is not None else None,
+                "bytes": sum(self._sizes.values()) if self._sizes is not None else None,
+                "reuses": self.reuses,
+                "rebuilds": self.rebuilds,
+                "evictions": self.evictions,
+            }
+
+
+# Singleton workspace manager shared by the compiler
+workspaces = WorkspaceManager()
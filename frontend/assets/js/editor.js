@@ -18,6 +18,21 @@ const utils = {
     };
   },
 
+  // Edit ops turning base into text for PATCH /notes/{id}: one
+  // [start, delete, insert] splice around the common prefix and suffix
+  textOps: (base, text) => {
+    if (base === text) return [];
+    let start = 0;
+    const max = Math.min(base.length, text.length);
+    while (start < max && base.charCodeAt(start) === text.charCodeAt(start)) start++;
+    // Don't split a surrogate pair
+    if (start > 0 && base.charCodeAt(start - 1) >= 0xD800 && base.charCodeAt(start - 1) <= 0xDBFF) start--;
+    let end = 0;
+    while (end < max - start && base.charCodeAt(base.length - 1 - end) === text.charCodeAt(text.length - 1 - end)) end++;
+    if (end > 0 && base.charCodeAt(base.length - end) >= 0xDC00 && base.charCodeAt(base.length - end) <= 0xDFFF) end--;
+    return [[start, base.length - end - start, text.slice(start, text.length - end)]];
+  },
+
   // Format date for display
   formatDate: (dateString) => {
     if (!dateString) return '';
@@ -224,13 +239,22 @@ function latexEditor() {
     // State variables
     latexContent: '',
     pdfUrl: null,
+    pdfEtag: null,
     compiling: false,
+    downloading: false,
     saving: false,
     user: null,
     status: null,
     notes: [],
+    notesCursor: null, // next_cursor of the last loaded page of notes
+    notesQuery: '', // Search box of the notes modal
+    searchResults: [],
+    searchCursor: null, // next_cursor of the last loaded page of search results
     currentNoteId: null,
     currentNoteTitle: '',
+    projectFiles: null, // Other files of a multi-file note (path -> content)
+    currentNoteVersion: null, // Version of the note last loaded or saved, sent as If-Match
+    savedNote: null, // Title and bodies at currentNoteVersion, the base autosave patches against
     showNotesModal: false,
     showSaveModal: false,
 
@@ -246,6 +270,7 @@ function latexEditor() {
 
     // Debounced auto-save function
     debouncedAutoSave: null,
+    debouncedSearch: null,
 
     // Initialize the component
     async init() {
@@ -266,6 +291,8 @@ function latexEditor() {
         }
       }, 2000);
 
+      this.debouncedSearch = utils.debounce(() => this.searchNotes(), 300);
+
       // Set up autocomplete keyboard handling
       document.addEventListener('keydown', (e) => this.handleGlobalKeyDown(e));
 
@@ -277,8 +304,15 @@ function latexEditor() {
         } else if (event === 'SIGNED_OUT') {
           this.user = null;
           this.notes = [];
+          this.notesCursor = null;
+          this.notesQuery = '';
+          this.searchResults = [];
+          this.searchCursor = null;
           this.currentNoteId = null;
           this.currentNoteTitle = '';
+          this.projectFiles = null;
+          this.currentNoteVersion = null;
+          this.savedNote = null;
         }
       });
 
@@ -535,19 +569,32 @@ function latexEditor() {
           throw new Error('Authentication required. Please log in.');
         }
 
+        const headers = {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${session.access_token}`
+        };
+        // Let the server answer 304 if the PDF we are showing is still current
+        if (this.pdfUrl && this.pdfEtag) {
+          headers['If-None-Match'] = this.pdfEtag;
+        }
+
         // Call the backend compile/pdf endpoint
         const response = await fetch(`${window.API_BASE_URL}/compile/pdf`, {
           method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-            'Authorization': `Bearer ${session.access_token}`
-          },
+          headers,
           body: JSON.stringify({
-            latex_content: this.latexContent
+            latex_content: this.latexContent,
+            note_id: this.currentNoteId,
+            files: this.projectFiles,
+            // Fast single-pass draft; downloads ask for the final PDF
+            mode: 'preview'
           })
         });
 
-        if (response.ok) {
+        if (response.status === 304) {
+          // Unchanged PDF, keep the current preview
+          this.showStatus('LaTeX compiled successfully!', 'success');
+        } else if (response.ok) {
           // Get the PDF blob from the response
           const pdfBlob = await response.blob();
           
@@ -558,6 +605,7 @@ function latexEditor() {
           
           // Create new blob URL for PDF preview
           this.pdfUrl = URL.createObjectURL(pdfBlob);
+          this.pdfEtag = response.headers.get('ETag');
           
           this.showStatus('LaTeX compiled successfully!', 'success');
         } else {
@@ -583,6 +631,60 @@ function latexEditor() {
       }
     },
 
+    // Compile the final-quality PDF and download it
+    async downloadPdf() {
+      if (!this.latexContent.trim() || !this.user) {
+        return;
+      }
+
+      this.downloading = true;
+
+      try {
+        const session = await authHelpers.getCurrentSession();
+        if (!session?.access_token) {
+          throw new Error('Authentication required. Please log in.');
+        }
+
+        const response = await fetch(`${window.API_BASE_URL}/compile/pdf`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${session.access_token}`
+          },
+          body: JSON.stringify({
+            latex_content: this.latexContent,
+            note_id: this.currentNoteId,
+            files: this.projectFiles,
+            mode: 'final',
+            priority: 'bulk'
+          })
+        });
+
+        if (!response.ok) {
+          const errorText = await response.text();
+          let errorMessage = 'Compilation failed';
+          try {
+            errorMessage = JSON.parse(errorText).detail || errorMessage;
+          } catch {
+            errorMessage = errorText || errorMessage;
+          }
+          throw new Error(errorMessage);
+        }
+
+        const url = URL.createObjectURL(await response.blob());
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = `${this.currentNoteTitle || 'document'}.pdf`;
+        link.click();
+        URL.revokeObjectURL(url);
+      } catch (error) {
+        console.error('Download error:', error);
+        this.showStatus(`Download failed: ${error.message}`, 'error');
+      } finally {
+        this.downloading = false;
+      }
+    },
+
     // Clear the editor / Create new note
     clearEditor() {
       console.log('Clear editor function called!');
@@ -601,6 +703,9 @@ function latexEditor() {
       }
       
       this.currentNoteId = null;
+      this.projectFiles = null;
+      this.currentNoteVersion = null;
+      this.savedNote = null;
       this.status = null;
       
       // Show helpful message for new note
@@ -701,13 +806,19 @@ Start editing this content to create your own LaTeX document!
       try {
         if (this.currentNoteId) {
           // Update existing note
-          await dbHelpers.updateNote(this.currentNoteId, title, this.latexContent, this.latexContent);
+          const updated = await dbHelpers.updateNote(
+            this.currentNoteId, title, this.latexContent, this.latexContent, this.currentNoteVersion
+          );
+          this.currentNoteVersion = updated.version;
+          this.savedNote = { title, content: updated.content, latex_content: updated.latex_content };
           this.currentNoteTitle = title;
           this.showStatus('Note updated successfully!', 'success');
         } else {
           // Create new note
           const newNote = await dbHelpers.saveNote(title, this.latexContent, this.latexContent);
           this.currentNoteId = newNote.id;
+          this.currentNoteVersion = newNote.version;
+          this.savedNote = { title, content: newNote.content, latex_content: newNote.latex_content };
           this.currentNoteTitle = title;
           this.showStatus('Note saved successfully!', 'success');
         }
@@ -727,9 +838,35 @@ Start editing this content to create your own LaTeX document!
       if (!this.user || !this.latexContent.trim() || !this.currentNoteId) return;
 
       try {
-        await dbHelpers.updateNote(this.currentNoteId, this.currentNoteTitle, this.latexContent, this.latexContent);
+        if (this.savedNote && this.currentNoteVersion !== null) {
+          // Send only what changed since the saved version
+          const saving = { title: this.currentNoteTitle, content: this.latexContent, latex_content: this.latexContent };
+          const patch = {
+            content: utils.textOps(this.savedNote.content || '', saving.content),
+            latex_content: utils.textOps(this.savedNote.latex_content || '', saving.latex_content)
+          };
+          if (saving.title !== this.savedNote.title) patch.title = saving.title;
+          if (!patch.content.length && !patch.latex_content.length && patch.title === undefined) return;
+
+          // Deferred: the server coalesces autosaves into fewer database writes
+          const patched = await dbHelpers.patchNote(this.currentNoteId, this.currentNoteVersion, patch, true);
+          this.currentNoteVersion = patched.version;
+          this.savedNote = saving;
+        } else {
+          const updated = await dbHelpers.updateNote(
+            this.currentNoteId, this.currentNoteTitle, this.latexContent, this.latexContent, this.currentNoteVersion
+          );
+          this.currentNoteVersion = updated.version;
+          this.savedNote = { title: updated.title, content: updated.content, latex_content: updated.latex_content };
+        }
       } catch (error) {
         console.error('Auto-save error:', error);
+        if (error.rejected) {
+          // The editor still holds the text the server turned down; don't let a reload lose it
+          this.showStatus('This note was changed elsewhere and your recent edits were not saved. Copy them before reloading.', 'error');
+        } else if (error.status === 409 || error.status === 412) {
+          this.showStatus('This note was changed elsewhere. Reload it before saving again.', 'error');
+        }
       }
     },
 
@@ -738,19 +875,84 @@ Start editing this content to create your own LaTeX document!
       if (!this.user) return;
 
       try {
-        this.notes = await dbHelpers.getUserNotes();
+        const page = await dbHelpers.getUserNotesPage();
+        this.notes = page.notes;
+        this.notesCursor = page.next_cursor;
       } catch (error) {
         console.error('Failed to load notes:', error);
         this.showStatus('Failed to load notes. Please try again.', 'error');
         this.notes = []; // Ensure notes is always an array
+        this.notesCursor = null;
+      }
+    },
+
+    // Append the next page of notes
+    async loadMoreNotes() {
+      if (!this.user || !this.notesCursor) return;
+
+      try {
+        const page = await dbHelpers.getUserNotesPage(this.notesCursor);
+        this.notes = this.notes.concat(page.notes);
+        this.notesCursor = page.next_cursor;
+      } catch (error) {
+        console.error('Failed to load more notes:', error);
+        this.showStatus('Failed to load more notes. Please try again.', 'error');
+      }
+    },
+
+    // Search the user's notes for the modal's search box
+    async searchNotes() {
+      const query = this.notesQuery.trim();
+      if (!this.user || !query) {
+        this.searchResults = [];
+        this.searchCursor = null;
+        return;
+      }
+
+      try {
+        const page = await dbHelpers.searchNotes(query);
+        // Drop results of a query the user already changed
+        if (query !== this.notesQuery.trim()) return;
+        this.searchResults = page.results;
+        this.searchCursor = page.next_cursor;
+      } catch (error) {
+        console.error('Failed to search notes:', error);
+        this.showStatus('Failed to search notes. Please try again.', 'error');
+      }
+    },
+
+    // Append the next page of search results
+    async loadMoreSearchResults() {
+      const query = this.notesQuery.trim();
+      if (!this.user || !query || !this.searchCursor) return;
+
+      try {
+        const page = await dbHelpers.searchNotes(query, this.searchCursor);
+        this.searchResults = this.searchResults.concat(page.results);
+        this.searchCursor = page.next_cursor;
+      } catch (error) {
+        console.error('Failed to load more search results:', error);
+        this.showStatus('Failed to load more search results. Please try again.', 'error');
       }
     },
 
     // Load a specific note
     async loadNote(note) {
+      // The notes list only has summaries; fetch the bodies
+      if (note.content === undefined) {
+        try {
+          note = await dbHelpers.getNote(note.id);
+        } catch (error) {
+          this.showStatus(`Failed to load note: ${error.message}`, 'error');
+          return;
+        }
+      }
       this.latexContent = note.content || note.latex_content || '';
       this.currentNoteId = note.id;
       this.currentNoteTitle = note.title;
+      this.projectFiles = note.files || null;
+      this.currentNoteVersion = note.version ?? null;
+      this.savedNote = { title: note.title, content: note.content, latex_content: note.latex_content };
       
       // Clean up previous PDF URL to prevent memory leaks
       if (this.pdfUrl) {
@@ -770,6 +972,8 @@ Start editing this content to create your own LaTeX document!
       try {
         await dbHelpers.deleteNote(noteId);
         
+        this.searchResults = this.searchResults.filter(result => result.id !== noteId);
+
         // Clear editor if current note was deleted
         if (this.currentNoteId === noteId) {
           this.clearEditor();
@@ -134,6 +134,16 @@ const getAuthHeaders = async () => {
   };
 };
 
+// Error for a failed note write; a 409 after deferred saves carries the
+// changes the server could not write in error.rejected
+const noteWriteError = (errorData, status, fallback) => {
+  const detail = errorData.detail;
+  const error = new Error((detail && detail.message) || detail || fallback);
+  error.status = status;
+  if (detail && detail.rejected) error.rejected = detail.rejected;
+  return error;
+};
+
 // Database helper functions - Updated to use backend API
 const dbHelpers = {
   // Save a LaTeX note
@@ -162,10 +172,14 @@ const dbHelpers = {
     }
   },
 
-  // Update a LaTeX note
-  updateNote: async (noteId, title, content, latexContent = null) => {
+  // Update a LaTeX note; with a version the update only applies if nobody
+  // changed the note since that version was loaded
+  updateNote: async (noteId, title, content, latexContent = null, version = null) => {
     try {
       const headers = await getAuthHeaders();
+      if (version !== null && version !== undefined) {
+        headers['If-Match'] = `"${version}"`;
+      }
       const updateData = {};
       if (title !== undefined) updateData.title = title;
       if (content !== undefined) updateData.content = content;
@@ -179,7 +193,7 @@ const dbHelpers = {
       
       if (!response.ok) {
         const errorData = await response.json();
-        throw new Error(errorData.detail || 'Failed to update note');
+        throw noteWriteError(errorData, response.status, 'Failed to update note');
       }
       
       return await response.json();
@@ -189,11 +203,40 @@ const dbHelpers = {
     }
   },
 
-  // Get user's notes
-  getUserNotes: async () => {
+  // Apply text edits to a note saved at baseVersion; patch holds
+  // [start, delete, insert] ops per body (and optionally a new title).
+  // Returns only the new version; a note changed meanwhile fails with 409.
+  // With defer the server buffers the edits and writes them a little later
+  patchNote: async (noteId, baseVersion, patch, defer = false) => {
     try {
       const headers = await getAuthHeaders();
-      const response = await fetch(`${window.API_BASE_URL}/notes`, {
+      const query = defer ? '?defer=true' : '';
+      const response = await fetch(`${window.API_BASE_URL}/notes/${noteId}${query}`, {
+        method: 'PATCH',
+        headers,
+        body: JSON.stringify({ base_version: baseVersion, ...patch })
+      });
+      
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw noteWriteError(errorData, response.status, 'Failed to patch note');
+      }
+      
+      return await response.json();
+    } catch (error) {
+      console.error('Patch note error:', error.message);
+      throw error;
+    }
+  },
+
+  // Get one page of the user's notes as summaries (no content); pass the
+  // previous page's next_cursor to get the following page
+  getUserNotesPage: async (cursor = null) => {
+    try {
+      const headers = await getAuthHeaders();
+      const params = new URLSearchParams({ fields: 'summary' });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`${window.API_BASE_URL}/notes?${params}`, {
         method: 'GET',
         headers
       });
@@ -203,14 +246,43 @@ const dbHelpers = {
         throw new Error(errorData.detail || 'Failed to fetch notes');
       }
       
-      const result = await response.json();
-      return result.notes;
+      return await response.json();
     } catch (error) {
       console.error('Get user notes error:', error.message);
       throw error;
     }
   },
 
+  // Search the user's notes; returns a page of results (best match first,
+  // with an HTML snippet) and the next_cursor for the following page
+  searchNotes: async (query, cursor = null) => {
+    try {
+      const headers = await getAuthHeaders();
+      const params = new URLSearchParams({ q: query });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`${window.API_BASE_URL}/notes/search?${params}`, {
+        method: 'GET',
+        headers
+      });
+      
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Failed to search notes');
+      }
+      
+      return await response.json();
+    } catch (error) {
+      console.error('Search notes error:', error.message);
+      throw error;
+    }
+  },
+
+  // Get the first page of the user's notes
+  getUserNotes: async () => {
+    const result = await dbHelpers.getUserNotesPage();
+    return result.notes;
+  },
+
   // Get a specific note
   getNote: async (noteId) => {
     try {